@@ -0,0 +1,49 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db.models import Prefetch
+from rest_framework.renderers import JSONRenderer
+
+from .models import Module, Task
+
+CATALOG_VERSION_KEY = 'module_catalog_version'
+CATALOG_TIMEOUT = 24 * 3600
+
+
+def catalog_queryset():
+    """Live modules with their live tasks and the tasks' personas, in three queries."""
+    return Module.objects.filter(is_deleted=False).prefetch_related(
+        Prefetch('tasks', queryset=Task.objects.filter(is_deleted=False).select_related('persona')))
+
+
+def catalog_version():
+    # Seeded from the clock in nanoseconds, so a version key lost from the
+    # cache never comes back as a number an old cached catalog was stored
+    # under, even after several bumps within the same second
+    cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+    return cache.get(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    """Invalidate the cached catalog. Called by the model signals and after bulk writes."""
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        catalog_version()
+
+
+def load_catalog():
+    """
+    The serialized module listing as (body, etag), cached per catalog version
+    so a warm listing costs no queries.
+    """
+    from .serializers import ModuleSerializer
+
+    key = f"module_catalog_{catalog_version()}"
+    catalog = cache.get(key)
+    if catalog is None:
+        body = JSONRenderer().render(ModuleSerializer(catalog_queryset(), many=True).data)
+        catalog = (body, f'"{hashlib.md5(body).hexdigest()}"')
+        cache.set(key, catalog, timeout=CATALOG_TIMEOUT)
+    return catalog
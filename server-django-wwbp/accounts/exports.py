@@ -0,0 +1,350 @@
+import csv
+import io
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+import pytz
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from config.routers import replica_reads, use_replica
+from config.storage import get_storage
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_TIMEZONE = 'US/Eastern'
+SHARD_SIZES = {
+    'day': timedelta(days=1),
+    'week': timedelta(days=7),
+}
+EXPORT_FORMATS = ('csv', 'parquet')
+PARQUET_ROW_GROUP_SIZE = 10000
+AUDIO_COPY_CHUNK_SIZE = 256 * 1024
+AUDIO_MANIFEST_HEADER = ['Transcript ID', 'Session ID', 'Message ID', 'Audio Link', 'Archive Path', 'Status']
+CSV_HEADER = ['Session ID', 'Username', 'Module Name', 'Task Name', 'Message ID',
+              'User Message', 'Bot Message', 'Created At (UTC)', 'Has Audio', 'Audio Link']
+PARQUET_SCHEMA = pa.schema([
+    ('session_id', pa.int64()),
+    ('user_id', pa.int64()),
+    ('username', pa.string()),
+    ('module_id', pa.int64()),
+    ('module_name', pa.string()),
+    ('task_id', pa.int64()),
+    ('task_name', pa.string()),
+    ('transcript_id', pa.int64()),
+    ('message_id', pa.int64()),
+    ('user_message', pa.string()),
+    ('bot_message', pa.string()),
+    ('created_at', pa.timestamp('us', tz='UTC')),
+    ('session_created_at', pa.timestamp('us', tz='UTC')),
+    ('has_audio', pa.bool_()),
+    ('audio_link', pa.string()),
+    ('prompt_tokens', pa.int64()),
+    ('completion_tokens', pa.int64()),
+    ('total_tokens', pa.int64()),
+]) if pa else None
+
+
+def shard_date_range(start_date, end_date, shard='day'):
+    """
+    Split an inclusive US/Eastern date range into (label, start_utc, end_utc)
+    shards of one day or one week each.
+    """
+    if shard not in SHARD_SIZES:
+        raise ValueError(f"Unknown shard size: {shard}")
+    step = SHARD_SIZES[shard]
+    etc = pytz.timezone(EXPORT_TIMEZONE)
+    current = datetime.strptime(start_date, '%Y-%m-%d')
+    last = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
+
+    shards = []
+    while current < last:
+        shard_end = min(current + step, last)
+        shards.append((
+            current.strftime('%Y-%m-%d'),
+            etc.localize(current).astimezone(pytz.utc),
+            etc.localize(shard_end).astimezone(pytz.utc),
+        ))
+        current = shard_end
+    return shards
+
+
+def transcripts_in_range(module_id, start_utc, end_utc):
+    Transcript = apps.get_model('langchain_stream', 'Transcript')
+    return Transcript.objects.filter(
+        session__module_id=module_id,
+        created_at__gte=start_utc,
+        created_at__lt=end_utc,
+    ).select_related('session__user', 'session__task', 'session__module').order_by('id').iterator(chunk_size=2000)
+
+
+def csv_row(conversation):
+    return [
+        conversation.session.id,
+        conversation.session.user.username,
+        conversation.session.module.name if conversation.session.module else '',
+        conversation.session.task.title if conversation.session.task else '',
+        conversation.message_id,
+        conversation.user_message,
+        conversation.bot_message,
+        conversation.created_at,
+        conversation.has_audio,
+        conversation.audio_link
+    ]
+
+
+def parquet_record(conversation):
+    session = conversation.session
+    return {
+        'session_id': session.id,
+        'user_id': session.user_id,
+        'username': session.user.username,
+        'module_id': session.module_id,
+        'module_name': session.module.name if session.module else None,
+        'task_id': session.task_id,
+        'task_name': session.task.title if session.task else None,
+        'transcript_id': conversation.id,
+        'message_id': conversation.message_id,
+        'user_message': conversation.user_message,
+        'bot_message': conversation.bot_message,
+        'created_at': conversation.created_at,
+        'session_created_at': session.created_at,
+        'has_audio': conversation.has_audio,
+        'audio_link': conversation.audio_link,
+        'prompt_tokens': session.prompt_tokens,
+        'completion_tokens': session.completion_tokens,
+        'total_tokens': session.total_tokens,
+    }
+
+
+def check_export_format(export_format):
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(
+            f"Unknown export format '{export_format}'. Use one of: {', '.join(EXPORT_FORMATS)}.")
+    if export_format == 'parquet' and pa is None:
+        raise ValueError("Parquet export requires the pyarrow package.")
+
+
+def _init_export_worker():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    import django
+    django.setup()
+
+
+def _write_csv_shard(conversations, path):
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        for conversation in conversations:
+            writer.writerow(csv_row(conversation))
+            count += 1
+    return count
+
+
+def _write_parquet_shard(conversations, path):
+    # Row groups are flushed as the iterator advances, so a shard never sits in memory whole
+    count = 0
+    batch = []
+    with pq.ParquetWriter(path, PARQUET_SCHEMA, compression='zstd') as writer:
+        for conversation in conversations:
+            batch.append(parquet_record(conversation))
+            if len(batch) == PARQUET_ROW_GROUP_SIZE:
+                writer.write_table(pa.Table.from_pylist(batch, schema=PARQUET_SCHEMA))
+                count += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=PARQUET_SCHEMA))
+            count += len(batch)
+    return count
+
+
+def export_shard(module_id, label, start_utc, end_utc, work_dir, export_format='csv', replica=True):
+    """
+    Write one shard to its own CSV or Parquet file in work_dir. Runs in a worker
+    process. Returns (member_name, path, row_count); empty shards produce no file.
+    Reads from the replica unless `replica` is False.
+    """
+    member_name = f"transcript_module_{module_id}_{label}.{export_format}"
+    path = os.path.join(work_dir, member_name)
+    with replica_reads() if replica else nullcontext():
+        conversations = transcripts_in_range(module_id, start_utc, end_utc)
+        if export_format == 'parquet':
+            count = _write_parquet_shard(conversations, path)
+        else:
+            count = _write_csv_shard(conversations, path)
+
+    if count == 0:
+        os.remove(path)
+        return member_name, None, 0
+    logger.debug(f"Exported shard {label} of module {module_id}: {count} rows")
+    return member_name, path, count
+
+
+def run_shards(jobs, work_dir, workers, export_format='csv', replica=True):
+    """
+    Export (module_id, label, start_utc, end_utc) jobs, in a process pool when
+    there is more than one job and more than one worker.
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        return [export_shard(module_id, label, start_utc, end_utc, work_dir, export_format, replica)
+                for module_id, label, start_utc, end_utc in jobs]
+
+    # Forked or spawned workers must open their own database connections
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs)),
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_export_worker) as executor:
+        futures = [executor.submit(export_shard, module_id, label, start_utc, end_utc, work_dir, export_format, replica)
+                   for module_id, label, start_utc, end_utc in jobs]
+        return [future.result() for future in futures]
+
+
+def merge_shards(results, zip_file):
+    for member_name, path, _ in sorted(results):
+        if path:
+            # Parquet members are already compressed column by column
+            compress_type = zipfile.ZIP_STORED if member_name.endswith(
+                '.parquet') else zipfile.ZIP_DEFLATED
+            zip_file.write(path, member_name, compress_type=compress_type)
+
+
+def audio_rows(module_id, start_date, end_date):
+    Transcript = apps.get_model('langchain_stream', 'Transcript')
+    start_utc = shard_date_range(start_date, start_date)[0][1]
+    end_utc = shard_date_range(end_date, end_date)[0][2]
+    return Transcript.objects.filter(
+        session__module_id=module_id,
+        created_at__gte=start_utc,
+        created_at__lt=end_utc,
+        has_audio=True,
+    ).exclude(audio_link=None).exclude(audio_link='').order_by('id').values_list(
+        'id', 'session_id', 'message_id', 'audio_link').iterator(chunk_size=2000)
+
+
+def bundle_audio(zip_file, rows):
+    """
+    Fetch the audio clips of (transcript_id, session_id, message_id, audio_link)
+    rows with bounded concurrency and stream them into the archive under audio/,
+    followed by audio/manifest.csv. At most two clips per fetch slot are in
+    flight at once, so memory stays flat however large the corpus is.
+    """
+    storage = get_storage()
+    concurrency = settings.TRANSCRIPT_EXPORT_AUDIO_CONCURRENCY
+
+    manifest = io.StringIO()
+    manifest_writer = csv.writer(manifest)
+    manifest_writer.writerow(AUDIO_MANIFEST_HEADER)
+    rows = iter(rows)
+    pending = {}
+    bundled = 0
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        def submit_next():
+            row = next(rows, None)
+            if row:
+                pending[executor.submit(storage.open, storage.key_from_url(row[3]))] = row
+
+        for _ in range(concurrency * 2):
+            submit_next()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                transcript_id, session_id, message_id, audio_link = pending.pop(future)
+                archive_path = f"audio/session_{session_id}/{os.path.basename(urlparse(audio_link).path)}"
+                try:
+                    with future.result() as body:
+                        # Clips are already compressed audio, store them as-is
+                        info = zipfile.ZipInfo(
+                            archive_path, date_time=datetime.now().timetuple()[:6])
+                        info.compress_type = zipfile.ZIP_STORED
+                        with zip_file.open(info, 'w', force_zip64=True) as member:
+                            shutil.copyfileobj(body, member, AUDIO_COPY_CHUNK_SIZE)
+                    manifest_writer.writerow(
+                        [transcript_id, session_id, message_id, audio_link, archive_path, 'ok'])
+                    bundled += 1
+                except Exception as e:
+                    logger.error(f"Error bundling audio {audio_link}: {e}")
+                    manifest_writer.writerow(
+                        [transcript_id, session_id, message_id, audio_link, '', 'missing'])
+                submit_next()
+
+    zip_file.writestr('audio/manifest.csv', manifest.getvalue())
+    return bundled
+
+
+def store_export(zip_path, zip_file_name):
+    file_url = get_storage().put_file(f"data/transcript/{zip_file_name}", zip_path)
+    logger.info(f"ZIP file stored at {file_url}")
+    return file_url
+
+
+@use_replica
+def export_transcripts(module_id, start_date, end_date, shard=None, workers=None, export_format='csv',
+                       include_audio=False):
+    """
+    Export a module's transcripts between two US/Eastern dates (inclusive) as a
+    ZIP archive with one CSV or Parquet member per shard, and return the stored
+    file URL. With include_audio the referenced clips are bundled under audio/.
+
+    For CSV exports, days already sealed by the snapshot pipeline are copied
+    from their stored shards; only the remaining live tail is queried from the
+    database.
+    """
+    from .snapshots import fetch_sealed_shards
+
+    shard = shard or settings.TRANSCRIPT_EXPORT_SHARD
+    workers = workers or settings.TRANSCRIPT_EXPORT_WORKERS
+    if shard not in SHARD_SIZES:
+        raise ValueError(f"Unknown shard size: {shard}")
+    check_export_format(export_format)
+    suffix = '' if export_format == 'csv' else f"_{export_format}"
+    if include_audio:
+        suffix += '_audio'
+    zip_file_name = f"transcripts_module_{module_id}_{start_date}_to_{end_date}{suffix}.zip"
+
+    with tempfile.TemporaryDirectory(prefix='transcript_export_') as work_dir:
+        results, tail_start = [], start_date
+        if export_format == 'csv':
+            results, tail_start = fetch_sealed_shards(
+                module_id, start_date, end_date, work_dir)
+
+        # Nothing can exist past today, so the live tail stops there
+        tail_end = min(end_date, timezone.localdate(
+            timezone=pytz.timezone(EXPORT_TIMEZONE)).strftime('%Y-%m-%d'))
+        jobs = []
+        if tail_start <= tail_end:
+            jobs = [(module_id, label, start_utc, end_utc)
+                    for label, start_utc, end_utc in shard_date_range(tail_start, tail_end, shard)]
+            results += run_shards(jobs, work_dir, workers, export_format)
+
+        total = sum(count for _, _, count in results)
+        logger.info(
+            f"Exported {total} transcript rows for module {module_id}: {len(results) - len(jobs)} snapshot shards, {len(jobs)} live {shard} shards")
+
+        zip_path = os.path.join(work_dir, zip_file_name)
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            merge_shards(results, zip_file)
+            if include_audio:
+                bundled = bundle_audio(
+                    zip_file, audio_rows(module_id, start_date, end_date))
+                logger.info(
+                    f"Bundled {bundled} audio clips for module {module_id}")
+        return store_export(zip_path, zip_file_name)
@@ -0,0 +1,260 @@
+import csv
+import io
+import json
+import logging
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+
+from config.storage import get_storage
+from .catalog import bump_catalog_version
+from .models import Module, Persona, Task
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_FORMATS = ('json', 'csv')
+# One row per task; module_* and persona are repeated on each of its rows,
+# and a row without a task_title only declares its module. Lists of files
+# are separated by semicolons.
+CSV_COLUMNS = ['module', 'module_content', 'module_files', 'task_title', 'task_content',
+               'instruction_prompt', 'persona_prompt', 'persona', 'task_files']
+MODULE_FIELDS = ['name', 'content', 'files']
+TASK_FIELDS = ['title', 'content', 'instruction_prompt', 'persona_prompt', 'files']
+PERSONA_FIELDS = ['name', 'instructions', 'avatar_url']
+
+
+class BundleError(ValueError):
+    """A course bundle that failed validation; `errors` lists every problem found."""
+
+    def __init__(self, errors):
+        super().__init__(f"Course bundle has {len(errors)} error(s): {'; '.join(errors[:5])}")
+        self.errors = errors
+
+
+class _DryRun(Exception):
+    pass
+
+
+def check_bundle_format(bundle_format):
+    if bundle_format not in BUNDLE_FORMATS:
+        raise BundleError([f"Unknown bundle format '{bundle_format}'. Use one of: {', '.join(BUNDLE_FORMATS)}."])
+
+
+def bundle_format_for(file_name):
+    return file_name.rsplit('.', 1)[-1].lower() if '.' in file_name else 'json'
+
+
+def split_files(value):
+    return [path.strip() for path in (value or '').split(';') if path.strip()]
+
+
+def csv_to_bundle(text):
+    """
+    Course bundle from CSV rows:
+    {"modules": [{"name", "content", "files", "tasks": [...]}]}, with tasks
+    naming their persona. Modules keep the order they first appear in.
+    """
+    reader = csv.DictReader(io.StringIO(text))
+    missing = {'module', 'task_title'} - set(reader.fieldnames or [])
+    if missing:
+        raise BundleError([f"CSV is missing the column(s): {', '.join(sorted(missing))}"])
+
+    modules = {}
+    for row in reader:
+        name = (row.get('module') or '').strip()
+        module = modules.setdefault(name, {"name": name, "content": None, "files": [], "tasks": []})
+        module['content'] = module['content'] or row.get('module_content') or None
+        module['files'] = module['files'] or split_files(row.get('module_files'))
+        if row.get('task_title'):
+            module['tasks'].append({
+                "title": row['task_title'],
+                "content": row.get('task_content') or '',
+                "instruction_prompt": row.get('instruction_prompt') or None,
+                "persona_prompt": row.get('persona_prompt') or None,
+                "persona": row.get('persona') or None,
+                "files": split_files(row.get('task_files')),
+            })
+    return {"modules": list(modules.values())}
+
+
+def load_bundle(raw, bundle_format='json'):
+    """Parse a JSON or CSV bundle from bytes or text."""
+    check_bundle_format(bundle_format)
+    try:
+        text = raw.decode('utf-8-sig') if isinstance(raw, bytes) else raw
+    except UnicodeDecodeError as e:
+        raise BundleError([f"Bundle is not UTF-8 text: {e}"])
+    if bundle_format == 'csv':
+        return csv_to_bundle(text)
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as e:
+        raise BundleError([f"Invalid JSON: {e}"])
+
+
+def clean_instance(instance, label, errors, exclude):
+    """Run the model's field validation, which needs no queries, collecting errors under `label`."""
+    try:
+        instance.clean_fields(exclude=exclude)
+    except ValidationError as e:
+        for field, messages in e.message_dict.items():
+            errors.extend(f"{label}.{field}: {message}" for message in messages)
+
+
+def check_files(paths, label, errors, seen):
+    if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+        errors.append(f"{label}.files: must be a list of file paths")
+        return
+    for path in paths:
+        seen.setdefault(path, label)
+
+
+def validate_bundle(bundle, check_storage=True):
+    """
+    Check a whole bundle before anything is written, returning the plan
+    (personas to create, modules with their unsaved tasks). Tasks name their
+    persona by id, or by name among the bundle's personas and the live ones;
+    bundle personas whose name is already live reuse that persona. Raises
+    BundleError listing every problem.
+    """
+    errors = []
+    if not isinstance(bundle, dict) or not isinstance(bundle.get('modules'), list) or not bundle['modules']:
+        raise BundleError(["Bundle must be an object with a non-empty 'modules' list"])
+    personas_data = bundle.get('personas') or []
+    if not isinstance(personas_data, list):
+        raise BundleError(["'personas' must be a list"])
+
+    # Every persona a task may refer to, resolved in one query
+    tasks_data = [task for module in bundle['modules'] if isinstance(module, dict)
+                  for task in (module.get('tasks') or []) if isinstance(task, dict)]
+    refs = [task.get('persona') for task in tasks_data if task.get('persona') not in (None, '')]
+    names = {persona.get('name') for persona in personas_data if isinstance(persona, dict)}
+    names |= {ref for ref in refs if isinstance(ref, str)}
+    ids = {ref for ref in refs if isinstance(ref, int) and not isinstance(ref, bool)}
+    live = list(Persona.objects.filter(is_deleted=False).filter(Q(id__in=ids) | Q(name__in=names)))
+    by_id = {persona.id: persona for persona in live}
+    by_name = {}
+    for persona in live:
+        by_name.setdefault(persona.name, persona)
+
+    new_personas = {}
+    for i, persona_data in enumerate(personas_data):
+        label = f"personas[{i}]"
+        if not isinstance(persona_data, dict):
+            errors.append(f"{label}: must be an object")
+            continue
+        unknown = set(persona_data) - set(PERSONA_FIELDS)
+        if unknown:
+            errors.append(f"{label}: unknown field(s) {', '.join(sorted(unknown))}")
+        persona = Persona(**{field: persona_data.get(field) for field in PERSONA_FIELDS})
+        clean_instance(persona, label, errors, exclude=['is_deleted'])
+        if persona.name in new_personas:
+            errors.append(f"{label}.name: '{persona.name}' appears twice in the bundle")
+        elif persona.name not in by_name:
+            new_personas[persona.name] = persona
+
+    files = {}
+    modules = []
+    for i, module_data in enumerate(bundle['modules']):
+        label = f"modules[{i}]"
+        if not isinstance(module_data, dict):
+            errors.append(f"{label}: must be an object")
+            continue
+        unknown = set(module_data) - set(MODULE_FIELDS) - {'tasks'}
+        if unknown:
+            errors.append(f"{label}: unknown field(s) {', '.join(sorted(unknown))}")
+        module = Module(**{field: module_data.get(field) for field in MODULE_FIELDS if field in module_data})
+        clean_instance(module, label, errors, exclude=['created_by', 'is_deleted'])
+        check_files(module.files or [], label, errors, files)
+
+        tasks = []
+        for j, task_data in enumerate(module_data.get('tasks') or []):
+            task_label = f"{label}.tasks[{j}]"
+            if not isinstance(task_data, dict):
+                errors.append(f"{task_label}: must be an object")
+                continue
+            unknown = set(task_data) - set(TASK_FIELDS) - {'persona'}
+            if unknown:
+                errors.append(f"{task_label}: unknown field(s) {', '.join(sorted(unknown))}")
+            task = Task(**{field: task_data.get(field) for field in TASK_FIELDS if field in task_data})
+            clean_instance(task, task_label, errors, exclude=['module', 'persona', 'is_deleted'])
+            check_files(task.files or [], task_label, errors, files)
+
+            ref = task_data.get('persona')
+            # Resolved to a live persona now, or to a new one's name once it has an id
+            task.persona_ref = None
+            if ref in (None, ''):
+                pass
+            elif isinstance(ref, str) and ref in by_name:
+                task.persona = by_name[ref]
+            elif isinstance(ref, str) and ref in new_personas:
+                task.persona_ref = ref
+            elif isinstance(ref, int) and ref in by_id:
+                task.persona = by_id[ref]
+            else:
+                errors.append(f"{task_label}.persona: no persona {ref!r} in the bundle or the database")
+            tasks.append(task)
+        modules.append((module, tasks))
+
+    if check_storage and files:
+        storage = get_storage()
+        for path, label in files.items():
+            try:
+                if not storage.exists(storage.key_from_url(path)):
+                    errors.append(f"{label}.files: {path} was not found in storage")
+            except Exception as e:
+                errors.append(f"{label}.files: {path} could not be checked: {e}")
+
+    if errors:
+        raise BundleError(errors)
+    return list(new_personas.values()), modules
+
+
+def import_bundle(bundle, user, dry_run=False, check_storage=True):
+    """
+    Validate a course bundle, then write it in one transaction: personas and
+    tasks with one bulk insert each, modules one by one since MySQL's
+    bulk_create returns no ids. A dry run does every write and rolls back.
+    Returns a summary of what was (or would be) created.
+    """
+    new_personas, modules = validate_bundle(bundle, check_storage=check_storage)
+    summary = {
+        "dry_run": dry_run,
+        "personas_created": len(new_personas),
+        "modules": [],
+        "tasks_created": sum(len(tasks) for _, tasks in modules),
+    }
+    try:
+        with transaction.atomic():
+            if new_personas:
+                Persona.objects.bulk_create(new_personas)
+                # Re-read for the ids; these names had no live persona before
+                created = Persona.objects.filter(is_deleted=False, name__in=[p.name for p in new_personas])
+                persona_ids = {persona.name: persona.id for persona in created.order_by('id')}
+
+            new_tasks = []
+            for module, tasks in modules:
+                module.created_by = user
+                module.save()
+                for task in tasks:
+                    task.module = module
+                    if task.persona_ref:
+                        task.persona_id = persona_ids[task.persona_ref]
+                    new_tasks.append(task)
+                summary["modules"].append({"id": module.id, "name": module.name, "tasks": len(tasks)})
+            Task.objects.bulk_create(new_tasks)
+
+            if dry_run:
+                raise _DryRun()
+            # Bulk writes send no signals
+            transaction.on_commit(bump_catalog_version)
+    except _DryRun:
+        for module in summary["modules"]:
+            module["id"] = None
+
+    logger.info(
+        f"{'Dry run of course import' if dry_run else 'Imported course'} for user {user.id}: "
+        f"{len(summary['modules'])} modules, {summary['tasks_created']} tasks, "
+        f"{summary['personas_created']} new personas")
+    return summary
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.exports import EXPORT_FORMATS, SHARD_SIZES, export_transcripts
+from accounts.models import Module, User, UserCSVDownload
+
+
+class Command(BaseCommand):
+    help = "Export a module's transcripts for a date range as a sharded ZIP of CSV or Parquet files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('module_id', type=int)
+        parser.add_argument('start_date', help='First day to export (YYYY-MM-DD, US/Eastern)')
+        parser.add_argument('end_date', help='Last day to export (YYYY-MM-DD, US/Eastern)')
+        parser.add_argument('--shard', choices=list(SHARD_SIZES),
+                            help='Shard size (defaults to TRANSCRIPT_EXPORT_SHARD)')
+        parser.add_argument('--workers', type=int,
+                            help='Worker processes (defaults to TRANSCRIPT_EXPORT_WORKERS)')
+        parser.add_argument('--format', dest='export_format', choices=list(EXPORT_FORMATS), default='csv',
+                            help='Member file format (default: csv)')
+        parser.add_argument('--include-audio', action='store_true',
+                            help='Bundle the referenced audio clips under audio/ with a manifest')
+        parser.add_argument('--user',
+                            help='Username to list the export under in the transcript download page')
+
+    def handle(self, *args, **options):
+        module_id = options['module_id']
+        if not Module.objects.filter(id=module_id).exists():
+            raise CommandError(f"Module {module_id} does not exist")
+
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']} does not exist")
+
+        try:
+            file_url = export_transcripts(
+                module_id, options['start_date'], options['end_date'],
+                shard=options['shard'], workers=options['workers'],
+                export_format=options['export_format'],
+                include_audio=options['include_audio'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if user:
+            UserCSVDownload.objects.create(
+                user=user,
+                module_id=module_id,
+                start_date=options['start_date'],
+                end_date=options['end_date'],
+                file_url=file_url,
+                export_format=options['export_format'],
+                is_deleted=False
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"Export written to {file_url}"))
@@ -0,0 +1,47 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.imports import BUNDLE_FORMATS, BundleError, bundle_format_for, import_bundle, load_bundle
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = "Import a course bundle (JSON or CSV) of modules, tasks, personas and file references in one transaction."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Bundle file (.json or .csv)')
+        parser.add_argument('--user', required=True,
+                            help='Username the imported modules are created by')
+        parser.add_argument('--format', dest='bundle_format', choices=list(BUNDLE_FORMATS),
+                            help='Bundle format (defaults to the file extension)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Validate and run the inserts, then roll back')
+        parser.add_argument('--skip-file-check', action='store_true',
+                            help='Do not check that referenced files exist in storage')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist")
+        if not os.path.exists(options['path']):
+            raise CommandError(f"{options['path']} does not exist")
+
+        with open(options['path'], 'rb') as bundle_file:
+            raw = bundle_file.read()
+        try:
+            bundle = load_bundle(raw, options['bundle_format'] or bundle_format_for(options['path']))
+            summary = import_bundle(bundle, user, dry_run=options['dry_run'],
+                                    check_storage=not options['skip_file_check'])
+        except BundleError as e:
+            for error in e.errors:
+                self.stderr.write(error)
+            raise CommandError(f"{len(e.errors)} error(s) in {options['path']}, nothing imported")
+
+        self.stdout.write(json.dumps(summary, indent=2))
+        verb = 'Validated' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {len(summary['modules'])} modules, {summary['tasks_created']} tasks "
+            f"and {summary['personas_created']} new personas"))
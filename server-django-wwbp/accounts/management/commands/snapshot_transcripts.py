@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from accounts.snapshots import snapshot_transcripts
+
+
+class Command(BaseCommand):
+    help = "Write transcripts past the snapshot watermark into immutable per-day shards. Run daily."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            help='Worker processes (defaults to TRANSCRIPT_EXPORT_WORKERS)')
+
+    def handle(self, *args, **options):
+        written = snapshot_transcripts(workers=options['workers'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} transcript shards"))
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0021_persona_avatar_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_transcript_id', models.BigIntegerField(default=0)),
+                ('sealed_until', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TranscriptShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('file_url', models.TextField()),
+                ('row_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('module', models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, related_name='transcript_shards', to='accounts.module')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='transcriptshard',
+            constraint=models.UniqueConstraint(fields=('module', 'day'), name='unique_transcript_shard_per_module_day'),
+        ),
+    ]
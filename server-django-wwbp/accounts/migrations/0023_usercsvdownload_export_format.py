@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0022_snapshotwatermark_transcriptshard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usercsvdownload',
+            name='export_format',
+            field=models.CharField(default='csv', max_length=10),
+        ),
+    ]
@@ -92,5 +92,28 @@ class UserCSVDownload(models.Model):
     start_date = models.DateField()
     end_date = models.DateField()
     file_url = models.URLField()
+    export_format = models.CharField(max_length=10, default='csv')
     created_at = models.DateTimeField(auto_now_add=True)
     is_deleted = models.BooleanField(default=True)
+
+
+class SnapshotWatermark(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    last_transcript_id = models.BigIntegerField(default=0)
+    sealed_until = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class TranscriptShard(models.Model):
+    module = models.ForeignKey(
+        Module, on_delete=models.RESTRICT, related_name='transcript_shards')
+    day = models.DateField()
+    file_url = models.TextField()
+    row_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['module', 'day'], name='unique_transcript_shard_per_module_day'),
+        ]
@@ -0,0 +1,19 @@
+from rest_framework.pagination import CursorPagination
+
+
+class OptionalCursorPagination(CursorPagination):
+    """
+    Cursor pagination a client opts into with ?page_size= or ?cursor=. Without
+    either the list comes back as a plain array, which the current frontends
+    expect; the viewsets scope those lists per user instead.
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    # Same order as the unpaginated lists; id is unique and never changes
+    ordering = 'id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params and self.page_size_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
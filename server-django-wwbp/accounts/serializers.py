@@ -1,8 +1,30 @@
+from django.db import transaction
 from rest_framework import serializers
+
+from .catalog import bump_catalog_version
 from .models import Persona, User, Module, Task, ChatSession, SystemPrompt
 
 
-class UserSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """
+    Trims GET output to the comma-separated ?fields= of the request, e.g.
+    /modules/?fields=id,name. Only serializers built by a view get the request
+    in their context, so nested serializers keep their full fields.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = kwargs.get('context', {}).get('request')
+        if request is None or request.method != 'GET':
+            return
+        fields = request.query_params.get('fields')
+        if fields:
+            wanted = {field.strip() for field in fields.split(',')}
+            for name in set(self.fields) - wanted:
+                self.fields.pop(name)
+
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'first_name', 'last_name',
@@ -15,7 +37,7 @@ class PersonaSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'instructions', 'avatar_url']
 
 
-class TaskSerializer(serializers.ModelSerializer):
+class TaskSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     persona = PersonaSerializer(read_only=True)
     persona_id = serializers.PrimaryKeyRelatedField(
@@ -27,8 +49,22 @@ class TaskSerializer(serializers.ModelSerializer):
                   'persona_prompt', 'persona', 'persona_id', 'module', 'files']
 
 
-class ModuleSerializer(serializers.ModelSerializer):
-    tasks = TaskSerializer(many=True, required=False)
+class ModuleTaskSerializer(TaskSerializer):
+    """A module's nested task: `id` picks the existing task to update, the module comes from the parent."""
+    id = serializers.IntegerField(required=False)
+    # Checked for the whole list at once in ModuleSerializer.validate_tasks
+    persona_id = serializers.IntegerField(write_only=True, required=False, allow_null=True)
+
+    class Meta(TaskSerializer.Meta):
+        read_only_fields = ['module']
+
+
+# Task fields a module update may change
+TASK_UPDATE_FIELDS = ['title', 'content', 'instruction_prompt', 'persona_prompt', 'persona_id', 'files']
+
+
+class ModuleSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    tasks = ModuleTaskSerializer(many=True, required=False)
 
     class Meta:
         model = Module
@@ -36,45 +72,64 @@ class ModuleSerializer(serializers.ModelSerializer):
                   'files', 'tasks']
         read_only_fields = ['created_by']
 
+    def validate_tasks(self, tasks_data):
+        persona_ids = {task_data['persona_id'] for task_data in tasks_data if task_data.get('persona_id')}
+        missing = persona_ids - set(Persona.objects.filter(id__in=persona_ids).values_list('id', flat=True))
+        if missing:
+            raise serializers.ValidationError(f"Personas {sorted(missing)} do not exist.")
+        return tasks_data
+
+    @transaction.atomic
     def create(self, validated_data):
         tasks_data = validated_data.pop('tasks', [])
         module = Module.objects.create(**validated_data)
         for task_data in tasks_data:
-            Task.objects.create(module=module, **task_data)
+            task_data.pop('id', None)
+        Task.objects.bulk_create([Task(module=module, **task_data) for task_data in tasks_data])
+        # Bulk writes send no signals
+        transaction.on_commit(bump_catalog_version)
         return module
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         tasks_data = validated_data.pop('tasks', [])
         instance.name = validated_data.get('name', instance.name)
         instance.content = validated_data.get('content', instance.content)
         instance.files = validated_data.get('files', instance.files)
         instance.save()
-
-        # Update tasks if provided
-        keep_tasks = []
+        if not tasks_data:
+            return instance
+
+        # One fetch of the tasks being edited and one statement per kind of
+        # change, however many tasks the module has
+        keep_ids = [task_data['id'] for task_data in tasks_data if 'id' in task_data]
+        existing = Task.objects.filter(module=instance).in_bulk(keep_ids)
+        missing = set(keep_ids) - set(existing)
+        if missing:
+            raise serializers.ValidationError({'tasks': f"Tasks {sorted(missing)} are not in this module."})
+
+        changed, new_tasks = [], []
         for task_data in tasks_data:
-            if "id" in task_data:
-                task = Task.objects.get(id=task_data["id"], module=instance)
-                task.title = task_data.get("title", task.title)
-                task.content = task_data.get("content", task.content)
-                task.instruction_prompt = task_data.get(
-                    "instruction_prompt", task.instruction_prompt)
-                task.persona_prompt = task_data.get(
-                    "persona_prompt", task.persona_prompt)
-                task.files = task_data.get("files", task.files)
-                task.save()
-                keep_tasks.append(task.id)
+            if 'id' in task_data:
+                task = existing[task_data['id']]
+                for field in TASK_UPDATE_FIELDS:
+                    if field in task_data:
+                        setattr(task, field, task_data[field])
+                changed.append(task)
             else:
-                task = Task.objects.create(module=instance, **task_data)
-                keep_tasks.append(task.id)
-
-        # Remove tasks not in the request
-        if keep_tasks:
-            instance.tasks.exclude(id__in=keep_tasks).delete()
+                new_tasks.append(Task(module=instance, **task_data))
+
+        # Tasks left out of the request are soft deleted, like Task.delete();
+        # done before the inserts since MySQL's bulk_create returns no ids
+        instance.tasks.filter(is_deleted=False).exclude(id__in=keep_ids).update(is_deleted=True)
+        if changed:
+            Task.objects.bulk_update(changed, TASK_UPDATE_FIELDS)
+        Task.objects.bulk_create(new_tasks)
+        transaction.on_commit(bump_catalog_version)
         return instance
 
 
-class ChatSessionSerializer(serializers.ModelSerializer):
+class ChatSessionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = ChatSession
         fields = ['id', 'user', 'module', 'task', 'assistant_id',
@@ -82,7 +137,7 @@ class ChatSessionSerializer(serializers.ModelSerializer):
                   'created_at', 'updated_at']
 
 
-class SystemPromptSerializer(serializers.ModelSerializer):
+class SystemPromptSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = SystemPrompt
         fields = ['id', 'prompt', 'created_at', 'updated_at']
@@ -0,0 +1,15 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .catalog import bump_catalog_version
+from .models import Module, Persona, Task
+
+
+@receiver(post_save, sender=Module)
+@receiver(post_save, sender=Task)
+@receiver(post_save, sender=Persona)
+@receiver(post_delete, sender=Module)
+@receiver(post_delete, sender=Task)
+@receiver(post_delete, sender=Persona)
+def invalidate_module_catalog(sender, **kwargs):
+    bump_catalog_version()
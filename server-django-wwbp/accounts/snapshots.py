@@ -0,0 +1,143 @@
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytz
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from config.storage import get_storage
+
+from .exports import EXPORT_TIMEZONE, run_shards
+from .models import SnapshotWatermark, TranscriptShard
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_NAME = 'transcripts'
+
+
+def local_day(value):
+    return value.astimezone(pytz.timezone(EXPORT_TIMEZONE)).date()
+
+
+def day_bounds(day):
+    etc = pytz.timezone(EXPORT_TIMEZONE)
+    start = etc.localize(datetime(day.year, day.month, day.day))
+    end = etc.localize(datetime(day.year, day.month, day.day) + timedelta(days=1))
+    return start.astimezone(pytz.utc), end.astimezone(pytz.utc)
+
+
+def seal_cutoff(now=None):
+    """
+    The US/Eastern midnight before which every day is complete and can be
+    written as an immutable shard, allowing for late commits.
+    """
+    now = now or timezone.now()
+    delay = timedelta(minutes=settings.TRANSCRIPT_SNAPSHOT_SEAL_DELAY_MINUTES)
+    return day_bounds(local_day(now - delay))[0]
+
+
+def snapshot_transcripts(workers=None):
+    """
+    Write every transcript row past the watermark into immutable per-module,
+    per-day shards and advance the watermark. Rows committed after their day
+    was sealed get that day's shard rebuilt. Shards are read from the primary,
+    since a lagging replica would freeze them incomplete. Returns the number
+    of shards written.
+    """
+    Transcript = apps.get_model('langchain_stream', 'Transcript')
+    workers = workers or settings.TRANSCRIPT_EXPORT_WORKERS
+    watermark, _ = SnapshotWatermark.objects.get_or_create(name=WATERMARK_NAME)
+    cutoff = seal_cutoff()
+
+    new_rows = Transcript.objects.filter(
+        id__gt=watermark.last_transcript_id, created_at__lt=cutoff)
+    last_id = new_rows.aggregate(last_id=Max('id'))['last_id']
+
+    shards = set()
+    if last_id is not None:
+        new_rows = new_rows.filter(id__lte=last_id).exclude(session__module_id=None)
+        sealed_until = watermark.sealed_until
+        if sealed_until:
+            # Late commits into sealed days are rare, so list them row by row
+            late = new_rows.filter(created_at__lt=sealed_until).values_list('session__module_id', 'created_at')
+            shards |= {(module_id, local_day(created_at)) for module_id, created_at in late.iterator()}
+            new_rows = new_rows.filter(created_at__gte=sealed_until)
+
+        first = new_rows.aggregate(first=Min('created_at'))['first']
+        if first is not None:
+            day = local_day(first)
+            while day_bounds(day)[0] < cutoff:
+                start_utc, end_utc = day_bounds(day)
+                module_ids = new_rows.filter(
+                    created_at__gte=start_utc, created_at__lt=end_utc
+                ).values_list('session__module_id', flat=True).distinct()
+                shards |= {(module_id, day) for module_id in module_ids}
+                day += timedelta(days=1)
+
+    jobs = [(module_id, day.strftime('%Y-%m-%d'), *day_bounds(day)) for module_id, day in sorted(shards)]
+    storage = get_storage()
+    stored = []
+    with tempfile.TemporaryDirectory(prefix='transcript_snapshot_') as work_dir:
+        results = run_shards(jobs, work_dir, workers, replica=False)
+        for (module_id, label, _, _), (_, path, count) in zip(jobs, results):
+            if not path:
+                continue
+            file_url = storage.put_file(
+                f"data/snapshots/module_{module_id}/{label}.csv", path)
+            stored.append((module_id, label, file_url, count))
+
+    # Shards only count as sealed together with the watermark that covers them
+    with transaction.atomic():
+        for module_id, label, file_url, count in stored:
+            TranscriptShard.objects.update_or_create(
+                module_id=module_id, day=label, defaults={'file_url': file_url, 'row_count': count})
+        if last_id is not None:
+            watermark.last_transcript_id = last_id
+        watermark.sealed_until = cutoff
+        watermark.save()
+
+    logger.info(
+        f"Wrote {len(stored)} transcript shards; watermark at id {watermark.last_transcript_id}, sealed until {cutoff}")
+    return len(stored)
+
+
+def fetch_sealed_shards(module_id, start_date, end_date, work_dir):
+    """
+    Collect the stored shards of a module covering the sealed part of an
+    export range. Returns (results, tail_start) where results are
+    (member_name, path, row_count) tuples and tail_start is the first day
+    (YYYY-MM-DD) that still has to be read from the database.
+    """
+    watermark = SnapshotWatermark.objects.filter(name=WATERMARK_NAME).first()
+    if not watermark or not watermark.sealed_until:
+        return [], start_date
+
+    first_unsealed = local_day(watermark.sealed_until)
+    start = datetime.strptime(start_date, '%Y-%m-%d').date()
+    end = datetime.strptime(end_date, '%Y-%m-%d').date()
+    sealed_end = min(end, first_unsealed - timedelta(days=1))
+    if start > sealed_end:
+        return [], start_date
+
+    shards = list(TranscriptShard.objects.filter(
+        module_id=module_id, day__gte=start, day__lte=sealed_end))
+
+    storage = get_storage()
+
+    def fetch(shard):
+        member_name = f"transcript_module_{module_id}_{shard.day:%Y-%m-%d}.csv"
+        key = storage.key_from_url(shard.file_url)
+        path = storage.local_path(key) or storage.download(key, os.path.join(work_dir, member_name))
+        return member_name, path, shard.row_count
+
+    with ThreadPoolExecutor(max_workers=settings.TRANSCRIPT_SNAPSHOT_FETCH_WORKERS) as executor:
+        results = list(executor.map(fetch, shards))
+
+    tail_start = max(start, first_unsealed).strftime('%Y-%m-%d')
+    return results, tail_start
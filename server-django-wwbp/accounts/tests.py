@@ -1,3 +1,577 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import StringIO
+from unittest import mock, skipIf
 
-# Create your tests here.
+import pytz
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from config.routers import ReplicaPinMiddleware, ReplicaRouter, replica_reads
+from config.storage import get_storage
+from langchain_stream.history import append_to_tail, load_tail, tail_cache_key
+from langchain_stream.models import Transcript
+from .catalog import CATALOG_VERSION_KEY, bump_catalog_version, catalog_version
+from .exports import EXPORT_TIMEZONE, export_transcripts, pq, shard_date_range
+from .models import (ChatSession, Module, Persona, SnapshotWatermark, SystemPrompt, Task, TranscriptShard, User,
+                     UserCSVDownload)
+from .snapshots import WATERMARK_NAME, seal_cutoff, snapshot_transcripts
+
+# Redis is not needed to test the views; each test starts with an empty cache
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=TEST_CACHES, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class APITestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.student = User.objects.create_user(username='student', password='x', role='student')
+        self.other = User.objects.create_user(username='other', password='x', role='student')
+        self.teacher = User.objects.create_user(username='teacher', password='x', role='teacher')
+        self.client = APIClient()
+
+    def login(self, user):
+        self.client.force_authenticate(user)
+
+
+@override_settings(SESSION_HISTORY_TAIL_SIZE=3)
+class SessionHistoryTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.session = ChatSession.objects.create(user=self.student)
+
+    def add_messages(self, count):
+        for message_id in range(1, count + 1):
+            Transcript.objects.create(session=self.session, message_id=message_id, user_message=f"m{message_id}")
+
+    def history(self, **params):
+        return self.client.get(f'/api/v1/chat_sessions/{self.session.id}/history/', params)
+
+    def test_owner_and_teacher_read_history(self):
+        self.add_messages(2)
+        for user in (self.student, self.teacher):
+            self.login(user)
+            response = self.history()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([m['user_message'] for m in response.json()['results']], ['m1', 'm2'])
+
+    def test_other_student_gets_404_even_with_a_warm_tail(self):
+        self.add_messages(2)
+        self.login(self.student)
+        self.history()
+        # A tail naming someone else as owner must not decide access
+        cache.set(tail_cache_key(self.session.id), {**load_tail(self.session.id), "user_id": self.other.id})
+        self.login(self.other)
+        self.assertEqual(self.history().status_code, 404)
+
+    def test_has_more_is_exact_at_the_tail_boundary(self):
+        self.add_messages(3)
+        self.login(self.student)
+        body = self.history(limit=3).json()
+        self.assertEqual(len(body['results']), 3)
+        self.assertFalse(body['has_more'])
+
+        # A write past the warm tail pushes the oldest message out of it
+        append_to_tail(Transcript.objects.create(session=self.session, message_id=4, user_message='m4'))
+        body = self.history(limit=3).json()
+        self.assertEqual([m['user_message'] for m in body['results']], ['m2', 'm3', 'm4'])
+        self.assertTrue(body['has_more'])
+
+    def test_before_cursor_walks_back(self):
+        self.add_messages(5)
+        self.login(self.student)
+        latest = self.history(limit=2).json()
+        self.assertTrue(latest['has_more'])
+        older = self.history(limit=2, before=latest['before']).json()
+        self.assertEqual([m['user_message'] for m in older['results']], ['m2', 'm3'])
+        self.assertTrue(older['has_more'])
+
+
+class ScopingTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.own_session = ChatSession.objects.create(user=self.student)
+        self.other_session = ChatSession.objects.create(user=self.other)
+        SystemPrompt.objects.create(prompt='Be kind.')
+
+    def test_anonymous_requests_are_rejected(self):
+        for url in ('/api/v1/users/', '/api/v1/chat_sessions/', '/api/v1/system_prompts/', '/api/v1/modules/'):
+            self.assertEqual(self.client.get(url).status_code, 401, url)
+
+    def test_student_sees_only_their_own_rows(self):
+        self.login(self.student)
+        self.assertEqual([user['id'] for user in self.client.get('/api/v1/users/').json()], [self.student.id])
+        self.assertEqual(self.client.get(f'/api/v1/users/{self.other.id}/').status_code, 404)
+        sessions = self.client.get('/api/v1/chat_sessions/').json()
+        self.assertEqual([session['id'] for session in sessions], [self.own_session.id])
+        self.assertEqual(self.client.get(f'/api/v1/chat_sessions/{self.other_session.id}/').status_code, 404)
+        self.assertEqual(self.client.get('/api/v1/system_prompts/').json(), [])
+
+    def test_teacher_sees_every_row(self):
+        self.login(self.teacher)
+        self.assertEqual(len(self.client.get('/api/v1/users/').json()), 3)
+        self.assertEqual(len(self.client.get('/api/v1/chat_sessions/').json()), 2)
+        self.assertEqual(len(self.client.get('/api/v1/system_prompts/').json()), 1)
+
+
+class PaginationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.login(self.teacher)
+
+    def test_lists_stay_plain_arrays_without_paging_parameters(self):
+        self.assertIsInstance(self.client.get('/api/v1/users/').json(), list)
+
+    def test_cursor_pages_walk_the_list_by_id(self):
+        first = self.client.get('/api/v1/users/', {'page_size': 2}).json()
+        self.assertEqual([user['id'] for user in first['results']], [self.student.id, self.other.id])
+        second = self.client.get(first['next']).json()
+        self.assertEqual([user['id'] for user in second['results']], [self.teacher.id])
+        self.assertIsNone(second['next'])
+
+    def test_fields_trims_the_output(self):
+        users = self.client.get('/api/v1/users/', {'fields': 'id,username'}).json()
+        self.assertEqual(set(users[0]), {'id', 'username'})
+
+
+class ModuleTaskUpdateTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.login(self.teacher)
+        self.persona = Persona.objects.create(name='Coach')
+        self.module = Module.objects.create(name='Unit 1', created_by=self.teacher)
+        self.kept = Task.objects.create(module=self.module, title='Kept', content='a')
+        self.dropped = Task.objects.create(module=self.module, title='Dropped', content='b')
+
+    def update(self, tasks):
+        return self.client.patch(f'/api/v1/modules/{self.module.id}/', {"tasks": tasks}, format='json')
+
+    def test_update_edits_adds_and_soft_deletes_tasks(self):
+        response = self.update([
+            {"id": self.kept.id, "title": "Renamed", "persona_id": self.persona.id},
+            {"title": "Added", "content": "c"},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(task['title'] for task in response.json()['tasks']), ['Added', 'Renamed'])
+
+        self.kept.refresh_from_db()
+        self.assertEqual((self.kept.title, self.kept.content, self.kept.persona_id), ('Renamed', 'a', self.persona.id))
+        self.dropped.refresh_from_db()
+        # Soft deleted, so sessions that point at it keep working
+        self.assertTrue(self.dropped.is_deleted)
+        self.assertTrue(Task.objects.filter(module=self.module, title='Added', is_deleted=False).exists())
+
+    def test_update_without_tasks_leaves_them_alone(self):
+        response = self.client.patch(f'/api/v1/modules/{self.module.id}/', {"name": "Unit 1b"}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Task.objects.filter(module=self.module, is_deleted=False).count(), 2)
+
+    def test_task_from_another_module_rejects_the_whole_update(self):
+        other_module = Module.objects.create(name='Unit 2', created_by=self.teacher)
+        foreign = Task.objects.create(module=other_module, title='Foreign', content='x')
+        response = self.update([{"id": foreign.id, "title": "Stolen"}])
+        self.assertEqual(response.status_code, 400)
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.title, 'Foreign')
+        self.assertEqual(Task.objects.filter(module=self.module, is_deleted=False).count(), 2)
+
+    def test_unknown_persona_is_rejected(self):
+        response = self.update([{"id": self.kept.id, "persona_id": 9999}])
+        self.assertEqual(response.status_code, 400)
+        self.kept.refresh_from_db()
+        self.assertIsNone(self.kept.persona_id)
+
+    def test_duplicate_copies_live_tasks_under_a_numbered_name(self):
+        self.dropped.delete()
+        first = self.client.post(f'/api/v1/modules/{self.module.id}/duplicate/').json()
+        second = self.client.post(f'/api/v1/modules/{self.module.id}/duplicate/').json()
+        self.assertEqual(first['name'], 'Unit 1 [duplicate]')
+        self.assertEqual(second['name'], 'Unit 1 [duplicate] (2)')
+        self.assertEqual([task['title'] for task in first['tasks']], ['Kept'])
+
+    def test_task_duplicate_is_named_within_its_module(self):
+        response = self.client.post(f'/api/v1/tasks/{self.kept.id}/duplicate/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['title'], 'Kept [duplicate]')
+
+
+class CourseImportTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.login(self.teacher)
+        self.live_persona = Persona.objects.create(name='Coach')
+        self.bundle = {
+            "personas": [{"name": "Tutor", "instructions": "Explain."}, {"name": "Coach", "instructions": "Ignored."}],
+            "modules": [
+                {"name": "Grit 101", "content": "Intro", "tasks": [
+                    {"title": "Warm up", "content": "Say hi", "persona": "Tutor"},
+                    {"title": "Goals", "content": "Set one", "persona": "Coach"},
+                ]},
+                {"name": "Grit 102", "tasks": [
+                    {"title": "Review", "content": "Look back", "persona": self.live_persona.id},
+                ]},
+            ],
+        }
+
+    def import_course(self, bundle, **params):
+        query = '?dry_run=1' if params.get('dry_run') else ''
+        return self.client.post(f'/api/v1/modules/import/{query}', bundle, format='json')
+
+    def test_bundle_round_trip(self):
+        response = self.import_course(self.bundle)
+        self.assertEqual(response.status_code, 201)
+        summary = response.json()
+        self.assertEqual((summary['personas_created'], summary['tasks_created']), (1, 3))
+
+        tutor = Persona.objects.get(name='Tutor')
+        modules = {module.name: module for module in Module.objects.filter(created_by=self.teacher)}
+        tasks = {task.title: task for task in Task.objects.filter(module__in=modules.values())}
+        self.assertEqual(modules['Grit 101'].content, 'Intro')
+        # New personas get their ids after insert; live ones are reused by name or id
+        self.assertEqual(tasks['Warm up'].persona_id, tutor.id)
+        self.assertEqual(tasks['Goals'].persona_id, self.live_persona.id)
+        self.assertEqual(tasks['Review'].persona_id, self.live_persona.id)
+        self.assertEqual(tasks['Review'].module_id, modules['Grit 102'].id)
+        self.assertEqual(Persona.objects.filter(name='Coach').count(), 1)
+
+        listed = self.client.get('/api/v1/modules/').json()
+        self.assertEqual({module['name'] for module in listed}, {'Grit 101', 'Grit 102'})
+
+    def test_dry_run_rolls_everything_back(self):
+        response = self.import_course(self.bundle, dry_run=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['dry_run'])
+        self.assertEqual([module['id'] for module in response.json()['modules']], [None, None])
+        self.assertFalse(Module.objects.exists())
+        self.assertFalse(Persona.objects.filter(name='Tutor').exists())
+
+    def test_every_error_is_reported_and_nothing_written(self):
+        self.bundle['modules'][0]['tasks'][0]['persona'] = 'Nobody'
+        self.bundle['modules'][1]['name'] = 'x' * 101
+        self.bundle['modules'][1]['extra'] = True
+        response = self.import_course(self.bundle)
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['errors']
+        self.assertEqual(len(errors), 3)
+        self.assertTrue(any("no persona 'Nobody'" in error for error in errors))
+        self.assertFalse(Module.objects.exists())
+
+    def test_csv_upload(self):
+        rows = "module,module_content,task_title,task_content,persona\n" \
+               "Unit A,About A,First,Do it,Coach\n" \
+               "Unit A,,Second,Do more,\n" \
+               "Unit B,,,,\n"
+        upload = SimpleUploadedFile('course.csv', rows.encode('utf-8'), content_type='text/csv')
+        response = self.client.post('/api/v1/modules/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([(module['name'], module['tasks']) for module in response.json()['modules']],
+                         [('Unit A', 2), ('Unit B', 0)])
+        self.assertEqual(Task.objects.get(title='First').persona_id, self.live_persona.id)
+
+    def test_students_cannot_import(self):
+        self.login(self.student)
+        self.assertEqual(self.import_course(self.bundle).status_code, 403)
+
+    def test_import_course_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as bundle_file:
+            json.dump(self.bundle, bundle_file)
+        self.addCleanup(os.remove, bundle_file.name)
+        call_command('import_course', bundle_file.name, user='teacher', stdout=StringIO())
+        self.assertEqual(Task.objects.filter(module__created_by=self.teacher).count(), 3)
+
+
+def eastern(*args):
+    return pytz.timezone(EXPORT_TIMEZONE).localize(datetime(*args))
+
+
+@override_settings(STORAGE_BACKEND='memory', TRANSCRIPT_EXPORT_WORKERS=1)
+class TranscriptExportTestCase(APITestCase):
+    """Exports land in a fresh in-memory storage; rows are placed on US/Eastern days."""
+
+    def setUp(self):
+        super().setUp()
+        get_storage.cache_clear()
+        self.addCleanup(get_storage.cache_clear)
+        self.module = Module.objects.create(name='Grit', created_by=self.teacher)
+        self.session = ChatSession.objects.create(user=self.student, module=self.module)
+
+    def add_row(self, created_at, text, session=None):
+        row = Transcript.objects.create(session=session or self.session, message_id=1, user_message=text)
+        # created_at is auto_now_add, so place the row on its day afterwards
+        Transcript.objects.filter(id=row.id).update(created_at=created_at)
+        return row
+
+    def read_export(self, file_url):
+        storage = get_storage()
+        with storage.open(storage.key_from_url(file_url)) as body:
+            archive = zipfile.ZipFile(io.BytesIO(body.read()))
+        return {name: archive.read(name) for name in archive.namelist()}
+
+    def csv_messages(self, member):
+        rows = list(csv.reader(io.StringIO(member.decode('utf-8'))))
+        self.assertEqual(rows[0][0], 'Session ID')
+        return [row[5] for row in rows[1:]]
+
+
+class ShardDateRangeTests(SimpleTestCase):
+    def test_days_follow_eastern_midnights_across_dst(self):
+        shards = shard_date_range('2024-03-09', '2024-03-11')
+        self.assertEqual([label for label, _, _ in shards], ['2024-03-09', '2024-03-10', '2024-03-11'])
+        self.assertEqual(shards[0][1], eastern(2024, 3, 9).astimezone(pytz.utc))
+        # The spring-forward day is 23 hours long and the shards stay contiguous
+        self.assertEqual((shards[1][2] - shards[1][1]).total_seconds(), 23 * 3600)
+        self.assertEqual(shards[0][2], shards[1][1])
+        self.assertEqual(shards[2][2], eastern(2024, 3, 12).astimezone(pytz.utc))
+
+    def test_week_shards_clip_to_the_range_end(self):
+        shards = shard_date_range('2024-01-01', '2024-01-10', 'week')
+        self.assertEqual([label for label, _, _ in shards], ['2024-01-01', '2024-01-08'])
+        self.assertEqual(shards[1][2], eastern(2024, 1, 11).astimezone(pytz.utc))
+
+    def test_unknown_shard_size(self):
+        with self.assertRaises(ValueError):
+            shard_date_range('2024-01-01', '2024-01-02', 'month')
+
+
+class TranscriptExportTests(TranscriptExportTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_row(eastern(2024, 1, 1, 9), 'first')
+        # Late evening Eastern is already the next day in UTC
+        self.add_row(eastern(2024, 1, 1, 23, 30), 'late')
+        self.add_row(eastern(2024, 1, 3, 12), 'third')
+        other_module = Module.objects.create(name='Other', created_by=self.teacher)
+        self.add_row(eastern(2024, 1, 1, 10), 'elsewhere',
+                     ChatSession.objects.create(user=self.student, module=other_module))
+
+    def test_one_member_per_non_empty_day(self):
+        members = self.read_export(export_transcripts(self.module.id, '2024-01-01', '2024-01-03'))
+        prefix = f"transcript_module_{self.module.id}"
+        self.assertEqual(sorted(members), [f"{prefix}_2024-01-01.csv", f"{prefix}_2024-01-03.csv"])
+        self.assertEqual(self.csv_messages(members[f"{prefix}_2024-01-01.csv"]), ['first', 'late'])
+        self.assertEqual(self.csv_messages(members[f"{prefix}_2024-01-03.csv"]), ['third'])
+
+    def test_week_shards(self):
+        members = self.read_export(export_transcripts(self.module.id, '2024-01-01', '2024-01-03', shard='week'))
+        self.assertEqual(list(members), [f"transcript_module_{self.module.id}_2024-01-01.csv"])
+        self.assertEqual(self.csv_messages(members[f"transcript_module_{self.module.id}_2024-01-01.csv"]),
+                         ['first', 'late', 'third'])
+
+    def test_command_lists_the_export_for_the_user(self):
+        call_command('export_transcripts', self.module.id, '2024-01-01', '2024-01-03',
+                     '--user', 'teacher', stdout=StringIO())
+        download = UserCSVDownload.objects.get(user=self.teacher)
+        self.assertEqual((download.module_id, download.export_format), (self.module.id, 'csv'))
+        self.assertEqual(len(self.read_export(download.file_url)), 2)
+
+
+class ThreadExecutor(ThreadPoolExecutor):
+    """Stands in for the spawn pool: spawned workers would open the real database, not the test one."""
+
+    def __init__(self, max_workers, mp_context=None, initializer=None):
+        super().__init__(max_workers=max_workers)
+
+
+@override_settings(CACHES=TEST_CACHES, STORAGE_BACKEND='memory')
+class ExportPoolTests(TransactionTestCase):
+    def setUp(self):
+        get_storage.cache_clear()
+        self.addCleanup(get_storage.cache_clear)
+        teacher = User.objects.create_user(username='teacher', password='x', role='teacher')
+        self.module = Module.objects.create(name='Grit', created_by=teacher)
+        session = ChatSession.objects.create(user=teacher, module=self.module)
+        for day in range(1, 6):
+            row = Transcript.objects.create(session=session, message_id=day, user_message=f"day {day}")
+            Transcript.objects.filter(id=row.id).update(created_at=eastern(2024, 2, day, 12))
+
+    def test_pool_merges_every_shard_in_day_order(self):
+        with mock.patch('accounts.exports.ProcessPoolExecutor', ThreadExecutor):
+            file_url = export_transcripts(self.module.id, '2024-02-01', '2024-02-07', workers=3)
+        storage = get_storage()
+        with storage.open(storage.key_from_url(file_url)) as body:
+            archive = zipfile.ZipFile(io.BytesIO(body.read()))
+        self.assertEqual(archive.namelist(),
+                         [f"transcript_module_{self.module.id}_2024-02-0{day}.csv" for day in range(1, 6)])
+        self.assertIn(b'day 3', archive.read(archive.namelist()[2]))
+
+
+class TranscriptSnapshotTests(TranscriptExportTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_row(eastern(2024, 1, 1, 9), 'first')
+        self.add_row(eastern(2024, 1, 2, 9), 'second')
+
+    def shard(self, day):
+        shard = TranscriptShard.objects.get(module=self.module, day=day)
+        storage = get_storage()
+        with storage.open(storage.key_from_url(shard.file_url)) as body:
+            return shard.row_count, self.csv_messages(body.read())
+
+    @override_settings(TRANSCRIPT_SNAPSHOT_SEAL_DELAY_MINUTES=60)
+    def test_days_seal_only_after_the_delay(self):
+        self.assertEqual(seal_cutoff(eastern(2024, 1, 2, 0, 30)), eastern(2024, 1, 1).astimezone(pytz.utc))
+        self.assertEqual(seal_cutoff(eastern(2024, 1, 2, 1, 30)), eastern(2024, 1, 2).astimezone(pytz.utc))
+
+    def test_snapshot_seals_each_day_and_advances_the_watermark(self):
+        today = self.add_row(timezone.now(), 'today')
+        self.assertEqual(snapshot_transcripts(), 2)
+        self.assertEqual(self.shard('2024-01-01'), (1, ['first']))
+        self.assertEqual(self.shard('2024-01-02'), (1, ['second']))
+
+        watermark = SnapshotWatermark.objects.get(name=WATERMARK_NAME)
+        self.assertLess(watermark.last_transcript_id, today.id)
+        self.assertEqual(watermark.sealed_until, seal_cutoff())
+        # Nothing new past the watermark, nothing rewritten
+        self.assertEqual(snapshot_transcripts(), 0)
+
+    def test_late_row_rebuilds_only_its_day(self):
+        snapshot_transcripts()
+        first_shard = TranscriptShard.objects.get(module=self.module, day='2024-01-02')
+        self.add_row(eastern(2024, 1, 1, 18), 'late')
+
+        self.assertEqual(snapshot_transcripts(), 1)
+        self.assertEqual(self.shard('2024-01-01'), (2, ['first', 'late']))
+        self.assertEqual(TranscriptShard.objects.get(module=self.module, day='2024-01-02').file_url,
+                         first_shard.file_url)
+
+    def test_export_reads_sealed_days_from_their_shards(self):
+        snapshot_transcripts()
+        # The shards are what an export of sealed days reads, not the live rows
+        Transcript.objects.filter(session=self.session).update(user_message='edited')
+        self.add_row(timezone.now(), 'live')
+        today = timezone.localdate(timezone=pytz.timezone(EXPORT_TIMEZONE)).strftime('%Y-%m-%d')
+
+        members = self.read_export(export_transcripts(self.module.id, '2024-01-01', today))
+        prefix = f"transcript_module_{self.module.id}"
+        self.assertEqual(self.csv_messages(members[f"{prefix}_2024-01-01.csv"]), ['first'])
+        self.assertEqual(self.csv_messages(members[f"{prefix}_{today}.csv"]), ['live'])
+
+
+@skipIf(pq is None, "pyarrow is not installed")
+class ParquetExportTests(TranscriptExportTestCase):
+    def test_parquet_members_carry_the_typed_columns(self):
+        self.session.total_tokens = 42
+        self.session.save()
+        row = self.add_row(eastern(2024, 1, 1, 9), 'first')
+        self.add_row(eastern(2024, 1, 2, 9), 'second')
+
+        file_url = export_transcripts(self.module.id, '2024-01-01', '2024-01-02', export_format='parquet')
+        self.assertTrue(file_url.endswith('_parquet.zip'))
+        members = self.read_export(file_url)
+        table = pq.read_table(io.BytesIO(members[f"transcript_module_{self.module.id}_2024-01-01.parquet"]))
+        record, = table.to_pylist()
+        self.assertEqual((record['transcript_id'], record['module_name'], record['user_message']),
+                         (row.id, 'Grit', 'first'))
+        self.assertEqual(record['total_tokens'], 42)
+        self.assertEqual(record['created_at'], eastern(2024, 1, 1, 9))
+
+    def test_unknown_format_is_rejected(self):
+        with self.assertRaises(ValueError):
+            export_transcripts(self.module.id, '2024-01-01', '2024-01-02', export_format='xlsx')
+
+
+class ModuleCatalogTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.module = Module.objects.create(name='Grit', created_by=self.teacher)
+        Task.objects.create(title='Warm up', content='Say hi', module=self.module)
+        self.login(self.student)
+
+    def catalog(self, **headers):
+        return self.client.get('/api/v1/modules/', **headers)
+
+    def test_warm_catalog_costs_no_queries_and_honours_the_etag(self):
+        first = self.catalog()
+        self.assertEqual([module['name'] for module in first.json()], ['Grit'])
+        with CaptureQueriesContext(connection) as queries:
+            second = self.catalog()
+        # The request profiler, when enabled, still records the request itself
+        self.assertEqual([query['sql'] for query in queries if '"accounts_' in query['sql']], [])
+        self.assertEqual(second.content, first.content)
+        revalidated = self.catalog(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated['ETag'], first['ETag'])
+
+    def test_writes_bump_the_version(self):
+        etag = self.catalog()['ETag']
+        Task.objects.create(title='Goals', content='Set one', module=self.module)
+        response = self.catalog(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()[0]['tasks']), 2)
+
+    def test_bulk_duplicate_bumps_the_version_on_commit(self):
+        etag = self.catalog()['ETag']
+        self.login(self.teacher)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/v1/modules/{self.module.id}/duplicate/')
+        self.assertEqual(len(self.catalog().json()), 2)
+        self.assertNotEqual(self.catalog()['ETag'], etag)
+
+    def test_lost_version_key_never_reuses_an_old_version(self):
+        version = catalog_version()
+        cache.delete(CATALOG_VERSION_KEY)
+        bump_catalog_version()
+        self.assertGreater(catalog_version(), version)
+        self.assertEqual([module['name'] for module in self.catalog().json()], ['Grit'])
+
+
+@override_settings(CACHES=TEST_CACHES, REPLICA_PIN_SECONDS=15)
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('config.routers.replica_enabled', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = ReplicaRouter()
+
+    def request(self, token, write=False):
+        """Run one request through the pin middleware and return where its replica reads went."""
+        routed = []
+
+        def view(request):
+            if write:
+                self.router.db_for_write(Module)
+            with replica_reads():
+                routed.append(self.router.db_for_read(Module))
+            return HttpResponse()
+
+        ReplicaPinMiddleware(view)(RequestFactory().get('/', HTTP_AUTHORIZATION=f'Token {token}'))
+        return routed[0]
+
+    def test_only_reads_inside_replica_reads_leave_the_primary(self):
+        self.assertIsNone(self.router.db_for_read(Module))
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Module), 'replica')
+            self.assertEqual(self.router.db_for_write(Module), 'default')
+        self.assertFalse(self.router.allow_migrate('replica', 'accounts'))
+
+    def test_a_client_that_wrote_reads_its_own_writes(self):
+        self.assertEqual(self.request('a'), 'replica')
+        # Reads after a write in the same request stay on the primary
+        self.assertEqual(self.request('a', write=True), 'default')
+        self.assertEqual(self.request('a'), 'default')
+        self.assertEqual(self.request('b'), 'replica')
+
+    def test_client_is_unpinned_once_the_pin_key_is_gone(self):
+        self.request('a', write=True)
+        cache.clear()
+        self.assertEqual(self.request('a'), 'replica')
+
+    def test_no_replica_means_no_routing(self):
+        with mock.patch('config.routers.replica_enabled', return_value=False), replica_reads():
+            self.assertIsNone(self.router.db_for_read(Module))
@@ -2,7 +2,7 @@ from django.conf.urls.static import static
 from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import GeneratePresignedURL, CSVCreateView, CSVListView, CSVServeView, LocalFileUploadView, PersonaViewSet, UserViewSet, ModuleViewSet, TaskViewSet, ChatSessionViewSet, SystemPromptViewSet, auto_login_view, csrf, current_time, login_view, logout_view, upload_avatar, user_profile, register, switch_to_student_view, switch_to_teacher_view, get_view_mode
+from .views import GeneratePresignedURL, ConsumerProfileView, CSVCreateView, CSVListView, CSVServeView, LocalFileUploadView, TurnTraceView, PersonaViewSet, UserViewSet, ModuleViewSet, TaskViewSet, ChatSessionViewSet, SystemPromptViewSet, auto_login_view, csrf, current_time, login_view, logout_view, upload_avatar, user_profile, register, switch_to_student_view, switch_to_teacher_view, get_view_mode
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet)
@@ -34,6 +34,13 @@ urlpatterns = [
     path('csv_transcripts/list/', CSVListView.as_view(), name='csv_list'),
     path('csv_transcripts/list/<int:csv_id>/',
          CSVListView.as_view(), name='csv_delete'),
+    path('consumer_profiles/<int:session_id>/',
+         ConsumerProfileView.as_view(), name='consumer_profiles'),
+    path('consumer_profiles/<int:session_id>/<str:name>/',
+         ConsumerProfileView.as_view(), name='consumer_profile'),
+    path('traces/<int:session_id>/', TurnTraceView.as_view(), name='turn_traces'),
+    path('traces/<int:session_id>/<int:message_id>/',
+         TurnTraceView.as_view(), name='turn_trace'),
     path('local_upload/', LocalFileUploadView.as_view(), name='local-upload'),
     path('get-avatar-url/', upload_avatar),
     path('auto_login/', auto_login_view, name='auto_login'),
@@ -1,17 +1,16 @@
 import re
 import uuid
+import hashlib
 from django.db import transaction
+from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator
 from django.utils.decorators import method_decorator
-import zipfile
-import io
 from rest_framework import status
 import boto3
 import os
 import json
-import csv
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 from django.conf import settings
@@ -19,7 +18,6 @@ from django.middleware.csrf import get_token
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import authenticate, login, logout, get_user_model
 from django.http import Http404, HttpResponseNotAllowed, JsonResponse, HttpResponse, FileResponse, HttpResponseRedirect
-from django.apps import apps
 
 from rest_framework import status, viewsets, permissions
 from rest_framework.decorators import action, api_view, permission_classes
@@ -31,6 +29,15 @@ from rest_framework.authtoken.models import Token
 from rest_framework.views import exception_handler
 import pytz
 
+from config.routers import replica_reads
+from config.storage import FileSystemStorage, get_storage
+from langchain_stream.history import format_cursor, history_page, load_tail
+from langchain_stream.profiling import arm_session, list_profiles
+from langchain_stream.tracing import list_turns, turn_waterfall
+from .catalog import bump_catalog_version, catalog_queryset, load_catalog
+from .pagination import OptionalCursorPagination
+from .imports import BundleError, bundle_format_for, import_bundle, load_bundle
+from .exports import SHARD_SIZES, check_export_format, export_transcripts
 from .models import Persona, User, Task, Module, ChatSession, SystemPrompt, UserCSVDownload
 from .serializers import PersonaSerializer, UserSerializer, TaskSerializer, ModuleSerializer, ChatSessionSerializer, SystemPromptSerializer
 
@@ -231,15 +238,78 @@ def get_view_mode(request):
     return Response({"error": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
 
 
-class UserViewSet(viewsets.ModelViewSet):
+def sees_all_users(user):
+    """Teachers and admins work across students; everyone else only sees their own rows."""
+    return user.is_authenticated and (user.role in ['teacher', 'admin'] or user.is_staff)
+
+
+def duplicate_name(queryset, field, name):
+    """
+    `<name> [duplicate]`, numbered past the earlier duplicates found by a
+    single query, e.g. `Unit 1 [duplicate] (3)`.
+    """
+    base = f"{name} [duplicate]"
+    taken = set(queryset.filter(**{f"{field}__startswith": base}).values_list(field, flat=True))
+    if base not in taken:
+        return base
+    number = 2
+    while f"{base} ({number})" in taken:
+        number += 1
+    return f"{base} ({number})"
+
+
+def requested_fields(request):
+    fields = request.query_params.get('fields')
+    return {field.strip() for field in fields.split(',')} if fields else None
+
+
+class ReplicaListMixin:
+    """Serve list actions from the read replica; detail and write actions stay on the primary."""
+
+    def list(self, request, *args, **kwargs):
+        with replica_reads():
+            return super().list(request, *args, **kwargs)
+
+
+class UserViewSet(ReplicaListMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    pagination_class = OptionalCursorPagination
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        if sees_all_users(self.request.user):
+            return self.queryset
+        return self.queryset.filter(id=self.request.user.id)
 
 
 class ModuleViewSet(viewsets.ModelViewSet):
-    queryset = Module.objects.filter(is_deleted=False)
+    queryset = catalog_queryset()
     serializer_class = ModuleSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = OptionalCursorPagination
+
+    def get_queryset(self):
+        fields = requested_fields(self.request)
+        if self.action == 'list' and fields is not None and 'tasks' not in fields:
+            return self.queryset.prefetch_related(None)
+        return self.queryset
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.keys() & {'fields', 'cursor', 'page_size'}:
+            # Pages and sparse fieldsets are built per request from the replica
+            with replica_reads():
+                return super().list(request, *args, **kwargs)
+        # Served from the cached catalog, built on the primary so a version
+        # bump is never rebuilt from a lagging replica
+        body, etag = load_catalog()
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -256,13 +326,19 @@ class ModuleViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
 
-    def partial_update(self, request, *args, **kwargs):
+    def update(self, request, *args, **kwargs):
+        partial = kwargs.pop('partial', False)
         instance = self.get_object()
         serializer = self.get_serializer(
-            instance, data=request.data, partial=True)
+            instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
-        return Response(serializer.data)
+        # Re-read so the reply lists the live tasks rather than the stale prefetch
+        return Response(self.get_serializer(self.get_object()).data)
+
+    def partial_update(self, request, *args, **kwargs):
+        kwargs['partial'] = True
+        return self.update(request, *args, **kwargs)
 
     def perform_update(self, serializer):
         serializer.save()
@@ -270,9 +346,10 @@ class ModuleViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
     def tasks(self, request, pk=None):
         module = self.get_object()
-        tasks = module.tasks.all().filter(is_deleted=False)
-        serializer = TaskSerializer(tasks, many=True)
-        return Response(serializer.data)
+        with replica_reads():
+            tasks = module.tasks.all().filter(is_deleted=False).select_related('persona')
+            serializer = TaskSerializer(tasks, many=True)
+            return Response(serializer.data)
 
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def add_task(self, request, pk=None):
@@ -284,39 +361,60 @@ class ModuleViewSet(viewsets.ModelViewSet):
         serializer.save(module=module)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsAuthenticated, IsTeacher])
+    def import_course(self, request):
+        """
+        Create a course from one bundle: a JSON body, or an uploaded .json or
+        .csv `file`. `?dry_run=1` validates and rolls back.
+        """
+        dry_run = str(request.query_params.get('dry_run', request.data.get('dry_run', False))).lower() in ('true', '1')
+        try:
+            upload = request.FILES.get('file')
+            if upload is not None:
+                bundle = load_bundle(upload.read(), bundle_format_for(upload.name))
+            else:
+                bundle = request.data
+            summary = import_bundle(bundle, request.user, dry_run=dry_run)
+        except BundleError as e:
+            return Response({"errors": e.errors}, status=status.HTTP_400_BAD_REQUEST)
+        except ValidationError as e:
+            return Response({"errors": e.messages}, status=status.HTTP_400_BAD_REQUEST)
+        # Anything else is a server fault: it propagates, is logged, and the
+        # client gets a generic 500 rather than the error text
+        return Response(summary, status=status.HTTP_200_OK if dry_run else status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated, IsTeacher])
     def duplicate(self, request, pk=None):
         try:
             original_module = self.get_object()
-            new_module_name = f"{original_module.name} [duplicate]"
-
-            # Handle multiple duplicates
-            existing_duplicates = Module.objects.filter(
-                name__startswith=new_module_name
-            ).count()
-            if existing_duplicates > 0:
-                new_module_name = f"{new_module_name} ({existing_duplicates + 1})"
-
-            # Create a new module with the same content
-            new_module = Module.objects.create(
-                name=new_module_name,
-                created_by=request.user,
-                content=original_module.content,
-                files=original_module.files,
-            )
+            new_module_name = duplicate_name(Module.objects.all(), 'name', original_module.name)
 
-            # Duplicate the tasks
-            for task in original_module.tasks.all():
-                Task.objects.create(
-                    title=task.title,
-                    content=task.content,
-                    module=new_module,
-                    instruction_prompt=task.instruction_prompt,
-                    persona_prompt=task.persona_prompt,
-                    files=task.files,
+            with transaction.atomic():
+                # Create a new module with the same content
+                new_module = Module.objects.create(
+                    name=new_module_name,
+                    created_by=request.user,
+                    content=original_module.content,
+                    files=original_module.files,
                 )
 
-            serializer = self.get_serializer(new_module)
+                # Duplicate the live tasks, already prefetched by get_object, in one insert
+                Task.objects.bulk_create([
+                    Task(
+                        title=task.title,
+                        content=task.content,
+                        module=new_module,
+                        instruction_prompt=task.instruction_prompt,
+                        persona_prompt=task.persona_prompt,
+                        persona_id=task.persona_id,
+                        files=task.files,
+                    )
+                    for task in original_module.tasks.all()
+                ])
+                # Bulk writes send no signals
+                transaction.on_commit(bump_catalog_version)
+
+            serializer = self.get_serializer(self.get_queryset().get(pk=new_module.pk))
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         except Exception as e:
@@ -324,16 +422,17 @@ class ModuleViewSet(viewsets.ModelViewSet):
             return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class PersonaViewSet(viewsets.ModelViewSet):
+class PersonaViewSet(ReplicaListMixin, viewsets.ModelViewSet):
     queryset = Persona.objects.all()
     serializer_class = PersonaSerializer
     permission_classes = [permissions.IsAuthenticated]
 
 
-class TaskViewSet(viewsets.ModelViewSet):
-    queryset = Task.objects.filter(is_deleted=False)
+class TaskViewSet(ReplicaListMixin, viewsets.ModelViewSet):
+    queryset = Task.objects.filter(is_deleted=False).select_related('persona')
     serializer_class = TaskSerializer
     permission_classes = [permissions.IsAuthenticated, IsTeacher]
+    pagination_class = OptionalCursorPagination
 
     def create(self, request, *args, **kwargs):
         data = request.data.copy()
@@ -364,23 +463,17 @@ class TaskViewSet(viewsets.ModelViewSet):
     def duplicate(self, request, pk=None):
         try:
             original_task = self.get_object()
-            new_task_title = f"{original_task.title} [duplicate]"
-
-            # Handle multiple duplicates
-            existing_duplicates = Task.objects.filter(
-                title__startswith=new_task_title,
-                module=original_task.module
-            ).count()
-            if existing_duplicates > 0:
-                new_task_title = f"{new_task_title} ({existing_duplicates + 1})"
+            new_task_title = duplicate_name(
+                Task.objects.filter(module_id=original_task.module_id), 'title', original_task.title)
 
             # Create a new task with the same content
             new_task = Task.objects.create(
                 title=new_task_title,
                 content=original_task.content,
-                module=original_task.module,
+                module_id=original_task.module_id,
                 instruction_prompt=original_task.instruction_prompt,
                 persona_prompt=original_task.persona_prompt,
+                persona=original_task.persona,
                 files=original_task.files,
             )
 
@@ -392,10 +485,16 @@ class TaskViewSet(viewsets.ModelViewSet):
             return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class ChatSessionViewSet(viewsets.ModelViewSet):
+class ChatSessionViewSet(ReplicaListMixin, viewsets.ModelViewSet):
     queryset = ChatSession.objects.all()
     serializer_class = ChatSessionSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = OptionalCursorPagination
+
+    def get_queryset(self):
+        if sees_all_users(self.request.user):
+            return self.queryset
+        return self.queryset.filter(user=self.request.user)
 
     def create(self, request, *args, **kwargs):
         data = request.data
@@ -408,11 +507,58 @@ class ChatSessionViewSet(viewsets.ModelViewSet):
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
+    def history(self, request, pk=None):
+        try:
+            session_id = int(pk)
+            limit = max(1, min(int(request.GET.get('limit', 50)), 200))
+        except ValueError:
+            return Response({"detail": "Invalid session id or limit."}, status=status.HTTP_400_BAD_REQUEST)
+        before = request.GET.get('before')
+        after = request.GET.get('after')
+
+        # Access is decided by the session row, through the same scoping as get_object
+        if not self.get_queryset().filter(id=session_id).exists():
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        if not before and not after and limit <= settings.SESSION_HISTORY_TAIL_SIZE:
+            tail = load_tail(session_id)
+            messages = tail['messages'][-limit:]
+            has_more = len(tail['messages']) > limit or tail['has_more']
+        else:
+            try:
+                messages, has_more = history_page(
+                    session_id, before=before, after=after, limit=limit)
+            except ValueError:
+                return Response({"detail": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+
+        body = json.dumps({
+            "results": messages,
+            "has_more": has_more,
+            "before": format_cursor(messages[0]) if messages else before,
+            "after": format_cursor(messages[-1]) if messages else after,
+        })
+        etag = f'"{hashlib.md5(body.encode()).hexdigest()}"'
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
 
 class SystemPromptViewSet(viewsets.ModelViewSet):
     queryset = SystemPrompt.objects.all()
     serializer_class = SystemPromptSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = OptionalCursorPagination
+
+    def get_queryset(self):
+        # System prompts are edited from the teacher and admin pages only
+        if sees_all_users(self.request.user):
+            return self.queryset
+        return self.queryset.none()
 
 
 class GeneratePresignedURL(APIView):
@@ -426,28 +572,14 @@ class GeneratePresignedURL(APIView):
             if not file_name or not file_type:
                 return Response({"error": "File name and type are required."}, status=400)
 
-            if settings.ENVIRONMENT == 'local':
-                # Different directories for avatars and other files
-                upload_dir = 'data/upload/'
-                file_path = os.path.join(
-                    settings.BASE_DIR, upload_dir, file_name)
+            upload_key = f"data/upload/{file_name}"
+            presigned_post = get_storage().presign_post(upload_key, file_type)
+            if presigned_post is None:
+                # Local storage has no direct upload; the client posts to LocalFileUploadView
                 return Response({
                     "url": "local",
-                    "file_path": file_path
+                    "file_path": os.path.join(settings.BASE_DIR, upload_key)
                 })
-
-            s3_client = boto3.client(
-                's3', region_name=settings.AWS_S3_REGION_NAME)
-            # Correct paths for avatars and other files
-            upload_key = f"data/upload/{file_name}"
-
-            presigned_post = s3_client.generate_presigned_post(
-                Bucket=settings.AWS_STORAGE_BUCKET_NAME,
-                Key=upload_key,
-                Fields={"Content-Type": file_type},
-                Conditions=[{"Content-Type": file_type}],
-                ExpiresIn=3600
-            )
             return Response(presigned_post)
 
         except Exception as e:
@@ -474,18 +606,10 @@ class LocalFileUploadView(APIView):
         is_avatar = request.data.get('is_avatar', False)
 
         try:
-            if is_avatar:
-                local_upload_dir = os.path.join(
-                    settings.MEDIA_ROOT, 'avatars/')
-            else:
-                local_upload_dir = os.path.join(settings.MEDIA_ROOT, 'upload/')
-
-            os.makedirs(local_upload_dir, exist_ok=True)
-
-            file_path = os.path.join(local_upload_dir, sanitized_filename)
-            with open(file_path, 'wb') as f:
-                for chunk in file.chunks():
-                    f.write(chunk)
+            # Served from MEDIA_URL, so this stays on the filesystem whatever
+            # STORAGE_BACKEND is; remote backends upload through presigned posts
+            sub_dir = 'avatars' if is_avatar else 'upload'
+            FileSystemStorage(settings.MEDIA_ROOT).put(f"{sub_dir}/{sanitized_filename}", file)
 
             file_url = f"{settings.MEDIA_URL}avatars/{sanitized_filename}" if is_avatar else f"{settings.MEDIA_URL}upload/{sanitized_filename}"
 
@@ -506,19 +630,17 @@ class LocalFileUploadView(APIView):
         is_avatar = request.GET.get('is_avatar', False)
 
         # Use the correct directory
-        if is_avatar:
-            local_upload_dir = os.path.join(settings.BASE_DIR, 'data/avatars/')
-        else:
-            local_upload_dir = os.path.join(settings.BASE_DIR, 'data/upload/')
-
-        file_path = os.path.join(local_upload_dir, sanitized_filename)
+        key = f"data/avatars/{sanitized_filename}" if is_avatar else f"data/upload/{sanitized_filename}"
 
         # Check if the file exists and return it, otherwise raise 404
-        if os.path.exists(file_path):
-            # Adjust content_type as needed
-            return FileResponse(open(file_path, 'rb'), content_type='application/octet-stream')
-        else:
-            raise Http404("File not found")
+        storage = get_storage()
+        try:
+            if storage.exists(key):
+                # Adjust content_type as needed
+                return FileResponse(storage.open(key), content_type='application/octet-stream')
+        except ValueError:
+            pass
+        raise Http404("File not found")
 
 
 class CSVCreateView(APIView):
@@ -529,93 +651,36 @@ class CSVCreateView(APIView):
         module_id = request.data.get('module_id')
         start_date = request.data.get('start_date')
         end_date = request.data.get('end_date')
+        shard = request.data.get('shard')
+        export_format = request.data.get('format', 'csv')
+        include_audio = str(request.data.get('include_audio', False)).lower() in ('true', '1')
         user_id = request.user.id
 
+        if shard and shard not in SHARD_SIZES:
+            return JsonResponse({'error': f"Invalid shard '{shard}'. Use one of: {', '.join(SHARD_SIZES)}."}, status=400)
+        try:
+            check_export_format(export_format)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
         logger.info(
             f"Starting CSV creation request for module {module_id} from {start_date} to {end_date} for user {user_id}")
 
         try:
             self.create_csv_and_upload_to_s3(
-                module_id, start_date, end_date, user_id)
+                module_id, start_date, end_date, user_id, shard=shard, export_format=export_format,
+                include_audio=include_audio)
             return JsonResponse({'message': 'CSV creation started. You will be notified when it is ready.'})
         except Exception as e:
             logger.error(f"Failed to start CSV creation: {e}")
             return JsonResponse({'error': 'Failed to start CSV creation.'}, status=500)
 
-    def create_csv_and_upload_to_s3(self, module_id, start_date, end_date, user_id):
+    def create_csv_and_upload_to_s3(self, module_id, start_date, end_date, user_id, shard=None, export_format='csv',
+                                    include_audio=False):
         try:
-            etc = pytz.timezone('US/Eastern')
-            start_date_etc = etc.localize(
-                datetime.strptime(start_date, '%Y-%m-%d'))
-            end_date_etc = etc.localize(datetime.strptime(
-                end_date, '%Y-%m-%d')) + timedelta(days=1)
-            start_date_utc = start_date_etc.astimezone(pytz.utc)
-            end_date_utc = end_date_etc.astimezone(pytz.utc)
-
-            Transcript = apps.get_model('langchain_stream', 'Transcript')
-            user_conversations = Transcript.objects.filter(
-                session__module_id=module_id,
-                created_at__range=(start_date_utc, end_date_utc)
-            ).select_related('session__user', 'session__task', 'session__module').iterator(chunk_size=1000)
-
-            logger.debug("Fetched conversations for CSV creation")
-
-            zip_buffer = io.BytesIO()
-
-            with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
-                buffer = io.StringIO()
-                writer = csv.writer(buffer)
-                writer.writerow(['Session ID', 'Username', 'Module Name', 'Task Name', 'Message ID',
-                                'User Message', 'Bot Message', 'Created At (UTC)', 'Has Audio', 'Audio Link'])
-
-                count = 0
-                for conversation in user_conversations:
-                    writer.writerow([
-                        conversation.session.id,
-                        conversation.session.user.username,
-                        conversation.session.module.name if conversation.session.module else '',
-                        conversation.session.task.title if conversation.session.task else '',
-                        conversation.message_id,
-                        conversation.user_message,
-                        conversation.bot_message,
-                        conversation.created_at,
-                        conversation.has_audio,
-                        conversation.audio_link
-                    ])
-                    count += 1
-
-                    if count % 1000 == 0:
-                        file_name = f"transcript_module_{module_id}_{start_date}_to_{end_date}_batch_{count // 1000}.csv"
-                        zip_file.writestr(file_name, buffer.getvalue())
-                        buffer = io.StringIO()
-                        writer = csv.writer(buffer)
-                        writer.writerow(['Session ID', 'Username', 'Module Name', 'Task Name', 'Message ID',
-                                        'User Message', 'Bot Message', 'Created At (UTC)', 'Has Audio', 'Audio Link'])
-
-                # Write any remaining data
-                if count % 1000 != 0:
-                    file_name = f"transcript_module_{module_id}_{start_date}_to_{end_date}_batch_{count // 1000 + 1}.csv"
-                    zip_file.writestr(file_name, buffer.getvalue())
-
-            zip_buffer.seek(0)
-
-            zip_file_name = f"transcripts_module_{module_id}_{start_date}_to_{end_date}.zip"
-            if settings.ENVIRONMENT == 'local':
-                local_dir = os.path.join(settings.BASE_DIR, 'data/transcript')
-                os.makedirs(local_dir, exist_ok=True)
-                file_path = os.path.join(local_dir, zip_file_name)
-                with open(file_path, 'wb') as f:
-                    f.write(zip_buffer.getvalue())
-                file_url = file_path
-                logger.info(f"ZIP file saved locally at {file_path}")
-            else:
-                s3 = boto3.client(
-                    's3', region_name=settings.AWS_S3_REGION_NAME)
-                s3_key = f"data/transcript/{zip_file_name}"
-                s3.put_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME,
-                              Key=s3_key, Body=zip_buffer.getvalue())
-                file_url = f"https://{settings.AWS_STORAGE_BUCKET_NAME}.s3.{settings.AWS_S3_REGION_NAME}.amazonaws.com/{s3_key}"
-                logger.info(f"ZIP file uploaded to S3 at {file_url}")
+            file_url = export_transcripts(
+                module_id, start_date, end_date, shard=shard, export_format=export_format,
+                include_audio=include_audio)
 
             with transaction.atomic():
                 UserCSVDownload.objects.create(
@@ -624,6 +689,7 @@ class CSVCreateView(APIView):
                     start_date=start_date,
                     end_date=end_date,
                     file_url=file_url,
+                    export_format=export_format,
                     is_deleted=False
                 )
                 logger.info(
@@ -645,10 +711,11 @@ class CSVListView(APIView):
 
     def get(self, request):
         user_id = request.user.id
-        csv_files = UserCSVDownload.objects.filter(
-            user_id=user_id, is_deleted=False).order_by('-created_at')
-        csv_list = [{'id': csv.id, 'module_id': csv.module.id, 'module_name': csv.module.name, 'start_date': csv.start_date,
-                     'end_date': csv.end_date, 'file_url': csv.file_url} for csv in csv_files]
+        with replica_reads():
+            csv_files = UserCSVDownload.objects.filter(
+                user_id=user_id, is_deleted=False).select_related('module').order_by('-created_at')
+            csv_list = [{'id': csv.id, 'module_id': csv.module.id, 'module_name': csv.module.name, 'start_date': csv.start_date,
+                         'end_date': csv.end_date, 'file_url': csv.file_url, 'format': csv.export_format} for csv in csv_files]
         logger.info(f"Fetched CSV list for user {user_id}: {csv_list}")
         return Response(csv_list, status=status.HTTP_200_OK)
 
@@ -678,37 +745,101 @@ class CSVServeView(APIView):
                 f"CSV file with id {csv_id} not found for user {request.user.id}")
             return HttpResponse(status=404)
 
-        if settings.ENVIRONMENT == 'local':
-            file_name = csv_record.file_url.split('/')[-1]
-            file_path = os.path.join(
-                settings.BASE_DIR, 'data/transcript', file_name)
-            logger.debug(f"Local file path: {file_path}")
-            if os.path.exists(file_path):
-                response = FileResponse(
-                    open(file_path, 'rb'), content_type="application/zip")
-                response['Content-Disposition'] = f'attachment; filename={file_name}'
-                logger.info(
-                    f"Serving local ZIP file {file_name} to user {request.user.id}")
-                return response
-            logger.error(
-                f"Local ZIP file {file_name} not found for user {request.user.id}")
-            return HttpResponse(status=404)
-        else:
-            try:
-                s3_client = boto3.client(
-                    's3', region_name=settings.AWS_S3_REGION_NAME)
-                key = csv_record.file_url.split('.com/')[-1]
-                signed_url = s3_client.generate_presigned_url(
-                    'get_object',
-                    Params={'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Key': key},
-                    ExpiresIn=3600  # URL expires in 1 hour
-                )
-                logger.info(
-                    f"Generated signed URL for ZIP file {csv_record.file_url}")
-                return HttpResponseRedirect(signed_url)
-            except Exception as e:
-                logger.error(f"Error generating presigned URL: {e}")
-                return HttpResponse(status=500)
+        storage = get_storage()
+        key = storage.key_from_url(csv_record.file_url)
+        file_name = os.path.basename(key)
+        try:
+            signed_url = storage.presign(key)
+        except Exception as e:
+            logger.error(f"Error generating presigned URL: {e}")
+            return HttpResponse(status=500)
+        if signed_url:
+            logger.info(
+                f"Generated signed URL for ZIP file {csv_record.file_url}")
+            return HttpResponseRedirect(signed_url)
+
+        try:
+            found = storage.exists(key)
+        except ValueError as e:
+            # A link outside the storage root
+            logger.error(f"Invalid file link for CSV {csv_id}: {e}")
+            found = False
+        if found:
+            response = FileResponse(
+                storage.open(key), content_type="application/zip")
+            response['Content-Disposition'] = f'attachment; filename={file_name}'
+            logger.info(
+                f"Serving ZIP file {file_name} to user {request.user.id}")
+            return response
+        logger.error(
+            f"ZIP file {file_name} not found for user {request.user.id}")
+        return HttpResponse(status=404)
+
+
+class ConsumerProfileView(APIView):
+    """
+    Admin access to consumer turn profiles. GET lists a session's captures, or
+    returns one capture as collapsed stacks when a name is given; POST arms
+    the session so its next `turns` turns are profiled.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, session_id, name=None):
+        if request.user.role != 'admin' and not request.user.is_staff:
+            return Response({'error': 'Not allowed.'}, status=status.HTTP_403_FORBIDDEN)
+
+        profiles = list_profiles(session_id)
+        if name is None:
+            return Response(profiles, status=status.HTTP_200_OK)
+
+        entry = next((p for p in profiles if p['name'] == name), None)
+        if not entry:
+            return Response({'error': 'Profile not found.'}, status=status.HTTP_404_NOT_FOUND)
+        storage = get_storage()
+        try:
+            found = storage.exists(entry['key'])
+        except ValueError:
+            found = False
+        if not found:
+            return Response({'error': 'Profile not found.'}, status=status.HTTP_404_NOT_FOUND)
+        response = FileResponse(storage.open(entry['key']), content_type='text/plain')
+        response['Content-Disposition'] = f"attachment; filename={name}.folded"
+        return response
+
+    def post(self, request, session_id):
+        if request.user.role != 'admin' and not request.user.is_staff:
+            return Response({'error': 'Not allowed.'}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            turns = int(request.data.get('turns', 1))
+        except (TypeError, ValueError):
+            return Response({'error': 'turns must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= turns <= 100:
+            return Response({'error': 'turns must be between 1 and 100.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        arm_session(session_id, turns)
+        logger.info(f"Armed profiling of {turns} turns for session {session_id} by user {request.user.id}")
+        return Response({'session_id': session_id, 'turns': turns}, status=status.HTTP_202_ACCEPTED)
+
+
+class TurnTraceView(APIView):
+    """
+    Per-turn trace spans for teachers and admins: the recent traced turns of a
+    session, or the span waterfall of one message_id.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, session_id, message_id=None):
+        if request.user.role not in ['teacher', 'admin'] and not request.user.is_staff:
+            return Response({'error': 'Not allowed.'}, status=status.HTTP_403_FORBIDDEN)
+
+        if message_id is None:
+            return Response(list_turns(session_id), status=status.HTTP_200_OK)
+
+        spans = turn_waterfall(session_id, message_id)
+        if not spans:
+            return Response({'error': 'Trace not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'session_id': session_id, 'message_id': message_id, 'spans': spans},
+                        status=status.HTTP_200_OK)
 
 
 @csrf_exempt
@@ -723,28 +854,15 @@ def upload_avatar(request):
         if not file_name or not file_type:
             return Response({"error": "File name and type are required."}, status=400)
 
-        if settings.ENVIRONMENT == 'local':
-            local_upload_dir = os.path.join(settings.MEDIA_ROOT, 'avatars/')
-            os.makedirs(local_upload_dir, exist_ok=True)
-            # file_path = os.path.join(local_upload_dir, file_name)
-
+        # Make sure the avatar goes to the correct folder
+        presigned_post = get_storage().presign_post(f"data/avatars/{file_name}", file_type)
+        if presigned_post is None:
             return Response({
                 "url": "local",
                 # Return URL, not file path
                 "file_path": f"{settings.MEDIA_URL}avatars/{file_name}"
             })
 
-        # For production (using S3)
-        s3_client = boto3.client('s3', region_name=settings.AWS_S3_REGION_NAME)
-        presigned_post = s3_client.generate_presigned_post(
-            Bucket=settings.AWS_STORAGE_BUCKET_NAME,
-            # Make sure the avatar goes to the correct folder
-            Key=f"data/avatars/{file_name}",
-            Fields={"Content-Type": file_type},
-            Conditions=[{"Content-Type": file_type}],
-            ExpiresIn=3600  # 1 hour expiration
-        )
-
         return Response(presigned_post)
 
     except Exception as e:
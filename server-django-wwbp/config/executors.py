@@ -0,0 +1,118 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection, connections
+
+from config.metrics import DB_POOL_CONNECTIONS, EXECUTOR_ACTIVE, EXECUTOR_QUEUED, EXECUTOR_WAIT
+
+# Pool name -> setting holding its size:
+#   db:  ORM and cache work from consumers, one connection per thread
+#   sdk: blocking provider SDK calls (OpenAI, ElevenLabs)
+#   cpu: transcoding and other CPU-bound work
+POOL_SIZES = {
+    'db': 'DB_EXECUTOR_WORKERS',
+    'sdk': 'SDK_EXECUTOR_WORKERS',
+    'cpu': 'CPU_EXECUTOR_WORKERS',
+}
+
+
+class InstrumentedExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor that reports its queue depth, queue wait and busy threads."""
+
+    def __init__(self, name, max_workers, **kwargs):
+        super().__init__(max_workers=max_workers, thread_name_prefix=f"{name}-pool", **kwargs)
+        self.name = name
+
+    def submit(self, fn, *args, **kwargs):
+        queued_at = time.perf_counter()
+        EXECUTOR_QUEUED.labels(self.name).inc()
+
+        def run():
+            EXECUTOR_QUEUED.labels(self.name).dec()
+            EXECUTOR_WAIT.labels(self.name).observe(time.perf_counter() - queued_at)
+            EXECUTOR_ACTIVE.labels(self.name).inc()
+            self.before_job()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.after_job()
+                EXECUTOR_ACTIVE.labels(self.name).dec()
+
+        return super().submit(run)
+
+    def before_job(self):
+        pass
+
+    def after_job(self):
+        pass
+
+
+class DBExecutor(InstrumentedExecutor):
+    """
+    The db pool. Each thread keeps one persistent connection, so the pool size
+    caps a worker's consumer connections. Jobs are bracketed like requests:
+    close_old_connections drops connections past DB_EXECUTOR_CONN_MAX_AGE or
+    broken ones, and with CONN_HEALTH_CHECKS a reused connection is pinged
+    first.
+    """
+
+    def __init__(self, name, max_workers):
+        super().__init__(name, max_workers, initializer=self.init_thread)
+        self.open_connections = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def init_thread():
+        # Connections are per thread; give this thread's its own copy of the
+        # settings, so only pool threads outlive a job (HTTP keeps CONN_MAX_AGE)
+        for alias in connections:
+            conn = connections[alias]
+            conn.settings_dict = {**conn.settings_dict, 'CONN_MAX_AGE': settings.DB_EXECUTOR_CONN_MAX_AGE}
+
+    def before_job(self):
+        close_old_connections()
+
+    def after_job(self):
+        close_old_connections()
+        thread_id = threading.get_ident()
+        with self.lock:
+            if connection.connection is not None:
+                self.open_connections.add(thread_id)
+            else:
+                self.open_connections.discard(thread_id)
+            DB_POOL_CONNECTIONS.set(len(self.open_connections))
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name):
+    with _executors_lock:
+        if name not in _executors:
+            executor_class = DBExecutor if name == 'db' else InstrumentedExecutor
+            _executors[name] = executor_class(name, getattr(settings, POOL_SIZES[name]))
+        return _executors[name]
+
+
+def run_in(name, func, *args, **kwargs):
+    """Await a blocking call on the named pool, with the caller's contextvars."""
+    return sync_to_async(func, thread_sensitive=False, executor=get_executor(name))(*args, **kwargs)
+
+
+def in_executor(name):
+    """
+    Decorator turning a blocking function into a coroutine function that runs
+    on the named pool. Replaces @sync_to_async, whose default runs every call
+    in the process on one shared thread.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await run_in(name, func, *args, **kwargs)
+        return wrapper
+    return decorator
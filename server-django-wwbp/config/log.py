@@ -0,0 +1,108 @@
+import atexit
+import json
+import logging
+import logging.config
+import logging.handlers
+import queue
+import threading
+from collections import defaultdict
+
+from langchain_stream.tracing import current_turn
+
+# Attributes every LogRecord has; anything else on a record came in through `extra`
+RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread without formatting them. The stock
+    QueueHandler merges msg % args in the caller, which for us is the event
+    loop; here the listener does all formatting and I/O. Arguments are
+    formatted after the call returns, so don't log objects you mutate next.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class TurnContextFilter(logging.Filter):
+    """Stamp records with the chat turn (session_id, message_id) the caller is serving."""
+
+    def filter(self, record):
+        turn = current_turn.get()
+        if turn and not hasattr(record, 'session_id'):
+            record.session_id, record.message_id = turn
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep one in LOG_SAMPLE_EVERY records that carry extra={'sample': <key>},
+    counted per key, for per-delta and per-chunk events. Other records pass.
+    """
+
+    def __init__(self, every=50):
+        super().__init__()
+        self.every = max(1, int(every))
+        self.counts = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, 'sample', None)
+        if key is None:
+            return True
+        with self.lock:
+            self.counts[key] += 1
+            count = self.counts[key]
+        record.sampled = self.every
+        return count % self.every == 1 or self.every == 1
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with `extra` fields as top-level keys."""
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS and key != 'sample':
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else repr(value)
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+_listener = None
+
+
+def configure(logging_settings):
+    """
+    LOGGING_CONFIG entry point. Applies the dictConfig, then moves every
+    handler behind one queue drained by a background listener thread, so
+    logging calls on the event loop only filter and enqueue.
+    """
+    global _listener
+    logging.config.dictConfig(logging_settings)
+
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    if not handlers or _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    for handler in handlers:
+        # Filters run in the caller, before the record is queued
+        for log_filter in handler.filters:
+            queue_handler.addFilter(log_filter)
+        handler.filters = []
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
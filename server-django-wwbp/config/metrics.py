@@ -0,0 +1,120 @@
+import hmac
+import inspect
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess, REGISTRY)
+
+# Seconds; spans fast cache/DB work up to slow LLM runs
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 21, 34, 60)
+
+STAGE_SECONDS = Histogram(
+    'wwbp_stage_seconds',
+    'Latency of one pipeline stage (moderation, stt, ffmpeg, tts_chunk, time_to_first_token, ...)',
+    ['stage'], buckets=LATENCY_BUCKETS)
+STAGE_ERRORS = Counter(
+    'wwbp_stage_errors_total', 'Pipeline stages that raised', ['stage'])
+WEBSOCKETS_ACTIVE = Gauge(
+    'wwbp_websockets_active', 'Open websocket connections', ['consumer'],
+    multiprocess_mode='livesum')
+RUNS_IN_FLIGHT = Gauge(
+    'wwbp_runs_in_flight', 'Assistant runs currently streaming', ['consumer'],
+    multiprocess_mode='livesum')
+MESSAGES = Counter(
+    'wwbp_messages_total', 'Messages received by consumers', ['consumer', 'outcome'])
+DISPATCHES = Counter(
+    'wwbp_dispatches_total',
+    'Runs streamed to the producing socket only (local), fanned out to its peers (group), '
+    'queued behind the producer already streaming (pending), handed to the socket that '
+    'queued them (handoff), or dropped after waiting too long (dropped)', ['path'])
+EXECUTOR_QUEUED = Gauge(
+    'wwbp_executor_queued', 'Jobs waiting for a thread in each executor pool', ['pool'],
+    multiprocess_mode='livesum')
+EXECUTOR_ACTIVE = Gauge(
+    'wwbp_executor_active', 'Jobs running in each executor pool', ['pool'],
+    multiprocess_mode='livesum')
+EXECUTOR_WAIT = Histogram(
+    'wwbp_executor_wait_seconds', 'Time a job queued before an executor thread picked it up', ['pool'],
+    buckets=LATENCY_BUCKETS)
+DB_POOL_CONNECTIONS = Gauge(
+    'wwbp_db_pool_connections', 'Persistent database connections held by db executor threads',
+    multiprocess_mode='livesum')
+DB_CONNECTIONS_OPENED = Counter(
+    'wwbp_db_connections_opened_total', 'New database connections, from any thread', ['alias'])
+ROUTED_READS = Counter(
+    'wwbp_db_routed_reads_total',
+    'Replica-eligible reads, by where they went (replica, or primary_pinned after a recent write)',
+    ['alias'])
+HEARTBEAT_RTT = Histogram(
+    'wwbp_heartbeat_rtt_seconds', 'Time from a heartbeat ping to the client pong',
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+HEARTBEAT_SOCKETS = Gauge(
+    'wwbp_heartbeat_sockets', 'Websockets registered with the heartbeat manager',
+    multiprocess_mode='livesum')
+DEAD_SOCKETS = Counter(
+    'wwbp_dead_sockets_total', 'Websockets closed by the heartbeat manager', ['reason'])
+RESUMED_FRAMES = Counter(
+    'wwbp_resumed_frames_total', 'Run frames replayed from the delta log to reconnecting sockets')
+
+
+def observe(stage, seconds):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Time the enclosed block as one stage. Works around awaits too, so the
+    whole wall-clock latency of an async step is recorded.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+def timed(stage):
+    """Decorator form of stage_timer for sync and async functions."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage_timer(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. With PROMETHEUS_MULTIPROC_DIR set, samples
+    from every worker process are merged. Scrapers send METRICS_TOKEN as a
+    bearer token; without one set, only local development serves the page.
+    """
+    token = settings.METRICS_TOKEN
+    if not token:
+        if settings.ENVIRONMENT != 'local':
+            return HttpResponseForbidden()
+    elif not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return HttpResponseForbidden()
+
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
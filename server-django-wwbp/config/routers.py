@@ -0,0 +1,104 @@
+import contextvars
+import hashlib
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+
+from config.metrics import ROUTED_READS
+
+REPLICA = 'replica'
+
+# True inside replica_reads(): reads in this block may be served by the replica
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+# Per-request state: {"pinned": bool, "wrote": bool}, set by ReplicaPinMiddleware
+_request_state = contextvars.ContextVar('replica_request_state', default=None)
+
+
+def replica_enabled():
+    return REPLICA in settings.DATABASES
+
+
+@contextmanager
+def replica_reads():
+    """Route the reads in this block to the replica, when one is configured."""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def use_replica(func):
+    """Decorator form of replica_reads."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+    Reads inside replica_reads() go to the 'replica' alias; everything else,
+    and every write, goes to 'default'. A client that wrote recently is pinned
+    to the primary (see ReplicaPinMiddleware) so it reads its own writes
+    despite replica lag. Without a replica configured this is a no-op.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get() or not replica_enabled():
+            return None
+        state = _request_state.get()
+        if state and (state['pinned'] or state['wrote']):
+            ROUTED_READS.labels('primary_pinned').inc()
+            return 'default'
+        ROUTED_READS.labels(REPLICA).inc()
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state['wrote'] = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is fed by replication, never migrated directly
+        return db != REPLICA
+
+
+def pin_key(request):
+    """Identify the client by its token or session, which are known before DRF authenticates."""
+    credential = request.headers.get('Authorization') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credential:
+        return None
+    return f"replica_pin_{hashlib.sha1(credential.encode()).hexdigest()}"
+
+
+class ReplicaPinMiddleware:
+    """
+    Read-your-writes for replica reads: after a request that writes, the same
+    client reads from the primary for REPLICA_PIN_SECONDS.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not replica_enabled():
+            return self.get_response(request)
+        key = pin_key(request)
+        state = {"pinned": bool(key and cache.get(key)), "wrote": False}
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        if key and state['wrote']:
+            cache.set(key, 1, timeout=settings.REPLICA_PIN_SECONDS)
+        return response
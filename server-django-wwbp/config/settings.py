@@ -44,13 +44,31 @@ else:
     ALLOWED_HOSTS.append(internal_ip)
 del requests
 
+# Logging goes through config.log.configure: every handler sits behind one
+# queue drained by a listener thread, records are formatted there, and
+# per-delta stream events are sampled (1 in LOG_SAMPLE_EVERY). Levels can be
+# set per subsystem; LOG_FORMAT=json emits one structured record per line.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG' if DEBUG else 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'verbose')
+LOG_SAMPLE_EVERY = int(os.getenv('LOG_SAMPLE_EVERY', '50'))
+LOGGING_CONFIG = 'config.log.configure'
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'turn_context': {
+            '()': 'config.log.TurnContextFilter',
+        },
+        'sampling': {
+            '()': 'config.log.SamplingFilter',
+            'every': LOG_SAMPLE_EVERY,
+        },
+    },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
-            'formatter': 'verbose',
+            'formatter': LOG_FORMAT,
+            'filters': ['turn_context', 'sampling'],
         },
     },
     'formatters': {
@@ -58,27 +76,30 @@ LOGGING = {
             'format': '{levelname} {asctime} {module} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'config.log.JsonFormatter',
+        },
     },
     'root': {
         'handlers': ['console'],
-        'level': 'DEBUG',
+        'level': LOG_LEVEL,
     },
     'loggers': {
         'config': {
-            'handlers': ['console'],
-            'level': 'DEBUG',
-            'propagate': True,
+            'level': os.getenv('LOG_LEVEL_CONFIG', LOG_LEVEL),
         },
         'accounts': {
-            'handlers': ['console'],
-            'level': 'DEBUG',
-            'propagate': True,
+            'level': os.getenv('LOG_LEVEL_ACCOUNTS', LOG_LEVEL),
         },
         'langchain_stream': {
-            'handlers': ['console'],
-            'level': 'DEBUG',
-            'propagate': True,
+            'level': os.getenv('LOG_LEVEL_STREAM', LOG_LEVEL),
         },
+        # Third-party chatter that drowns DEBUG output
+        'botocore': {'level': 'INFO'},
+        'urllib3': {'level': 'INFO'},
+        'httpcore': {'level': 'INFO'},
+        'openai': {'level': 'INFO'},
+        'asyncio': {'level': 'INFO'},
     },
 }
 
@@ -99,17 +120,16 @@ INSTALLED_APPS = [
     'rest_framework.authtoken',
     'langchain_stream',
     'channels_redis',
-    'silk',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
-    'silk.middleware.SilkyMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'config.routers.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -130,6 +150,43 @@ else:
 AWS_S3_REGION_NAME = os.getenv('AWS_S3_REGION_NAME', 'a')
 AWS_STORAGE_BUCKET_NAME = os.getenv('AWS_STORAGE_BUCKET_NAME', 'a')
 
+# Object storage used for audio, uploads, exports and snapshots (config/storage.py):
+# 'filesystem' (under STORAGE_ROOT), 's3' or 'memory'
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'filesystem' if ENVIRONMENT == 'local' else 's3')
+STORAGE_ROOT = os.getenv('STORAGE_ROOT', str(BASE_DIR))
+STORAGE_MAX_POOL_CONNECTIONS = int(os.getenv('STORAGE_MAX_POOL_CONNECTIONS', '32'))
+
+# Background audio archival: clips are spooled here and uploaded to S3 off the
+# message path with bounded concurrency and retries
+AUDIO_SPOOL_DIR = os.getenv('AUDIO_SPOOL_DIR', os.path.join(BASE_DIR, 'data/spool/audio'))
+AUDIO_ARCHIVE_CONCURRENCY = int(os.getenv('AUDIO_ARCHIVE_CONCURRENCY', '4'))
+AUDIO_ARCHIVE_MAX_RETRIES = int(os.getenv('AUDIO_ARCHIVE_MAX_RETRIES', '5'))
+
+# Background re-encode of archived clips to mono Opus: ffmpeg worker count
+# (one thread each, so this is the CPU limit), nice level, target bitrate and
+# the minimum clip age before it is picked up
+AUDIO_REENCODE_WORKERS = int(os.getenv('AUDIO_REENCODE_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+AUDIO_REENCODE_NICE = int(os.getenv('AUDIO_REENCODE_NICE', '10'))
+AUDIO_REENCODE_BITRATE = os.getenv('AUDIO_REENCODE_BITRATE', '24k')
+AUDIO_REENCODE_MIN_AGE_MINUTES = int(os.getenv('AUDIO_REENCODE_MIN_AGE_MINUTES', '60'))
+# Runs a clip may fail before it is skipped and the watermark moves past it
+AUDIO_REENCODE_MAX_ATTEMPTS = int(os.getenv('AUDIO_REENCODE_MAX_ATTEMPTS', '3'))
+
+# Transcript export engine: date-range shard size ('day' or 'week') and the
+# number of worker processes that export shards in parallel
+TRANSCRIPT_EXPORT_SHARD = os.getenv('TRANSCRIPT_EXPORT_SHARD', 'day')
+TRANSCRIPT_EXPORT_WORKERS = int(os.getenv('TRANSCRIPT_EXPORT_WORKERS', '4'))
+# Concurrent audio fetches when an export bundles the referenced clips
+TRANSCRIPT_EXPORT_AUDIO_CONCURRENCY = int(
+    os.getenv('TRANSCRIPT_EXPORT_AUDIO_CONCURRENCY', '8'))
+# Minutes after a US/Eastern midnight before the previous day is sealed into
+# immutable snapshot shards by `manage.py snapshot_transcripts`
+TRANSCRIPT_SNAPSHOT_SEAL_DELAY_MINUTES = int(
+    os.getenv('TRANSCRIPT_SNAPSHOT_SEAL_DELAY_MINUTES', '60'))
+# Concurrent downloads of stored snapshot shards when an export reuses them
+TRANSCRIPT_SNAPSHOT_FETCH_WORKERS = int(
+    os.getenv('TRANSCRIPT_SNAPSHOT_FETCH_WORKERS', '8'))
+
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
@@ -140,6 +197,10 @@ CACHES = {
     }
 }
 
+# Number of recent transcript messages per session kept warm in the cache for
+# the session history endpoint
+SESSION_HISTORY_TAIL_SIZE = int(os.getenv('SESSION_HISTORY_TAIL_SIZE', '50'))
+
 # Session Engine
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
 SESSION_CACHE_ALIAS = "default"
@@ -206,9 +267,33 @@ DATABASES = {
         'PASSWORD': os.getenv('DATABASE_PASSWORD', ''),
         'HOST': os.getenv('DATABASE_HOST', ''),
         'PORT': os.getenv('DATABASE_PORT', ''),
+        # HTTP runs under daphne (ASGI), where a persistent connection is left
+        # open on whichever thread served the request and never reused, so
+        # requests close theirs (0). The consumers' db executor threads keep
+        # theirs for DB_EXECUTOR_CONN_MAX_AGE instead; either way a reused
+        # connection is pinged first
+        'CONN_MAX_AGE': int(os.getenv('DATABASE_CONN_MAX_AGE', '0')),
+        'CONN_HEALTH_CHECKS': os.getenv('DATABASE_CONN_HEALTH_CHECKS', 'True') == 'True',
     }
 }
 
+# Optional read replica for exports, history pages and list endpoints
+# (config/routers.py). Set DATABASE_REPLICA_HOST, or DATABASE_REPLICA_NAME for
+# a second local SQLite file; unset fields are taken from the primary. After a
+# write, a client reads from the primary for REPLICA_PIN_SECONDS.
+if os.getenv('DATABASE_REPLICA_HOST') or os.getenv('DATABASE_REPLICA_NAME'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('DATABASE_REPLICA_NAME', DATABASES['default']['NAME']),
+        'USER': os.getenv('DATABASE_REPLICA_USER', DATABASES['default']['USER']),
+        'PASSWORD': os.getenv('DATABASE_REPLICA_PASSWORD', DATABASES['default']['PASSWORD']),
+        'HOST': os.getenv('DATABASE_REPLICA_HOST', DATABASES['default']['HOST']),
+        'PORT': os.getenv('DATABASE_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['config.routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '15'))
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -235,4 +320,77 @@ USE_TZ = True
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'accounts.User'
 
-SILKY_PYTHON_PROFILER = True
+# Silk request profiling. Off by default in production, and when enabled only
+# SILKY_INTERCEPT_PERCENT of requests are recorded and profiled
+SILK_ENABLED = os.getenv('SILK_ENABLED', str(ENVIRONMENT == 'local')) == 'True'
+if SILK_ENABLED:
+    INSTALLED_APPS.append('silk')
+    MIDDLEWARE.insert(MIDDLEWARE.index(
+        'corsheaders.middleware.CorsMiddleware') + 1, 'silk.middleware.SilkyMiddleware')
+SILKY_PYTHON_PROFILER = os.getenv('SILKY_PYTHON_PROFILER', 'True') == 'True'
+SILKY_INTERCEPT_PERCENT = int(os.getenv(
+    'SILKY_INTERCEPT_PERCENT', '100' if ENVIRONMENT == 'local' else '1'))
+SILKY_MAX_RECORDED_REQUESTS = int(os.getenv('SILKY_MAX_RECORDED_REQUESTS', '10000'))
+
+# Consumer turn profiler (langchain_stream/profiling.py): fraction of turns
+# sampled at random, sampling interval, and the cut-off for turns that never
+# complete. Individual sessions can also be armed from the profiles endpoint
+CONSUMER_PROFILE_SAMPLE_RATE = float(os.getenv('CONSUMER_PROFILE_SAMPLE_RATE', '0'))
+CONSUMER_PROFILE_INTERVAL_MS = int(os.getenv('CONSUMER_PROFILE_INTERVAL_MS', '5'))
+CONSUMER_PROFILE_MAX_SECONDS = int(os.getenv('CONSUMER_PROFILE_MAX_SECONDS', '120'))
+# How often each worker checks whether any session is armed; an arm can take
+# this long to be picked up
+CONSUMER_PROFILE_ARM_POLL_SECONDS = float(os.getenv('CONSUMER_PROFILE_ARM_POLL_SECONDS', '5'))
+
+# Prometheus scrape endpoint at /metrics, which scrapers reach with
+# METRICS_TOKEN as a bearer token. Outside local the endpoint stays closed
+# until the token is set; set PROMETHEUS_MULTIPROC_DIR to aggregate across
+# worker processes
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Per-turn trace spans (langchain_stream/tracing.py), kept in a local SQLite
+# file capped at TRACE_MAX_SPANS rows, or in Redis streams expiring after
+# TRACE_TTL_SECONDS
+TRACE_ENABLED = os.getenv('TRACE_ENABLED', 'True') == 'True'
+TRACE_STORE = os.getenv('TRACE_STORE', 'sqlite' if ENVIRONMENT == 'local' else 'redis')
+TRACE_SQLITE_PATH = os.getenv('TRACE_SQLITE_PATH', os.path.join(BASE_DIR, 'data/traces.sqlite3'))
+TRACE_MAX_SPANS = int(os.getenv('TRACE_MAX_SPANS', '200000'))
+TRACE_TTL_SECONDS = int(os.getenv('TRACE_TTL_SECONDS', str(3 * 24 * 3600)))
+
+# One run producer per session (langchain_stream/runqueue.py): the producer
+# lock's lifetime, refreshed while a run streams, so a worker that dies mid-run
+# frees the session this fast; how long a turn may wait behind other runs
+# before it is dropped and the client told; and where waiting turns are queued
+RUN_PRODUCER_LOCK_SECONDS = int(os.getenv('RUN_PRODUCER_LOCK_SECONDS', '30'))
+RUN_PENDING_MAX_SECONDS = int(os.getenv('RUN_PENDING_MAX_SECONDS', '300'))
+RUN_QUEUE_STORE = os.getenv('RUN_QUEUE_STORE', 'memory' if ENVIRONMENT == 'local' else 'redis')
+
+# Per-session log of run frames (langchain_stream/deltalog.py) that reconnecting
+# clients resume from: a Redis stream per session outside local, in memory
+# locally; either way capped at DELTA_LOG_MAX_ENTRIES and expiring
+# DELTA_LOG_TTL_SECONDS after the last run
+DELTA_LOG_STORE = os.getenv('DELTA_LOG_STORE', 'memory' if ENVIRONMENT == 'local' else 'redis')
+DELTA_LOG_MAX_ENTRIES = int(os.getenv('DELTA_LOG_MAX_ENTRIES', '2000'))
+DELTA_LOG_TTL_SECONDS = int(os.getenv('DELTA_LOG_TTL_SECONDS', '900'))
+
+# Thread pools for blocking work from consumers (config/executors.py): ORM and
+# cache calls (each thread holds its own DB connection), provider SDK calls,
+# and ffmpeg transcodes. Each db thread keeps its connection open for
+# DB_EXECUTOR_CONN_MAX_AGE seconds, so DB_EXECUTOR_WORKERS caps a worker's
+# consumer connections
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', '8'))
+DB_EXECUTOR_CONN_MAX_AGE = int(os.getenv('DB_EXECUTOR_CONN_MAX_AGE', '300'))
+SDK_EXECUTOR_WORKERS = int(os.getenv('SDK_EXECUTOR_WORKERS', '64'))
+CPU_EXECUTOR_WORKERS = int(os.getenv('CPU_EXECUTOR_WORKERS', str(os.cpu_count() or 2)))
+
+# Websocket heartbeat (langchain_stream/heartbeat.py): ping interval, silence
+# after which an idle socket is closed, and the timer wheel's tick
+HEARTBEAT_INTERVAL_SECONDS = int(os.getenv('HEARTBEAT_INTERVAL_SECONDS', '30'))
+HEARTBEAT_TIMEOUT_SECONDS = int(os.getenv('HEARTBEAT_TIMEOUT_SECONDS', '95'))
+HEARTBEAT_TICK_SECONDS = float(os.getenv('HEARTBEAT_TICK_SECONDS', '1'))
+
+# Event-loop watchdog (config/watchdog.py): how often each ASGI worker checks
+# its loop, and the lag beyond which the blocking stack is logged
+LOOP_WATCHDOG_ENABLED = os.getenv('LOOP_WATCHDOG_ENABLED', 'True') == 'True'
+LOOP_WATCHDOG_INTERVAL_MS = int(os.getenv('LOOP_WATCHDOG_INTERVAL_MS', '100'))
+LOOP_LAG_THRESHOLD_MS = int(os.getenv('LOOP_LAG_THRESHOLD_MS', '250'))
@@ -0,0 +1,300 @@
+import io
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from functools import lru_cache
+from urllib.parse import urlparse
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+SPOOL_MAX_MEMORY = 1024 * 1024
+MULTIPART_CHUNK_SIZE = 5 * 1024 * 1024
+
+
+class BaseStorage:
+    """
+    Object storage addressed by keys such as "data/audio/<file>". Every
+    backend turns a key into the link stored on rows (audio_link, file_url,
+    module files) and back again with key_from_url. The sync methods are
+    used from worker threads and management commands; the `a` prefixed
+    methods run them off the event loop for consumers and async views.
+    """
+    remote = False
+
+    def put(self, key, body):
+        """Store bytes or a readable file object under key and return its link."""
+        raise NotImplementedError
+
+    def put_file(self, key, path):
+        with open(path, 'rb') as body:
+            return self.put(key, body)
+
+    def open(self, key):
+        """Return a seekable, readable file object for key."""
+        raise NotImplementedError
+
+    def stream(self, key, chunk_size=CHUNK_SIZE):
+        """Yield the body of key in chunks without reading it all into memory."""
+        with self.open(key) as body:
+            while True:
+                chunk = body.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def download(self, key, path):
+        with self.open(key) as body, open(path, 'wb') as dest:
+            shutil.copyfileobj(body, dest, CHUNK_SIZE)
+        return path
+
+    def local_path(self, key):
+        """A filesystem path for key if the backend has one, else None."""
+        return None
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def size(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def url(self, key):
+        raise NotImplementedError
+
+    def key_from_url(self, url):
+        raise NotImplementedError
+
+    def presign(self, key, expires=3600):
+        """A temporary download URL, or None if the backend serves files itself."""
+        return None
+
+    def presign_post(self, key, content_type, expires=3600):
+        """Presigned POST fields for a direct browser upload, or None."""
+        return None
+
+    async def aput(self, key, body):
+        return await sync_to_async(self.put, thread_sensitive=False)(key, body)
+
+    async def aput_file(self, key, path):
+        return await sync_to_async(self.put_file, thread_sensitive=False)(key, path)
+
+    async def aopen(self, key):
+        return await sync_to_async(self.open, thread_sensitive=False)(key)
+
+    async def adelete(self, key):
+        return await sync_to_async(self.delete, thread_sensitive=False)(key)
+
+    async def apresign(self, key, expires=3600):
+        return await sync_to_async(self.presign, thread_sensitive=False)(key, expires)
+
+    async def astream(self, key, chunk_size=CHUNK_SIZE):
+        chunks = self.stream(key, chunk_size)
+        next_chunk = sync_to_async(next, thread_sensitive=False)
+        while True:
+            chunk = await next_chunk(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+
+
+class FileSystemStorage(BaseStorage):
+    """Keys are paths under root; links are absolute filesystem paths."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Key escapes storage root: {key}")
+        return path
+
+    def put(self, key, body):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as dest:
+            if isinstance(body, (bytes, bytearray, memoryview)):
+                dest.write(body)
+            else:
+                shutil.copyfileobj(body, dest, CHUNK_SIZE)
+        return path
+
+    def put_file(self, key, path):
+        dest = self.path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copyfile(path, dest)
+        return dest
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def local_path(self, key):
+        return self.path(key)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def url(self, key):
+        return self.path(key)
+
+    def key_from_url(self, url):
+        if os.path.isabs(url):
+            return os.path.relpath(url, self.root)
+        return url
+
+
+class S3Storage(BaseStorage):
+    """
+    One boto3 client per process, shared by every thread, with a connection
+    pool sized by STORAGE_MAX_POOL_CONNECTIONS. Large bodies go up as multipart
+    transfers; links are virtual-hosted bucket URLs.
+    """
+    remote = True
+
+    def __init__(self, bucket, region, max_pool_connections):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+
+        self.bucket = bucket
+        self.region = region
+        self.client = boto3.client('s3', region_name=region, config=Config(
+            max_pool_connections=max_pool_connections,
+            retries={'max_attempts': 5, 'mode': 'adaptive'},
+        ))
+        self.transfer_config = TransferConfig(
+            multipart_threshold=MULTIPART_CHUNK_SIZE,
+            multipart_chunksize=MULTIPART_CHUNK_SIZE,
+            max_concurrency=4,
+        )
+
+    def put(self, key, body):
+        if isinstance(body, (bytes, bytearray, memoryview)):
+            body = io.BytesIO(body)
+        self.client.upload_fileobj(body, self.bucket, key, Config=self.transfer_config)
+        return self.url(key)
+
+    def put_file(self, key, path):
+        self.client.upload_file(path, self.bucket, key, Config=self.transfer_config)
+        return self.url(key)
+
+    def open(self, key):
+        # Small objects stay in memory, large ones spill to disk
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+        self.client.download_fileobj(self.bucket, key, body, Config=self.transfer_config)
+        body.seek(0)
+        return body
+
+    def stream(self, key, chunk_size=CHUNK_SIZE):
+        body = self.client.get_object(Bucket=self.bucket, Key=key)['Body']
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def download(self, key, path):
+        self.client.download_file(self.bucket, key, path, Config=self.transfer_config)
+        return path
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except self.client.exceptions.ClientError:
+            return False
+
+    def size(self, key):
+        return self.client.head_object(Bucket=self.bucket, Key=key)['ContentLength']
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def url(self, key):
+        return f"https://{self.bucket}.s3.{self.region}.amazonaws.com/{key}"
+
+    def key_from_url(self, url):
+        if url.startswith('https://'):
+            return urlparse(url).path.lstrip('/')
+        return url
+
+    def presign(self, key, expires=3600):
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': key}, ExpiresIn=expires)
+
+    def presign_post(self, key, content_type, expires=3600):
+        return self.client.generate_presigned_post(
+            Bucket=self.bucket,
+            Key=key,
+            Fields={"Content-Type": content_type},
+            Conditions=[{"Content-Type": content_type}],
+            ExpiresIn=expires
+        )
+
+
+class InMemoryStorage(BaseStorage):
+    """Process-local storage for offline runs and scripts; links are memory://<key>."""
+
+    def __init__(self):
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def put(self, key, body):
+        if not isinstance(body, (bytes, bytearray, memoryview)):
+            body = body.read()
+        with self.lock:
+            self.objects[key] = bytes(body)
+        return self.url(key)
+
+    def open(self, key):
+        with self.lock:
+            if key not in self.objects:
+                raise FileNotFoundError(key)
+            return io.BytesIO(self.objects[key])
+
+    def exists(self, key):
+        return key in self.objects
+
+    def size(self, key):
+        return len(self.objects[key])
+
+    def delete(self, key):
+        with self.lock:
+            self.objects.pop(key, None)
+
+    def url(self, key):
+        return f"memory://{key}"
+
+    def key_from_url(self, url):
+        if url.startswith('memory://'):
+            return url[len('memory://'):]
+        return url
+
+
+@lru_cache(maxsize=None)
+def get_storage():
+    backend = settings.STORAGE_BACKEND
+    if backend == 'filesystem':
+        return FileSystemStorage(settings.STORAGE_ROOT)
+    if backend == 's3':
+        return S3Storage(settings.AWS_STORAGE_BUCKET_NAME, settings.AWS_S3_REGION_NAME,
+                         settings.STORAGE_MAX_POOL_CONNECTIONS)
+    if backend == 'memory':
+        return InMemoryStorage()
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -3,13 +3,18 @@ from django.urls import include, path
 from django.conf import settings
 from django.conf.urls.static import static
 
+from config.metrics import metrics_view
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include('accounts.urls')),
-    path('silk/', include('silk.urls', namespace='silk')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
+if settings.SILK_ENABLED:
+    urlpatterns += [path('silk/', include('silk.urls', namespace='silk'))]
+
 if settings.DEBUG:
     urlpatterns += static(settings.STATIC_URL,
                           document_root=settings.STATIC_ROOT)
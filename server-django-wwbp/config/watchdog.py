@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = Histogram(
+    'wwbp_loop_lag_seconds', 'How late the event loop ran a timer scheduled to fire on time',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+LOOP_LAG_CURRENT = Gauge(
+    'wwbp_loop_lag_current_seconds',
+    'Latest loop lag; while the loop is stalled, how long it has been stalled so far',
+    multiprocess_mode='livemax')
+LOOP_STALLS = Counter(
+    'wwbp_loop_stalls_total', 'Loop stalls over LOOP_LAG_THRESHOLD_MS, by the code site that blocked', ['site'])
+
+
+def blocking_site(frame):
+    """The innermost frame from our own code, as file:function, so stalls group by call site."""
+    base_dir = str(settings.BASE_DIR)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(base_dir) and 'site-packages' not in filename:
+            return f"{os.path.relpath(filename, base_dir)}:{frame.f_code.co_name}"
+        frame = frame.f_back
+    return 'unknown'
+
+
+class LoopWatchdog:
+    """
+    Measures event-loop lag with a timer coroutine on the loop, and watches it
+    from a separate thread. When the loop misses its heartbeat for longer than
+    the threshold, the thread dumps the loop thread's stack (the blocking call
+    is on it at that moment) once per stall.
+    """
+
+    def __init__(self, loop, interval, threshold):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+
+    def start(self):
+        self.loop.create_task(self.tick())
+        threading.Thread(target=self.watch, name='loop-watchdog', daemon=True).start()
+
+    async def tick(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - expected)
+            self.heartbeat = time.monotonic()
+            LOOP_LAG.observe(lag)
+            LOOP_LAG_CURRENT.set(lag)
+
+    def watch(self):
+        dumped_for = None
+        while True:
+            time.sleep(self.interval)
+            heartbeat = self.heartbeat
+            stalled_for = time.monotonic() - heartbeat - self.interval
+            if stalled_for < self.threshold:
+                continue
+            # A frozen worker cannot serve its own scrape, but with multiprocess
+            # metrics another worker can, so the stall is visible while it lasts
+            LOOP_LAG_CURRENT.set(stalled_for)
+            if dumped_for == heartbeat:
+                continue
+            # One dump per stall: the heartbeat does not move until the loop is free
+            dumped_for = heartbeat
+            self.dump(stalled_for)
+
+    def dump(self, stalled_for):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        if frame is None:
+            return
+        site = blocking_site(frame)
+        LOOP_STALLS.labels(site).inc()
+        task = asyncio.current_task(self.loop)
+        task_name = task.get_name() if task else 'no task'
+        coro = task.get_coro().__qualname__ if task else ''
+        logger.warning(
+            f"Event loop blocked for {stalled_for * 1000:.0f} ms at {site} ({task_name} {coro}):\n"
+            f"{''.join(traceback.format_stack(frame))}")
+
+
+_watchdog = None
+_watchdog_lock = threading.Lock()
+
+
+def ensure_watchdog():
+    """Start the watchdog for the running loop, once per worker process."""
+    global _watchdog
+    if _watchdog is not None or not settings.LOOP_WATCHDOG_ENABLED:
+        return
+    with _watchdog_lock:
+        if _watchdog is None:
+            _watchdog = LoopWatchdog(
+                asyncio.get_running_loop(),
+                settings.LOOP_WATCHDOG_INTERVAL_MS / 1000,
+                settings.LOOP_LAG_THRESHOLD_MS / 1000)
+            _watchdog.start()
+            logger.info(f"Loop watchdog started in process {os.getpid()}")
+
+
+class LoopWatchdogMiddleware:
+    """ASGI middleware that starts the watchdog on the worker's first connection."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        ensure_watchdog()
+        return await self.app(scope, receive, send)
@@ -6,6 +6,10 @@ python manage.py migrate
 # Collect static files
 python manage.py collectstatic --noinput
 
+# Fresh directory for per-process Prometheus metric files, shared by all workers
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 # Tail logs so they appear in STDOUT (optional)
 tail -F /var/log/gunicorn.stdout.log /var/log/gunicorn.stderr.log /var/log/daphne.stdout.log /var/log/daphne.stderr.log &
 
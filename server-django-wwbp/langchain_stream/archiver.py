@@ -0,0 +1,119 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.db import close_old_connections
+
+from config.metrics import stage_timer
+from config.storage import get_storage
+from langchain_stream.history import update_tail_audio
+
+logger = logging.getLogger(__name__)
+
+
+class AudioArchiver:
+    """
+    Moves transcript audio off the message path: clips are written to a local
+    spool directory and uploaded to remote storage by a bounded pool of
+    background threads, with retries. The transcript's audio_link is filled
+    in once the upload completes. Spooled clips survive restarts and are
+    re-queued by `manage.py flush_audio_spool`.
+    """
+
+    def __init__(self, spool_dir, max_concurrency, max_retries):
+        self.spool_dir = spool_dir
+        self.max_retries = max_retries
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix='audio-archiver')
+        self.storage = get_storage()
+
+    def archive(self, transcript, audio_bytes, file_name):
+        spool_path = os.path.join(self.spool_dir, file_name)
+        job = {
+            "transcript_id": transcript.id,
+            "session_id": transcript.session_id,
+            "key": f"data/audio/{file_name}",
+            "spool_path": spool_path,
+        }
+        with open(spool_path, "wb") as audio_file:
+            audio_file.write(audio_bytes)
+        # The sidecar is written last, so only complete clips are ever resumed
+        with open(f"{spool_path}.json", "w") as sidecar:
+            json.dump(job, sidecar)
+        return self.executor.submit(self._upload, job)
+
+    def resume_pending(self):
+        resumed = 0
+        for name in os.listdir(self.spool_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.spool_dir, name)) as sidecar:
+                    job = json.load(sidecar)
+                self.executor.submit(self._upload, job)
+                resumed += 1
+            except Exception as e:
+                logger.error(f"Error resuming spooled audio {name}: {e}")
+        if resumed:
+            logger.info(f"Resumed {resumed} spooled audio uploads")
+        return resumed
+
+    def _upload(self, job):
+        if not os.path.exists(job["spool_path"]):
+            logger.debug(f"Spooled audio {job['key']} already archived")
+            return None
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                with stage_timer('audio_archive'):
+                    audio_link = self.storage.put_file(job["key"], job["spool_path"])
+                break
+            except Exception as e:
+                logger.warning(
+                    f"Audio upload attempt {attempt} failed for {job['key']}: {e}")
+                if attempt == self.max_retries:
+                    logger.error(
+                        f"Giving up on audio upload for {job['key']}; left in spool")
+                    return None
+                time.sleep(min(2 ** attempt, 30))
+
+        Transcript = apps.get_model('langchain_stream', 'Transcript')
+        close_old_connections()
+        try:
+            Transcript.objects.filter(id=job["transcript_id"]).update(
+                has_audio=True, audio_link=audio_link)
+        finally:
+            close_old_connections()
+        update_tail_audio(job["session_id"], job["transcript_id"], audio_link)
+
+        for path in (f"{job['spool_path']}.json", job["spool_path"]):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        logger.info(f"Archived audio for transcript {job['transcript_id']} at {audio_link}")
+        return audio_link
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+_archiver = None
+_archiver_lock = threading.Lock()
+
+
+def get_archiver():
+    global _archiver
+    with _archiver_lock:
+        if _archiver is None:
+            _archiver = AudioArchiver(
+                spool_dir=settings.AUDIO_SPOOL_DIR,
+                max_concurrency=settings.AUDIO_ARCHIVE_CONCURRENCY,
+                max_retries=settings.AUDIO_ARCHIVE_MAX_RETRIES,
+            )
+        return _archiver
@@ -0,0 +1,208 @@
+import json
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryDeltaStore:
+    """
+    Per-process log for local development, where one worker serves every
+    socket. Like the Redis store, a session's log (audio included) is dropped
+    `ttl` seconds after its last write.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.logs = defaultdict(lambda: deque(maxlen=max_entries))
+        self.written = {}
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+    def expire(self, now):
+        for session_id, written in list(self.written.items()):
+            if now - written > self.ttl:
+                del self.written[session_id]
+                self.logs.pop(session_id, None)
+
+    def write(self, entries):
+        now = time.monotonic()
+        with self.lock:
+            self.expire(now)
+            for session_id, seq, text_data, bytes_data in entries:
+                self.logs[session_id].append((seq, text_data, bytes_data))
+                self.written[session_id] = now
+
+    def last_seq(self, session_id):
+        with self.lock:
+            self.expire(time.monotonic())
+            log = self.logs.get(str(session_id))
+            return log[-1][0] if log else 0
+
+    def read(self, session_id, after):
+        with self.lock:
+            self.expire(time.monotonic())
+            return [entry for entry in self.logs.get(str(session_id), ()) if entry[0] > after]
+
+
+class RedisDeltaStore:
+    """
+    One capped Redis stream per session. Redis assigns the entry ids and the
+    sequence number travels as a field, so an out-of-order seq (a second
+    worker, or a restarted one, appending to the same stream) cannot make
+    XADD reject a frame. Audio chunks are stored under their own keys and the
+    stream holds a reference, so replays of text stay cheap. Everything
+    expires after DELTA_LOG_TTL_SECONDS without a new run.
+    """
+
+    # Entries fetched per XREVRANGE while walking back to a resume cursor
+    READ_BATCH = 200
+
+    def __init__(self, max_entries, ttl):
+        from django_redis import get_redis_connection
+        self.redis = get_redis_connection('default')
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    def write(self, entries):
+        pipe = self.redis.pipeline(transaction=False)
+        for session_id, seq, text_data, bytes_data in entries:
+            stream = f"delta_log:{session_id}"
+            if bytes_data is not None:
+                fields = {"seq": seq, "audio": f"delta_audio:{session_id}:{seq}"}
+                pipe.set(fields["audio"], bytes_data, ex=self.ttl)
+            else:
+                fields = {"seq": seq, "text": text_data}
+            pipe.xadd(stream, fields, maxlen=self.max_entries, approximate=True)
+            pipe.expire(stream, self.ttl)
+        pipe.execute()
+
+    def last_seq(self, session_id):
+        # The highest of the newest entries, in case a late writer appended a lower seq last
+        entries = self.redis.xrevrange(f"delta_log:{session_id}", count=self.READ_BATCH)
+        return max((int(fields[b'seq']) for _, fields in entries), default=0)
+
+    def read(self, session_id, after):
+        # Walk back from the newest entry until the cursor is passed; resumes
+        # usually want only the last few frames
+        stream = f"delta_log:{session_id}"
+        entries = []
+        newest = '+'
+        while True:
+            batch = self.redis.xrevrange(stream, max=newest, count=self.READ_BATCH)
+            entries.extend(batch)
+            if len(batch) < self.READ_BATCH or any(int(fields[b'seq']) <= after for _, fields in batch):
+                break
+            # Exclusive bound: continue below the oldest entry read so far
+            newest = b'(' + batch[-1][0]
+        entries = sorted(((int(fields[b'seq']), fields) for _, fields in entries if int(fields[b'seq']) > after),
+                         key=lambda entry: entry[0])
+
+        refs = [fields[b'audio'] for _, fields in entries if b'audio' in fields]
+        audio = dict(zip(refs, self.redis.mget(refs))) if refs else {}
+        result = []
+        for seq, fields in entries:
+            if b'audio' in fields:
+                # The clip expired or was trimmed; skip it rather than send nothing
+                if audio.get(fields[b'audio']) is not None:
+                    result.append((seq, None, audio[fields[b'audio']]))
+            else:
+                result.append((seq, fields[b'text'].decode('utf-8'), None))
+        return result
+
+
+class DeltaLog:
+    """
+    Short-lived log of every run frame per session, so a socket that drops
+    mid-answer can reconnect and catch up instead of asking again. Sequence
+    numbers are assigned in-process (only the session's run producer appends)
+    and entries are written in batches from one background thread, so the
+    stream loop never waits on Redis. A session's counter is forgotten along
+    with its log, DELTA_LOG_TTL_SECONDS after its last frame.
+    """
+
+    def __init__(self, store, ttl):
+        self.store = store
+        self.ttl = ttl
+        # session_id -> (last seq, monotonic time it was assigned)
+        self.seqs = {}
+        self.seqs_lock = threading.Lock()
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, name='delta-log', daemon=True)
+        self.thread.start()
+
+    def start_run(self, session_id):
+        """Sync the session's counter with its stored log. Blocks; run it off the event loop."""
+        session_id = str(session_id)
+        last_seq = self.store.last_seq(session_id)
+        now = time.monotonic()
+        with self.seqs_lock:
+            for stale, (_, assigned) in list(self.seqs.items()):
+                if now - assigned > self.ttl:
+                    del self.seqs[stale]
+            seq = self.seqs.get(session_id, (0, now))[0]
+            self.seqs[session_id] = (max(seq, last_seq), now)
+
+    def next_seq(self, session_id):
+        session_id = str(session_id)
+        with self.seqs_lock:
+            seq = self.seqs.get(session_id, (0, None))[0] + 1
+            self.seqs[session_id] = (seq, time.monotonic())
+        return seq
+
+    def append_text(self, session_id, frame):
+        """Number a JSON frame, queue it, and return it serialized with its `seq`."""
+        frame["seq"] = self.next_seq(session_id)
+        text_data = json.dumps(frame)
+        self.queue.put((str(session_id), frame["seq"], text_data, None))
+        return text_data
+
+    def append_audio(self, session_id, bytes_data):
+        """Number an audio chunk and queue it; returns its `seq`."""
+        seq = self.next_seq(session_id)
+        self.queue.put((str(session_id), seq, None, bytes_data))
+        return seq
+
+    def read(self, session_id, after):
+        """
+        Entries after `after` as (seq, text_data, bytes_data). A cursor from
+        a log that has since expired and restarted reads from the beginning.
+        """
+        if after > self.store.last_seq(session_id):
+            after = 0
+        return self.store.read(session_id, after)
+
+    def run(self):
+        while True:
+            entries = [self.queue.get()]
+            try:
+                while len(entries) < 200:
+                    entries.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                self.store.write(entries)
+            except Exception as e:
+                logger.error(f"Error writing {len(entries)} delta log entries: {e}")
+
+
+def make_store():
+    if settings.DELTA_LOG_STORE == 'redis':
+        return RedisDeltaStore(settings.DELTA_LOG_MAX_ENTRIES, settings.DELTA_LOG_TTL_SECONDS)
+    return MemoryDeltaStore(settings.DELTA_LOG_MAX_ENTRIES, settings.DELTA_LOG_TTL_SECONDS)
+
+
+_delta_log = None
+_delta_log_lock = threading.Lock()
+
+
+def get_delta_log():
+    global _delta_log
+    with _delta_log_lock:
+        if _delta_log is None:
+            _delta_log = DeltaLog(make_store(), settings.DELTA_LOG_TTL_SECONDS)
+        return _delta_log
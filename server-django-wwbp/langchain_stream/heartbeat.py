@@ -0,0 +1,106 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from config.metrics import DEAD_SOCKETS, HEARTBEAT_RTT, HEARTBEAT_SOCKETS
+
+logger = logging.getLogger(__name__)
+
+
+class HeartbeatManager:
+    """
+    Pings every websocket of a worker from one task, on a timer wheel: each
+    socket sits in one of interval/tick slots and the task visits one slot per
+    tick, so pings are spread evenly over the interval instead of one sleeping
+    task per socket. Pongs give the round-trip time and liveness; a socket
+    silent for longer than the timeout is closed.
+    """
+
+    def __init__(self, interval, timeout, tick):
+        self.tick = tick
+        self.timeout = timeout
+        self.slots = [set() for _ in range(max(1, round(interval / tick)))]
+        self.cursor = 0
+        self.slot_of = {}
+        self.task = None
+
+    def register(self, consumer):
+        if consumer in self.slot_of:
+            return
+        # The slot the wheel reaches last, so the first ping is a full interval away
+        slot = self.cursor
+        self.slots[slot].add(consumer)
+        self.slot_of[consumer] = slot
+        consumer.last_pong = time.monotonic()
+        consumer.ping_sent_at = None
+        HEARTBEAT_SOCKETS.inc()
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def unregister(self, consumer):
+        slot = self.slot_of.pop(consumer, None)
+        if slot is not None:
+            self.slots[slot].discard(consumer)
+            HEARTBEAT_SOCKETS.dec()
+
+    def pong(self, consumer):
+        now = time.monotonic()
+        consumer.last_pong = now
+        if getattr(consumer, 'ping_sent_at', None) is not None:
+            HEARTBEAT_RTT.observe(now - consumer.ping_sent_at)
+            consumer.ping_sent_at = None
+
+    async def run(self):
+        while self.slot_of:
+            await asyncio.sleep(self.tick)
+            self.cursor = (self.cursor + 1) % len(self.slots)
+            due = list(self.slots[self.cursor])
+            if due:
+                await asyncio.gather(*(self.beat(consumer) for consumer in due))
+
+    async def beat(self, consumer):
+        # A consumer handles one message at a time, so a pong can sit queued
+        # behind a long run; only judge sockets that are idle
+        if consumer.handling == 0 and time.monotonic() - consumer.last_pong > self.timeout:
+            logger.info(f"Closing websocket with no pong for {self.timeout}s: session_id={consumer.session_id}")
+            DEAD_SOCKETS.labels('timeout').inc()
+            await self.close(consumer)
+            return
+        try:
+            if consumer.ping_sent_at is None:
+                consumer.ping_sent_at = time.monotonic()
+            await consumer.send(text_data=json.dumps({"type": "ping"}))
+            logger.debug("Ping sent", extra={'sample': 'ping'})
+        except Exception as e:
+            logger.error(f"Error in ping: {e}")
+            DEAD_SOCKETS.labels('send_failed').inc()
+            await self.close(consumer)
+
+    async def close(self, consumer):
+        self.unregister(consumer)
+        try:
+            await consumer.close()
+        except Exception as e:
+            logger.debug(f"Error closing dead websocket: {e}")
+
+
+_heartbeat = None
+_heartbeat_lock = threading.Lock()
+
+
+def get_heartbeat():
+    """The worker's heartbeat manager; daphne runs one event loop per process."""
+    global _heartbeat
+    with _heartbeat_lock:
+        if _heartbeat is None:
+            _heartbeat = HeartbeatManager(
+                settings.HEARTBEAT_INTERVAL_SECONDS,
+                settings.HEARTBEAT_TIMEOUT_SECONDS,
+                settings.HEARTBEAT_TICK_SECONDS)
+            logger.info(f"Heartbeat manager started in process {os.getpid()}")
+        return _heartbeat
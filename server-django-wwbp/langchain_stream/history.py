@@ -0,0 +1,129 @@
+import logging
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from config.routers import use_replica
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TAIL_TIMEOUT = 3600
+
+
+def tail_cache_key(session_id):
+    return f"session_history_tail_v2_{session_id}"
+
+
+def serialize_transcript(transcript):
+    return {
+        "id": transcript.id,
+        "message_id": transcript.message_id,
+        "user_message": transcript.user_message,
+        "bot_message": transcript.bot_message,
+        "has_audio": transcript.has_audio,
+        "audio_link": transcript.audio_link,
+        "created_at": transcript.created_at.isoformat(),
+    }
+
+
+def history_key(entry):
+    return (entry["message_id"], entry["id"])
+
+
+def session_history_queryset(session_id):
+    Transcript = apps.get_model('langchain_stream', 'Transcript')
+    return Transcript.objects.filter(session_id=session_id)
+
+
+def load_tail(session_id):
+    """
+    Return {"messages": [...], "has_more": ...} for the most recent messages
+    of a session, oldest first, with whether older ones exist. Served from the
+    cache once warm. Callers check access to the session first; the tail
+    holds only its messages.
+    """
+    tail = cache.get(tail_cache_key(session_id))
+    if tail is not None:
+        return tail
+
+    size = settings.SESSION_HISTORY_TAIL_SIZE
+    # One row past the tail tells whether there is anything older
+    recent = list(session_history_queryset(session_id).order_by('-message_id', '-id')[:size + 1])
+    tail = {
+        "messages": [serialize_transcript(t) for t in reversed(recent[:size])],
+        "has_more": len(recent) > size,
+    }
+    cache.set(tail_cache_key(session_id), tail, timeout=HISTORY_TAIL_TIMEOUT)
+    return tail
+
+
+def append_to_tail(transcript):
+    """
+    Keep a warm history tail current after a transcript write. A cold tail is
+    left alone; the next read rebuilds it from the database.
+    """
+    key = tail_cache_key(transcript.session_id)
+    try:
+        tail = cache.get(key)
+        if tail is None:
+            return
+        entry = serialize_transcript(transcript)
+        messages = [m for m in tail["messages"] if m["id"] != entry["id"]]
+        messages.append(entry)
+        messages.sort(key=history_key)
+        tail["messages"] = messages[-settings.SESSION_HISTORY_TAIL_SIZE:]
+        tail["has_more"] = tail["has_more"] or len(messages) > settings.SESSION_HISTORY_TAIL_SIZE
+        cache.set(key, tail, timeout=HISTORY_TAIL_TIMEOUT)
+    except Exception as e:
+        logger.error(f"Error updating history tail for session {transcript.session_id}: {e}")
+
+
+def parse_cursor(cursor):
+    message_id, transcript_id = cursor.split(':')
+    return int(message_id), int(transcript_id)
+
+
+def format_cursor(entry):
+    return f"{entry['message_id']}:{entry['id']}"
+
+
+@use_replica
+def history_page(session_id, before=None, after=None, limit=50):
+    """
+    Keyset-paginate a session's transcript on (message_id, id). Without a
+    cursor the latest `limit` messages are returned; `before` walks back into
+    older messages and `after` catches up on newer ones. Messages are always
+    oldest first. Returns (messages, has_more).
+    """
+    queryset = session_history_queryset(session_id)
+    if after:
+        message_id, transcript_id = parse_cursor(after)
+        rows = list(queryset.filter(
+            Q(message_id__gt=message_id) | Q(message_id=message_id, id__gt=transcript_id)
+        ).order_by('message_id', 'id')[:limit + 1])
+        return [serialize_transcript(t) for t in rows[:limit]], len(rows) > limit
+
+    if before:
+        message_id, transcript_id = parse_cursor(before)
+        queryset = queryset.filter(
+            Q(message_id__lt=message_id) | Q(message_id=message_id, id__lt=transcript_id))
+    rows = list(queryset.order_by('-message_id', '-id')[:limit + 1])
+    return [serialize_transcript(t) for t in reversed(rows[:limit])], len(rows) > limit
+
+
+def update_tail_audio(session_id, transcript_id, audio_link):
+    key = tail_cache_key(session_id)
+    try:
+        tail = cache.get(key)
+        if tail is None:
+            return
+        for message in tail["messages"]:
+            if message["id"] == transcript_id:
+                message["has_audio"] = True
+                message["audio_link"] = audio_link
+                cache.set(key, tail, timeout=HISTORY_TAIL_TIMEOUT)
+                return
+    except Exception as e:
+        logger.error(f"Error updating history tail for session {session_id}: {e}")
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from langchain_stream.archiver import get_archiver
+
+
+class Command(BaseCommand):
+    help = "Upload audio clips left in the local spool by interrupted or failed background uploads."
+
+    def handle(self, *args, **options):
+        archiver = get_archiver()
+        resumed = archiver.resume_pending()
+        archiver.shutdown(wait=True)
+        self.stdout.write(self.style.SUCCESS(f"Processed {resumed} spooled audio clips"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from langchain_stream.reencode import reencode_audio
+
+
+class Command(BaseCommand):
+    help = "Re-encode archived transcript audio to low-bitrate mono Opus and report the bytes saved."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            help='ffmpeg workers (defaults to AUDIO_REENCODE_WORKERS)')
+        parser.add_argument('--limit', type=int,
+                            help='Only consider this many clips in this run')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Count the clips that would be re-encoded without touching them')
+
+    def handle(self, *args, **options):
+        report = reencode_audio(
+            workers=options['workers'], limit=options['limit'], dry_run=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(f"{report['clips']} clips would be re-encoded")
+            return
+
+        saved = report['bytes_before'] - report['bytes_after']
+        ratio = report['bytes_before'] / report['bytes_after'] if report['bytes_after'] else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-encoded {report['clips']} clips ({report['failed']} failed): "
+            f"{report['bytes_before']} -> {report['bytes_after']} bytes, "
+            f"saved {saved} bytes ({ratio:.1f}x smaller)"))
@@ -0,0 +1,39 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from langchain_stream.tracing import list_turns, turn_waterfall
+
+BAR_WIDTH = 50
+
+
+class Command(BaseCommand):
+    help = "Show the traced turns of a session, or the span waterfall of one turn."
+
+    def add_arguments(self, parser):
+        parser.add_argument('session_id', type=int)
+        parser.add_argument('message_id', type=int, nargs='?',
+                            help='Turn to show; lists recent turns when omitted')
+
+    def handle(self, *args, **options):
+        session_id = options['session_id']
+        if options['message_id'] is None:
+            for turn in list_turns(session_id):
+                started = datetime.fromtimestamp(turn['start']).isoformat(timespec='seconds')
+                self.stdout.write(f"message {turn['message_id']:>6}  {started}  {turn['spans']} spans")
+            return
+
+        spans = turn_waterfall(session_id, options['message_id'])
+        if not spans:
+            raise CommandError(
+                f"No trace for session {session_id} message {options['message_id']}")
+
+        total = max(s['offset_ms'] + s['duration_ms'] for s in spans) or 1
+        for s in spans:
+            left = int(s['offset_ms'] / total * BAR_WIDTH)
+            width = max(1, int(s['duration_ms'] / total * BAR_WIDTH))
+            bar = ' ' * left + '#' * width
+            attrs = ' '.join(f"{k}={v}" for k, v in s['attrs'].items())
+            self.stdout.write(
+                f"{s['name']:<18} {s['offset_ms']:>9.1f} {s['duration_ms']:>9.1f} ms |{bar:<{BAR_WIDTH}}| {attrs}")
+        self.stdout.write(f"total {total:.1f} ms")
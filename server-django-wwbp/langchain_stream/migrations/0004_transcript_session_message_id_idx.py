@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('langchain_stream', '0003_alter_transcript_session'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transcript',
+            index=models.Index(fields=['session', 'message_id'], name='langchain_s_session_438846_idx'),
+        ),
+    ]
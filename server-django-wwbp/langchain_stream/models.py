@@ -15,4 +15,5 @@ class Transcript(models.Model):
         indexes = [
             models.Index(fields=['session']),
             models.Index(fields=['created_at']),
+            models.Index(fields=['session', 'message_id']),
         ]
@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from config.executors import run_in
+from config.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+PROFILE_INDEX_TIMEOUT = 7 * 24 * 3600
+PROFILE_INDEX_SIZE = 20
+# Arms not used within this long lapse
+PROFILE_ARM_TIMEOUT = 3600
+# Set while any session is armed, so idle workers skip the per-session lookup
+ARMED_KEY = 'consumer_profile_armed'
+
+# This process's last look at ARMED_KEY: (monotonic time, armed)
+_armed_seen = (float('-inf'), False)
+
+
+def arm_key(session_id):
+    return f"consumer_profile_arm_{session_id}"
+
+
+def index_key(session_id):
+    return f"consumer_profiles_{session_id}"
+
+
+def arm_session(session_id, turns=1):
+    """Profile the next `turns` turns of a session, on whichever worker serves them."""
+    cache.set(arm_key(session_id), turns, timeout=PROFILE_ARM_TIMEOUT)
+    cache.set(ARMED_KEY, True, timeout=PROFILE_ARM_TIMEOUT)
+
+
+def list_profiles(session_id):
+    return cache.get(index_key(session_id), [])
+
+
+async def any_armed():
+    """
+    Whether any session may be armed. Polled from the cache at most every
+    CONSUMER_PROFILE_ARM_POLL_SECONDS per process, off the event loop, so a
+    turn on an idle worker costs no cache round trip.
+    """
+    global _armed_seen
+    checked_at, armed = _armed_seen
+    if time.monotonic() - checked_at >= settings.CONSUMER_PROFILE_ARM_POLL_SECONDS:
+        try:
+            armed = bool(await run_in('db', cache.get, ARMED_KEY))
+        except Exception as e:
+            logger.error(f"Error checking for armed profiles: {e}")
+            armed = False
+        _armed_seen = (time.monotonic(), armed)
+    return armed
+
+
+def take_arm(session_id):
+    """Use up one armed turn of a session; True if there was one."""
+    try:
+        if cache.get(arm_key(session_id)):
+            return cache.decr(arm_key(session_id)) >= 0
+    except ValueError:
+        pass
+    except Exception as e:
+        logger.error(f"Error checking profile arm for session {session_id}: {e}")
+    return False
+
+
+async def should_profile(session_id):
+    """Return why this turn should be profiled ('armed' or 'sampled'), or None."""
+    if await any_armed() and await run_in('db', take_arm, session_id):
+        return 'armed'
+    if settings.CONSUMER_PROFILE_SAMPLE_RATE and random.random() < settings.CONSUMER_PROFILE_SAMPLE_RATE:
+        return 'sampled'
+    return None
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def thread_stack(frame):
+    stack = []
+    while frame is not None:
+        stack.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def await_stack(task):
+    """The coroutine chain a suspended task is parked in, outermost first."""
+    stack = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, 'cr_frame', None) or getattr(awaitable, 'gi_frame', None)
+        if frame is None:
+            stack.append(f"<await {type(awaitable).__name__}>")
+            break
+        stack.append(frame_label(frame.f_code))
+        awaitable = getattr(awaitable, 'cr_await', None) or getattr(awaitable, 'gi_yieldfrom', None)
+    return ['[awaiting]'] + stack
+
+
+class TurnProfile:
+    """
+    Wall-clock samples of one consumer task for one turn. While the task is
+    running its thread stack is sampled, while it is suspended its await chain
+    is, so time spent waiting on OpenAI, TTS or the database shows up next to
+    CPU time. Samples are kept as collapsed stacks ("a;b;c count"), the input
+    format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, session_id, consumer, reason):
+        self.session_id = session_id
+        self.consumer = consumer
+        self.reason = reason
+        self.task = asyncio.current_task()
+        self.loop = asyncio.get_running_loop()
+        self.thread_id = threading.get_ident()
+        self.samples = Counter()
+        self.started_at = timezone.now()
+        self.started = time.monotonic()
+        self.finished = False
+
+    def sample(self):
+        if self.task.done():
+            return
+        if asyncio.current_task(self.loop) is self.task:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = thread_stack(frame)
+        else:
+            stack = await_stack(self.task)
+        self.samples[';'.join(stack)] += 1
+
+    def folded(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def save(self):
+        duration_ms = int((time.monotonic() - self.started) * 1000)
+        name = f"{self.started_at:%Y%m%dT%H%M%S%f}_{self.consumer}"
+        key = f"data/profiles/session_{self.session_id}/{name}.folded"
+        try:
+            get_storage().put(key, self.folded().encode('utf-8'))
+            entry = {
+                "name": name,
+                "key": key,
+                "consumer": self.consumer,
+                "reason": self.reason,
+                "started_at": self.started_at.isoformat(),
+                "duration_ms": duration_ms,
+                "samples": sum(self.samples.values()),
+            }
+            profiles = [entry] + list_profiles(self.session_id)
+            cache.set(index_key(self.session_id), profiles[:PROFILE_INDEX_SIZE],
+                      timeout=PROFILE_INDEX_TIMEOUT)
+            logger.info(
+                f"Saved {self.reason} profile {name} for session {self.session_id}: {entry['samples']} samples over {duration_ms} ms")
+        except Exception as e:
+            logger.error(f"Error saving profile for session {self.session_id}: {e}")
+
+
+class Sampler:
+    """One daemon thread per process that samples every active turn profile."""
+
+    def __init__(self, interval, max_seconds):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.profiles = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add(self, profile):
+        with self.lock:
+            self.profiles.add(profile)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name='consumer-profiler', daemon=True)
+                self.thread.start()
+
+    def claim(self, profile):
+        """Stop sampling a profile; True for exactly one caller, which then saves it."""
+        with self.lock:
+            self.profiles.discard(profile)
+            if profile.finished:
+                return False
+            profile.finished = True
+            return True
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.profiles:
+                    self.thread = None
+                    return
+                profiles = list(self.profiles)
+            for profile in profiles:
+                with self.lock:
+                    if profile.finished:
+                        continue
+                    try:
+                        profile.sample()
+                    except Exception as e:
+                        logger.debug(f"Profile sample failed: {e}")
+                # A turn whose completion never arrives is cut off and saved as-is
+                if time.monotonic() - profile.started > self.max_seconds and self.claim(profile):
+                    profile.save()
+            time.sleep(self.interval)
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler():
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = Sampler(settings.CONSUMER_PROFILE_INTERVAL_MS / 1000,
+                               settings.CONSUMER_PROFILE_MAX_SECONDS)
+        return _sampler
+
+
+async def start_turn_profile(session_id, consumer):
+    """Start profiling the current consumer task if this turn is armed or sampled."""
+    reason = await should_profile(session_id)
+    if not reason:
+        return None
+    profile = TurnProfile(session_id, consumer, reason)
+    get_sampler().add(profile)
+    return profile
+
+
+async def finish_turn_profile(profile):
+    """Stop sampling a turn and store its capture, unless it was already cut off."""
+    if profile is None or not get_sampler().claim(profile):
+        return
+    await sync_to_async(profile.save, thread_sensitive=False)()
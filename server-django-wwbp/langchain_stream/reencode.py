@@ -0,0 +1,190 @@
+import logging
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlparse
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils import timezone
+
+from config.storage import get_storage
+from langchain_stream.history import update_tail_audio
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_NAME = 'audio_reencode'
+REENCODED_SUFFIX = '.opus.webm'
+
+
+class ClipUnavailable(Exception):
+    """The clip can never be re-encoded, e.g. its object is gone from storage."""
+
+
+def failure_key(transcript_id):
+    return f"audio_reencode_failures_{transcript_id}"
+
+
+def reencoded_name(audio_link):
+    stem = os.path.basename(urlparse(audio_link).path)
+    if stem.endswith('.webm'):
+        stem = stem[:-len('.webm')]
+    return f"{stem}{REENCODED_SUFFIX}"
+
+
+def encode_opus(source_path, dest_path):
+    """
+    Re-encode a clip (browser WebM or ElevenLabs MP3, the container is
+    probed) to low-bitrate mono Opus in WebM. Each ffmpeg runs on a single
+    thread at lowered priority so the pool size is the CPU limit.
+    """
+    # nice(1) rather than preexec_fn, which is unsafe to use from threads
+    command = [
+        'nice', '-n', str(settings.AUDIO_REENCODE_NICE),
+        'ffmpeg', '-y', '-nostdin', '-loglevel', 'error',
+        '-threads', '1',
+        '-i', source_path,
+        '-vn', '-ac', '1',
+        '-acodec', 'libopus',
+        '-b:a', settings.AUDIO_REENCODE_BITRATE,
+        '-application', 'voip',
+        '-f', 'webm',
+        dest_path,
+    ]
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise Exception(f"ffmpeg error: {process.stderr.decode('utf-8')}")
+
+
+def _remove(storage, audio_link):
+    try:
+        storage.delete(storage.key_from_url(audio_link))
+    except Exception as e:
+        logger.warning(f"Could not remove audio {audio_link}: {e}")
+
+
+def reencode_clip(storage, transcript_id, session_id, audio_link):
+    """
+    Re-encode one clip and swap the transcript's audio_link to it. The swap is
+    a compare-and-set on the old link, so a clip that changed underneath us is
+    left alone. Returns (bytes_before, bytes_after); both are 0 if skipped.
+    """
+    Transcript = apps.get_model('langchain_stream', 'Transcript')
+    with tempfile.TemporaryDirectory(prefix='audio_reencode_') as work_dir:
+        key = storage.key_from_url(audio_link)
+        if not storage.exists(key):
+            raise ClipUnavailable(f"{audio_link} is missing from storage")
+        source_path = storage.local_path(key) or storage.download(
+            key, os.path.join(work_dir, 'source'))
+        dest_path = os.path.join(work_dir, 'opus.webm')
+        encode_opus(source_path, dest_path)
+
+        bytes_before = os.path.getsize(source_path)
+        bytes_after = os.path.getsize(dest_path)
+        if bytes_after >= bytes_before:
+            logger.debug(f"Keeping audio for transcript {transcript_id}; re-encode saves nothing")
+            return 0, 0
+
+        new_link = storage.put_file(
+            os.path.join(os.path.dirname(key), reencoded_name(audio_link)), dest_path)
+
+    close_old_connections()
+    try:
+        swapped = Transcript.objects.filter(
+            id=transcript_id, audio_link=audio_link).update(audio_link=new_link)
+    finally:
+        close_old_connections()
+
+    if not swapped:
+        logger.warning(f"audio_link of transcript {transcript_id} changed during re-encode; discarding")
+        _remove(storage, new_link)
+        return 0, 0
+
+    update_tail_audio(session_id, transcript_id, new_link)
+    _remove(storage, audio_link)
+    return bytes_before, bytes_after
+
+
+def give_up(transcript_id, error):
+    """
+    Whether a failed clip should be skipped for good: it is unavailable, or it
+    has failed AUDIO_REENCODE_MAX_ATTEMPTS runs in a row. Skipped clips keep
+    their original audio.
+    """
+    key = failure_key(transcript_id)
+    cache.add(key, 0, timeout=30 * 24 * 3600)
+    attempts = cache.incr(key)
+    if isinstance(error, ClipUnavailable) or attempts >= settings.AUDIO_REENCODE_MAX_ATTEMPTS:
+        logger.warning(f"Skipping audio of transcript {transcript_id} after {attempts} failed attempt(s): {error}")
+        cache.delete(key)
+        return True
+    return False
+
+
+def reencode_audio(workers=None, limit=None, dry_run=False):
+    """
+    Re-encode archived clips past the re-encode watermark to mono Opus on a
+    bounded pool of ffmpeg workers. Clips younger than AUDIO_REENCODE_MIN_AGE_MINUTES
+    are left for the next run so in-flight archive uploads settle first.
+    Failed clips are retried on later runs until give_up() skips them.
+    Returns a dict with clips, failed, bytes_before and bytes_after.
+    """
+    Transcript = apps.get_model('langchain_stream', 'Transcript')
+    SnapshotWatermark = apps.get_model('accounts', 'SnapshotWatermark')
+    workers = workers or settings.AUDIO_REENCODE_WORKERS
+    watermark, _ = SnapshotWatermark.objects.get_or_create(name=WATERMARK_NAME)
+    cutoff = timezone.now() - timedelta(minutes=settings.AUDIO_REENCODE_MIN_AGE_MINUTES)
+
+    rows = Transcript.objects.filter(
+        id__gt=watermark.last_transcript_id, created_at__lt=cutoff, has_audio=True
+    ).exclude(audio_link=None).exclude(audio_link='').order_by('id').values_list(
+        'id', 'session_id', 'audio_link')
+    if limit:
+        rows = rows[:limit]
+    rows = list(rows)
+
+    report = {"clips": 0, "failed": 0, "bytes_before": 0, "bytes_after": 0}
+    if not rows:
+        return report
+    if dry_run:
+        report["clips"] = sum(1 for row in rows if not row[2].endswith(REENCODED_SUFFIX))
+        return report
+
+    storage = get_storage()
+
+    def run(row):
+        transcript_id, session_id, audio_link = row
+        if audio_link.endswith(REENCODED_SUFFIX):
+            return 0, 0
+        return reencode_clip(storage, transcript_id, session_id, audio_link)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='audio-reencode') as executor:
+        futures = [executor.submit(run, row) for row in rows]
+        retry_ids = []
+        for row, future in zip(rows, futures):
+            try:
+                bytes_before, bytes_after = future.result()
+            except Exception as e:
+                logger.error(f"Error re-encoding audio for transcript {row[0]}: {e}")
+                report["failed"] += 1
+                if not give_up(row[0], e):
+                    retry_ids.append(row[0])
+                continue
+            if bytes_before:
+                report["clips"] += 1
+                report["bytes_before"] += bytes_before
+                report["bytes_after"] += bytes_after
+
+    # Clips that may still succeed are retried on the next run, so the
+    # watermark stops short of them; permanent failures are passed over
+    watermark.last_transcript_id = min(retry_ids) - 1 if retry_ids else rows[-1][0]
+    watermark.save()
+
+    saved = report["bytes_before"] - report["bytes_after"]
+    logger.info(
+        f"Re-encoded {report['clips']} audio clips ({report['failed']} failed), saved {saved} bytes")
+    return report
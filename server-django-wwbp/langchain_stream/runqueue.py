@@ -0,0 +1,134 @@
+import json
+import threading
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class MemoryRunStore:
+    """Per-process queues for local development, where one worker serves every socket."""
+
+    def __init__(self):
+        self.queues = defaultdict(deque)
+        self.lock = threading.Lock()
+
+    def push(self, session_id, entry):
+        with self.lock:
+            self.queues[str(session_id)].append(entry)
+
+    def pop(self, session_id):
+        with self.lock:
+            queue = self.queues.get(str(session_id))
+            if not queue:
+                self.queues.pop(str(session_id), None)
+                return None
+            return queue.popleft()
+
+    def length(self, session_id):
+        with self.lock:
+            return len(self.queues.get(str(session_id), ()))
+
+    def discard(self, session_id, channel):
+        with self.lock:
+            queue = self.queues.get(str(session_id))
+            if queue:
+                self.queues[str(session_id)] = deque(entry for entry in queue if entry["channel"] != channel)
+
+
+class RedisRunStore:
+    """One Redis list per session; RPUSH and LPOP are atomic, so no queued turn is overwritten."""
+
+    def __init__(self, ttl):
+        from django_redis import get_redis_connection
+        self.redis = get_redis_connection('default')
+        self.ttl = ttl
+
+    def push(self, session_id, entry):
+        key = f"run_queue:{session_id}"
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.rpush(key, json.dumps(entry))
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def pop(self, session_id):
+        entry = self.redis.lpop(f"run_queue:{session_id}")
+        return json.loads(entry) if entry is not None else None
+
+    def length(self, session_id):
+        return self.redis.llen(f"run_queue:{session_id}")
+
+    def discard(self, session_id, channel):
+        key = f"run_queue:{session_id}"
+        for raw in self.redis.lrange(key, 0, -1):
+            if json.loads(raw)["channel"] == channel:
+                self.redis.lrem(key, 0, raw)
+
+
+class RunQueue:
+    """
+    A session's producer lock and its queue of turns waiting for it. The lock
+    names the channel allowed to stream the session's runs; it is short and
+    refreshed while a run streams, so a worker that dies mid-run frees the
+    session within RUN_PRODUCER_LOCK_SECONDS. All calls block; consumers run
+    them on the db pool.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    @staticmethod
+    def lock_key(session_id):
+        return f"run_producer_{session_id}"
+
+    def acquire(self, session_id, channel):
+        return cache.add(self.lock_key(session_id), channel, timeout=settings.RUN_PRODUCER_LOCK_SECONDS)
+
+    def owns(self, session_id, channel):
+        return cache.get(self.lock_key(session_id)) == channel
+
+    def refresh(self, session_id, channel):
+        if self.owns(session_id, channel):
+            cache.touch(self.lock_key(session_id), timeout=settings.RUN_PRODUCER_LOCK_SECONDS)
+
+    def hand_over(self, session_id, channel):
+        """Pass the lock straight to another channel, so nothing runs in between."""
+        cache.set(self.lock_key(session_id), channel, timeout=settings.RUN_PRODUCER_LOCK_SECONDS)
+
+    def release(self, session_id, channel):
+        if self.owns(session_id, channel):
+            cache.delete(self.lock_key(session_id))
+
+    def running(self, session_id):
+        return cache.get(self.lock_key(session_id)) is not None
+
+    def push(self, session_id, entry):
+        self.store.push(session_id, entry)
+
+    def pop(self, session_id):
+        return self.store.pop(session_id)
+
+    def length(self, session_id):
+        return self.store.length(session_id)
+
+    def discard(self, session_id, channel):
+        """Drop a closed socket's queued turns, so the lock is never handed to it."""
+        self.store.discard(session_id, channel)
+
+
+def make_store():
+    if settings.RUN_QUEUE_STORE == 'redis':
+        return RedisRunStore(settings.RUN_PENDING_MAX_SECONDS * 2)
+    return MemoryRunStore()
+
+
+_run_queue = None
+_run_queue_lock = threading.Lock()
+
+
+def get_run_queue():
+    global _run_queue
+    with _run_queue_lock:
+        if _run_queue is None:
+            _run_queue = RunQueue(make_store())
+        return _run_queue
@@ -1 +1,10 @@
 # This file can contain signal handlers or any other initialization code
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from config.metrics import DB_CONNECTIONS_OPENED
+
+
+@receiver(connection_created)
+def count_db_connection(sender, connection, **kwargs):
+    DB_CONNECTIONS_OPENED.labels(connection.alias).inc()
@@ -1,36 +1,43 @@
-import boto3
 import os
-import io
-from django.conf import settings
 from django.apps import apps
-from asgiref.sync import sync_to_async
+from django.db.models import F
+from django.utils import timezone
 import logging
-from urllib.parse import urlparse
+from config.executors import in_executor, run_in
+from config.metrics import timed
+from config.storage import get_storage
+from langchain_stream.archiver import get_archiver
+from langchain_stream.history import append_to_tail
+from langchain_stream.tracing import traced
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
-@sync_to_async
-def save_usage_stats(session_id, prompt_tokens, completion_tokens, total_tokens):
+@timed('usage_write')
+@traced('usage_write')
+async def save_usage_stats(session_id, prompt_tokens, completion_tokens, total_tokens):
+    """Add a run's token usage to its session in one UPDATE, without loading the row."""
     ChatSession = apps.get_model('accounts', 'ChatSession')
     try:
-        session = ChatSession.objects.get(id=session_id)
-        session.prompt_tokens += prompt_tokens
-        session.completion_tokens += completion_tokens
-        session.total_tokens += total_tokens
-        session.save()
+        await run_in(
+            'db', ChatSession.objects.filter(id=session_id).update,
+            prompt_tokens=F('prompt_tokens') + prompt_tokens,
+            completion_tokens=F('completion_tokens') + completion_tokens,
+            total_tokens=F('total_tokens') + total_tokens,
+            updated_at=timezone.now(),
+        )
         logger.debug(f"Usage stats saved for session_id={session_id}")
     except Exception as e:
         logger.error(f"Error saving usage stats: {e}")
 
 
-@sync_to_async
+@in_executor('db')
+@timed('file_streams')
 def get_file_streams(session_id):
     file_streams = []
     try:
         ChatSession = apps.get_model('accounts', 'ChatSession')
-        session = ChatSession.objects.get(id=session_id)
+        session = ChatSession.objects.select_related('module', 'task').get(id=session_id)
         module = session.module
         task = session.task
 
@@ -38,22 +45,11 @@ def get_file_streams(session_id):
         if task:
             file_paths += task.files
 
+        storage = get_storage()
         for file_path in file_paths:
-            if file_path.startswith('https://'):
-                # Extract bucket name and key
-                parsed_url = urlparse(file_path)
-                bucket_name = settings.AWS_STORAGE_BUCKET_NAME
-                key = parsed_url.path.lstrip('/')
-
-                # Download file from S3
-                s3 = boto3.client(
-                    's3', region_name=settings.AWS_S3_REGION_NAME)
-                local_file_path = f'/tmp/{os.path.basename(key)}'
-                s3.download_file(bucket_name, key, local_file_path)
-                file_streams.append(open(local_file_path, 'rb'))
-            else:
-                # Local file
-                file_streams.append(open(file_path, 'rb'))
+            # OpenAI infers the file type from the name, so pass it alongside the body
+            key = storage.key_from_url(file_path)
+            file_streams.append((os.path.basename(key), storage.open(key)))
     except Exception as e:
         logger.error(f"Error retrieving file streams: {e}")
         return []
@@ -61,14 +57,14 @@ def get_file_streams(session_id):
     return file_streams
 
 
-@sync_to_async
+@in_executor('db')
+@timed('transcript_write')
+@traced('transcript_write')
 def save_message_to_transcript(session_id, message_id, user_message, bot_message, has_audio=False, audio_bytes=None):
     try:
-        ChatSession = apps.get_model('accounts', 'ChatSession')
         Transcript = apps.get_model('langchain_stream', 'Transcript')
-        session = ChatSession.objects.get(id=session_id)
         transcript = Transcript.objects.create(
-            session=session,
+            session_id=session_id,
             message_id=message_id,
             user_message=user_message,
             bot_message=bot_message,
@@ -77,28 +73,19 @@ def save_message_to_transcript(session_id, message_id, user_message, bot_message
         role = 'bot' if bot_message else 'user'
         audio_file_name = f"audio_{session_id}_{message_id}_{role}.webm"
         if has_audio and audio_bytes:
-            if settings.ENVIRONMENT == 'local':
-                local_audio_dir = os.path.join(settings.BASE_DIR, 'data/audio')
-                os.makedirs(local_audio_dir, exist_ok=True)
-                audio_file_path = os.path.join(
-                    local_audio_dir, audio_file_name)
-                with open(audio_file_path, "wb") as audio_file:
-                    audio_file.write(audio_bytes)
-                transcript.has_audio = True
-                transcript.audio_link = audio_file_path
-            elif settings.ENVIRONMENT == 'production':
-                s3 = boto3.client(
-                    's3', region_name=settings.AWS_S3_REGION_NAME)
-                bucket_name = settings.AWS_STORAGE_BUCKET_NAME
-                s3_key = f"data/audio/{audio_file_name}"
-                s3.upload_fileobj(io.BytesIO(audio_bytes), bucket_name, s3_key)
-                transcript.has_audio = True
-                transcript.audio_link = f"https://{bucket_name}.s3.{settings.AWS_S3_REGION_NAME}.amazonaws.com/{s3_key}"
+            storage = get_storage()
+            if storage.remote:
+                # Spool locally and upload in the background; the archiver sets
+                # audio_link when the upload completes, so the row is not saved again here
+                get_archiver().archive(transcript, audio_bytes, audio_file_name)
             else:
-                pass
+                transcript.has_audio = True
+                transcript.audio_link = storage.put(
+                    f"data/audio/{audio_file_name}", audio_bytes)
+                transcript.save(update_fields=['has_audio', 'audio_link'])
 
-            transcript.save()
             logger.info(
                 f"Transcript saved successfully for session_id: {session_id}, message_id: {message_id}")
+        append_to_tail(transcript)
     except Exception as e:
         logger.error(f"Error saving transcript: {e}")
@@ -1,3 +1,319 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time
+from types import SimpleNamespace as NS
+from unittest import mock
 
-# Create your tests here.
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from langchain_stream import deltalog, runqueue, views
+from langchain_stream.deltalog import DeltaLog, MemoryDeltaStore
+from langchain_stream.routing import websocket_urlpatterns
+
+
+class MemoryDeltaStoreTests(SimpleTestCase):
+    def test_read_after_cursor(self):
+        log = DeltaLog(MemoryDeltaStore(100, 60), 60)
+        log.start_run(1)
+        for value in ('a', 'b', 'c'):
+            log.append_text(1, {"value": value})
+        seq = log.append_audio(1, b'clip')
+        self.assertEqual(seq, 4)
+        log.store.write([log.queue.get() for _ in range(4)])
+
+        entries = log.read(1, 2)
+        self.assertEqual([entry[0] for entry in entries], [3, 4])
+        self.assertEqual(json.loads(entries[0][1]), {"value": "c", "seq": 3})
+        self.assertEqual(entries[1][2], b'clip')
+
+    def test_cursor_past_the_log_reads_from_the_start(self):
+        store = MemoryDeltaStore(100, 60)
+        store.write([('1', 1, '{}', None), ('1', 2, '{}', None)])
+        log = DeltaLog(store, 60)
+        self.assertEqual([entry[0] for entry in log.read(1, 99)], [1, 2])
+
+    def test_logs_and_counters_expire(self):
+        store = MemoryDeltaStore(100, 0.05)
+        log = DeltaLog(store, 0.05)
+        log.start_run(1)
+        store.write([('1', log.next_seq(1), '{}', None), ('1', log.next_seq(1), None, b'clip')])
+        self.assertEqual(store.last_seq('1'), 2)
+        time.sleep(0.1)
+        self.assertEqual(store.read('1', 0), [])
+        log.start_run(2)
+        self.assertNotIn('1', store.logs)
+        self.assertEqual(list(log.seqs), ['2'])
+
+
+class FakeStream:
+    """A run's events; each delta waits for the test to let it through."""
+
+    def __init__(self, words):
+        self.words = words
+        self.step = threading.Semaphore(0)
+
+    def __iter__(self):
+        yield NS(event='thread.run.created', data=None)
+        for word in self.words:
+            self.step.acquire(timeout=5)
+            yield NS(event='thread.message.delta', data=NS(delta=NS(content=[NS(text=NS(value=word))])))
+        yield NS(event='thread.run.completed', data=NS(usage=NS(prompt_tokens=1, completion_tokens=1, total_tokens=2)))
+
+    def release(self, count=None):
+        for _ in range(count or len(self.words)):
+            self.step.release()
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    DELTA_LOG_STORE='memory',
+    RUN_QUEUE_STORE='memory',
+    TRACE_ENABLED=False,
+)
+class ConsumerTestCase(SimpleTestCase):
+    """
+    Drives the websocket consumers against a fake assistant: no OpenAI calls,
+    no database writes, and runs that stream one delta at a time on demand.
+    """
+    session_id = 1
+
+    def setUp(self):
+        cache.clear()
+        cache.set(f'initial_message_sent_{self.session_id}', True)
+        self.streams = []
+        self.messages = []
+        self.handlers = []
+        test = self
+
+        async def setup(manager, session_id):
+            manager.assistant, manager.thread = NS(id='asst'), NS(id='thread')
+
+        async def create_user_message(manager, message):
+            # OpenAI rejects new messages while a run on the thread is active
+            active = any(not stream.done for stream in test.streams)
+            test.messages.append(('rejected' if active else 'added', message))
+
+        async def get_run_stream(manager):
+            stream = FakeStream(['Hello ', 'there.'])
+            stream.done = False
+            test.streams.append(stream)
+            return stream
+
+        original_async_stream = views.AssistantSessionManager.async_stream
+
+        async def async_stream(manager, stream):
+            async for event in original_async_stream(manager, stream):
+                if event.event == 'thread.run.completed':
+                    stream.done = True
+                yield event
+
+        def record(handler):
+            async def wrapper(consumer, event):
+                test.handlers.append((handler.__name__, event["message_id"]))
+                return await handler(consumer, event)
+            return wrapper
+
+        async def stt(consumer, audio_data):
+            return "spoken words"
+
+        async def tts(consumer, text):
+            return b'ogg'
+
+        patches = [
+            # Fresh per-process queues and logs, so no turn outlives its test
+            mock.patch.object(runqueue, '_run_queue', None),
+            mock.patch.object(deltalog, '_delta_log', None),
+            mock.patch.object(views, 'OpenAI', mock.MagicMock()),
+            mock.patch.object(views.AssistantSessionManager, 'setup', setup),
+            mock.patch.object(views.AssistantSessionManager, 'create_user_message', create_user_message),
+            mock.patch.object(views.AssistantSessionManager, 'get_run_stream', get_run_stream),
+            mock.patch.object(views.AssistantSessionManager, 'async_stream', async_stream),
+            mock.patch.object(views, 'moderate_content', mock.AsyncMock(return_value=(False, None))),
+            mock.patch.object(views, 'save_message_to_transcript', mock.AsyncMock()),
+            mock.patch.object(views, 'save_usage_stats', mock.AsyncMock()),
+            mock.patch.object(views, 'get_heartbeat', mock.MagicMock()),
+            mock.patch.object(views.ChatConsumer, 'stream_text_response',
+                              record(views.ChatConsumer.stream_text_response)),
+            mock.patch.object(views.AudioConsumer, 'stream_audio_response',
+                              record(views.AudioConsumer.stream_audio_response)),
+            mock.patch.object(views.AudioConsumer, 'stt_openai', stt),
+            mock.patch.object(views.AudioConsumer, 'text_to_speech', tts),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    async def connect(self, path='chat'):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f"/ws/{path}/{self.session_id}/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("Timed out waiting for the consumers")
+            await asyncio.sleep(0.01)
+
+    async def frames(self, communicator, until, timeout=5):
+        """JSON frames (audio as None) up to and including the first matching `until`."""
+        frames = []
+        while True:
+            output = await communicator.receive_output(timeout=timeout)
+            if output.get('text') is None:
+                frames.append(None)
+                continue
+            frame = json.loads(output['text'])
+            frames.append(frame)
+            if until(frame):
+                return frames
+
+
+def run_end(frame):
+    return frame.get('event') == 'on_parser_end'
+
+
+class ResumeTests(ConsumerTestCase):
+    async def test_invalid_cursor_gets_an_error_frame(self):
+        chat = await self.connect()
+        for last_seq in ('x', -1, 1.5, True, None):
+            await chat.send_to(text_data=json.dumps({"type": "resume", "last_seq": last_seq}))
+            self.assertEqual(json.loads(await chat.receive_from())['event'], 'error')
+        await chat.disconnect()
+
+    async def test_resume_mid_run_does_not_repeat_group_frames(self):
+        producer = await self.connect()
+        peer = await self.connect()
+        await producer.send_to(text_data=json.dumps({"message": "hi"}))
+        await self.wait_for(lambda: self.streams)
+        seen = await self.frames(peer, lambda frame: frame.get('event') == 'on_parser_start')
+
+        # The peer resumes from its cursor while the run keeps streaming
+        await peer.send_to(text_data=json.dumps({"type": "resume", "last_seq": seen[-1]['seq']}))
+        self.streams[0].release()
+        frames = await self.frames(peer, run_end)
+        self.assertTrue(await peer.receive_nothing(timeout=0.5))
+        seqs = [frame['seq'] for frame in frames]
+        self.assertEqual(seqs, sorted(set(seqs)))
+        self.assertEqual([frame['event'] for frame in frames], ['on_parser_stream', 'on_parser_stream', 'on_parser_end'])
+
+        await producer.disconnect()
+        await peer.disconnect()
+
+
+class InitialMessageTests(ConsumerTestCase):
+    async def test_first_socket_starts_the_conversation_once(self):
+        await asyncio.to_thread(cache.delete, f'initial_message_sent_{self.session_id}')
+        chat = await self.connect()
+        await self.wait_for(lambda: self.streams)
+        self.streams[0].release()
+        await self.frames(chat, run_end)
+        self.assertEqual(self.messages, [('added', 'Begin the conversation.')])
+        await self.wait_for(lambda: cache.get(f'initial_message_sent_{self.session_id}'))
+
+        again = await self.connect()
+        self.assertTrue(await again.receive_nothing())
+        self.assertEqual(len(self.streams), 1)
+        await chat.disconnect()
+        await again.disconnect()
+
+    async def test_voice_speed_is_read_once_per_session(self):
+        profile = mock.AsyncMock(return_value={'voice_speed': '1.25'})
+        with mock.patch.object(views.AssistantSessionManager, 'get_user_profile', profile):
+            consumer = views.AudioConsumer()
+            consumer.session_id = self.session_id
+            consumer.session_manager = views.AssistantSessionManager()
+            self.assertEqual(await consumer.fetch_voice_speed(), 1.25)
+            self.assertEqual(await consumer.fetch_voice_speed(), 1.25)
+        profile.assert_awaited_once()
+
+
+class DeferredTurnTests(ConsumerTestCase):
+    async def test_turn_waits_for_the_active_run_and_keeps_its_message(self):
+        first = await self.connect()
+        second = await self.connect()
+        await first.send_to(text_data=json.dumps({"message": "one"}))
+        await self.wait_for(lambda: self.streams)
+
+        await second.send_to(text_data=json.dumps({"message": "two"}))
+        deferred = await self.frames(second, lambda frame: frame.get('event') == 'run_deferred')
+        # Not added yet: the thread still has an active run
+        self.assertEqual(self.messages, [('added', 'one')])
+
+        self.streams[0].release()
+        await self.wait_for(lambda: len(self.streams) == 2)
+        self.streams[1].release()
+        frames = await self.frames(second, lambda frame: run_end(frame) and frame['message_id'] == deferred[-1]['message_id'])
+        self.assertIn('on_parser_stream', [frame['event'] for frame in frames if frame])
+        self.assertEqual(self.messages, [('added', 'one'), ('added', 'two')])
+        # The lock is released once the last queued turn is done
+        await self.wait_for(lambda: cache.get(f'run_producer_{self.session_id}') is None)
+        await first.disconnect()
+        await second.disconnect()
+
+    async def test_queued_turns_run_in_order_with_their_own_handler(self):
+        chat = await self.connect()
+        other_chat = await self.connect()
+        audio = await self.connect('audio')
+        await chat.send_to(text_data=json.dumps({"message": "one"}))
+        await self.wait_for(lambda: self.streams)
+        await audio.send_to(bytes_data=b'voice')
+        await self.frames(audio, lambda frame: frame.get('event') == 'run_deferred')
+        await other_chat.send_to(text_data=json.dumps({"message": "two"}))
+        await self.frames(other_chat, lambda frame: frame.get('event') == 'run_deferred')
+
+        for count in (1, 2, 3):
+            await self.wait_for(lambda: len(self.streams) == count)
+            self.streams[-1].release()
+        await self.wait_for(lambda: all(stream.done for stream in self.streams))
+        self.assertEqual([handler for handler, _ in self.handlers],
+                         ['stream_text_response', 'stream_audio_response', 'stream_text_response'])
+        self.assertEqual(self.messages, [('added', 'one'), ('added', 'spoken words'), ('added', 'two')])
+        for communicator in (chat, other_chat, audio):
+            await communicator.disconnect()
+
+    async def test_closed_socket_leaves_no_turn_behind(self):
+        first = await self.connect()
+        second = await self.connect()
+        await first.send_to(text_data=json.dumps({"message": "one"}))
+        await self.wait_for(lambda: self.streams)
+        await second.send_to(text_data=json.dumps({"message": "two"}))
+        await self.frames(second, lambda frame: frame.get('event') == 'run_deferred')
+        await second.disconnect()
+
+        self.streams[0].release()
+        await self.frames(first, run_end)
+        # Released at once rather than handed to the closed socket
+        await self.wait_for(lambda: cache.get(f'run_producer_{self.session_id}') is None, timeout=1)
+        self.assertEqual(len(self.streams), 1)
+        self.assertEqual(self.messages, [('added', 'one')])
+        await first.disconnect()
+
+    @override_settings(RUN_PRODUCER_LOCK_SECONDS=0.2)
+    async def test_turn_behind_a_dead_producer_runs_once_the_lock_lapses(self):
+        await asyncio.to_thread(cache.set, f'run_producer_{self.session_id}', 'gone', 0.3)
+        chat = await self.connect()
+        await chat.send_to(text_data=json.dumps({"message": "hello"}))
+        await self.frames(chat, lambda frame: frame.get('event') == 'run_deferred')
+        await self.wait_for(lambda: self.streams)
+        self.streams[0].release()
+        await self.frames(chat, run_end)
+        self.assertEqual(self.messages, [('added', 'hello')])
+        await chat.disconnect()
+
+    @override_settings(RUN_PRODUCER_LOCK_SECONDS=0.1, RUN_PENDING_MAX_SECONDS=0.3)
+    async def test_turn_behind_a_stuck_producer_is_dropped_and_the_client_told(self):
+        await asyncio.to_thread(cache.set, f'run_producer_{self.session_id}', 'stuck', 60)
+        chat = await self.connect()
+        await chat.send_to(text_data=json.dumps({"message": "hello"}))
+        frames = await self.frames(chat, lambda frame: frame.get('event') == 'run_dropped')
+        self.assertEqual([frame['event'] for frame in frames], ['run_deferred', 'run_dropped'])
+        self.assertEqual(self.messages, [])
+        self.assertEqual(self.streams, [])
+        await chat.disconnect()
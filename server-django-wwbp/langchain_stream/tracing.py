@@ -0,0 +1,209 @@
+import contextvars
+import inspect
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MAX_TURN_SPANS = 1000
+
+# (session_id, message_id) of the turn the running code belongs to. Copied
+# into sync_to_async threads, so spans recorded there land on the same turn.
+current_turn = contextvars.ContextVar('current_turn', default=None)
+
+
+def set_turn(session_id, message_id):
+    current_turn.set((str(session_id), str(message_id)))
+
+
+def record_span(name, start, end, turn=None, **attrs):
+    """Queue one finished span (start/end as epoch seconds) for the current or given turn."""
+    turn = turn or current_turn.get()
+    if turn is None or not settings.TRACE_ENABLED:
+        return
+    get_tracer().submit({
+        "session_id": turn[0],
+        "message_id": turn[1],
+        "name": name,
+        "start": start,
+        "duration_ms": round((end - start) * 1000, 2),
+        "attrs": attrs,
+    })
+
+
+@contextmanager
+def span(name, **attrs):
+    start = time.time()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs['error'] = type(e).__name__
+        raise
+    finally:
+        record_span(name, start, time.time(), **attrs)
+
+
+def traced(name):
+    """Decorator form of span for sync and async functions."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class SQLiteSpanStore:
+    """Spans in a local SQLite file, pruned to the newest TRACE_MAX_SPANS rows."""
+
+    def __init__(self, path, max_spans):
+        self.path = path
+        self.max_spans = max_spans
+        self.local = threading.local()
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS spans (id INTEGER PRIMARY KEY, session_id TEXT, message_id TEXT, '
+                'name TEXT, start REAL, duration_ms REAL, attrs TEXT)')
+            conn.execute('CREATE INDEX IF NOT EXISTS spans_turn ON spans (session_id, message_id)')
+            self.local.conn = conn
+        return conn
+
+    def write(self, spans):
+        conn = self.connection()
+        with conn:
+            conn.executemany(
+                'INSERT INTO spans (session_id, message_id, name, start, duration_ms, attrs) VALUES (?, ?, ?, ?, ?, ?)',
+                [(s['session_id'], s['message_id'], s['name'], s['start'], s['duration_ms'], json.dumps(s['attrs']))
+                 for s in spans])
+            conn.execute('DELETE FROM spans WHERE id <= (SELECT MAX(id) FROM spans) - ?', (self.max_spans,))
+
+    def turn(self, session_id, message_id):
+        rows = self.connection().execute(
+            'SELECT name, start, duration_ms, attrs FROM spans WHERE session_id = ? AND message_id = ? ORDER BY start',
+            (str(session_id), str(message_id))).fetchall()
+        return [{"name": r[0], "start": r[1], "duration_ms": r[2], "attrs": json.loads(r[3])} for r in rows]
+
+    def turns(self, session_id, limit=50):
+        rows = self.connection().execute(
+            'SELECT message_id, MIN(start), COUNT(*) FROM spans WHERE session_id = ? '
+            'GROUP BY message_id ORDER BY MIN(start) DESC LIMIT ?', (str(session_id), limit)).fetchall()
+        return [{"message_id": r[0], "start": r[1], "spans": r[2]} for r in rows]
+
+
+class RedisSpanStore:
+    """
+    One capped Redis stream per turn, expiring after TRACE_TTL_SECONDS, plus a
+    per-session sorted set of recent turns. Shared by every worker and instance.
+    """
+
+    def __init__(self, ttl):
+        from django_redis import get_redis_connection
+        self.redis = get_redis_connection('default')
+        self.ttl = ttl
+
+    def write(self, spans):
+        pipe = self.redis.pipeline(transaction=False)
+        for s in spans:
+            stream = f"turn_trace:{s['session_id']}:{s['message_id']}"
+            index = f"turn_traces:{s['session_id']}"
+            pipe.xadd(stream, {"span": json.dumps(s)}, maxlen=MAX_TURN_SPANS, approximate=True)
+            pipe.expire(stream, self.ttl)
+            pipe.zadd(index, {s['message_id']: s['start']}, nx=True)
+            pipe.expire(index, self.ttl)
+        pipe.execute()
+
+    def turn(self, session_id, message_id):
+        entries = self.redis.xrange(f"turn_trace:{session_id}:{message_id}")
+        spans = [json.loads(fields[b'span']) for _, fields in entries]
+        return sorted(({k: s[k] for k in ('name', 'start', 'duration_ms', 'attrs')} for s in spans),
+                      key=lambda s: s['start'])
+
+    def turns(self, session_id, limit=50):
+        members = self.redis.zrevrange(f"turn_traces:{session_id}", 0, limit - 1, withscores=True)
+        return [{"message_id": m.decode(), "start": score,
+                 "spans": self.redis.xlen(f"turn_trace:{session_id}:{m.decode()}")} for m, score in members]
+
+
+class Tracer:
+    """Buffers spans and writes them in batches from one background thread."""
+
+    def __init__(self, store):
+        self.store = store
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, name='turn-tracer', daemon=True)
+        self.thread.start()
+
+    def submit(self, span):
+        self.queue.put(span)
+
+    def run(self):
+        while True:
+            spans = [self.queue.get()]
+            try:
+                while len(spans) < 500:
+                    spans.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                self.store.write(spans)
+            except Exception as e:
+                logger.error(f"Error writing {len(spans)} trace spans: {e}")
+
+
+def make_store():
+    if settings.TRACE_STORE == 'redis':
+        return RedisSpanStore(settings.TRACE_TTL_SECONDS)
+    return SQLiteSpanStore(settings.TRACE_SQLITE_PATH, settings.TRACE_MAX_SPANS)
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer(make_store())
+        return _tracer
+
+
+def turn_waterfall(session_id, message_id):
+    """
+    A turn's spans ordered by start, each with its offset from the first span,
+    or an empty list if the turn was not traced or has expired.
+    """
+    spans = get_tracer().store.turn(session_id, message_id)
+    if not spans:
+        return []
+    origin = spans[0]['start']
+    for s in spans:
+        s['offset_ms'] = round((s['start'] - origin) * 1000, 2)
+    return spans
+
+
+def list_turns(session_id, limit=50):
+    return get_tracer().store.turns(session_id, limit)
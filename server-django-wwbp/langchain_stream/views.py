@@ -5,21 +5,28 @@ import json
 import logging
 import os
 import re
+import time
 from collections import deque
 
-from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from django.apps import apps
 from django.conf import settings
 from django.core.cache import cache
+from django.utils import timezone
 from google.cloud import speech, texttospeech
 from langchain_stream.tasks import save_message_to_transcript, get_file_streams, save_usage_stats
+from langchain_stream.deltalog import get_delta_log
+from langchain_stream.heartbeat import get_heartbeat
+from langchain_stream.profiling import finish_turn_profile, start_turn_profile
+from langchain_stream.runqueue import get_run_queue
+from langchain_stream.tracing import current_turn, record_span, set_turn, traced
+from config.executors import in_executor, run_in
+from config.metrics import DISPATCHES, MESSAGES, RESUMED_FRAMES, RUNS_IN_FLIGHT, STAGE_ERRORS, WEBSOCKETS_ACTIVE, observe, timed
 from openai import OpenAI
 from openai._compat import model_dump
 from django.conf import settings
 from elevenlabs import ElevenLabs
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 MODERATION_THRESHOLD = {
@@ -32,9 +39,12 @@ MODERATION_THRESHOLD = {
 }
 
 
+@timed('moderation')
+@traced('moderation')
 async def moderate_content(text, client):
     try:
-        response = client.moderations.create(
+        response = await run_in(
+            'sdk', client.moderations.create,
             model="omni-moderation-latest",
             input=text,
         )
@@ -48,9 +58,12 @@ async def moderate_content(text, client):
         return False, None
     except Exception as e:
         logger.error(f"Error during moderation: {e}")
+        STAGE_ERRORS.labels('moderation').inc()
         return True, "moderation_error"
 
 
+@timed('ffmpeg')
+@traced('ffmpeg')
 async def convert_audio_to_webm_ffmpeg(audio_data):
     try:
         # Create a BytesIO stream to hold the output
@@ -71,11 +84,15 @@ async def convert_audio_to_webm_ffmpeg(audio_data):
             'pipe:1'
         ]
 
-        # Run the ffmpeg command, piping the input and output to BytesIO
-        process = subprocess.Popen(
-            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-        output, error = process.communicate(input=audio_data)
+        # Run the ffmpeg command on the cpu pool, piping the input and output to BytesIO
+        def transcode():
+            process = subprocess.Popen(
+                command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            output, error = process.communicate(input=audio_data)
+            return process, output, error
+
+        process, output, error = await run_in('cpu', transcode)
 
         if process.returncode != 0:
             raise Exception(f"ffmpeg error: {error.decode('utf-8')}")
@@ -88,6 +105,7 @@ async def convert_audio_to_webm_ffmpeg(audio_data):
 
     except Exception as e:
         print(f"Error converting audio to webm with ffmpeg: {e}")
+        STAGE_ERRORS.labels('ffmpeg').inc()
         return None
 
 
@@ -100,8 +118,14 @@ def get_cached_data(key, fetch_function, timeout=300):
 
 
 class PromptHook:
-    @sync_to_async
-    def get_system_prompt(self):
+    @staticmethod
+    def load_session(session_id):
+        """The session with the module, task, persona and user the prompts read, in one query."""
+        ChatSession = apps.get_model('accounts', 'ChatSession')
+        return ChatSession.objects.select_related('module', 'task__persona', 'user').get(id=session_id)
+
+    @staticmethod
+    def fetch_system_prompt():
         def fetch_prompt():
             SystemPrompt = apps.get_model('accounts', 'SystemPrompt')
             try:
@@ -111,77 +135,84 @@ class PromptHook:
                 return "You are a helpful assistant."
         return get_cached_data('system_prompt', fetch_prompt)
 
-    @sync_to_async
+    @staticmethod
+    def user_profile(user):
+        return {
+            "username": user.username,
+            "preferred_name": user.preferred_name,
+            "role": user.role,
+            "grade": user.grade,
+            "preferred_language": user.preferred_language,
+            "voice_speed": user.voice_speed
+        }
+
+    @in_executor('db')
+    def get_system_prompt(self):
+        return self.fetch_system_prompt()
+
+    @in_executor('db')
     def get_module_prompts(self, session_id):
-        ChatSession = apps.get_model('accounts', 'ChatSession')
         try:
-            session = ChatSession.objects.get(id=session_id)
-            module = session.module
-            return module.content
+            return self.load_session(session_id).module.content
         except Exception as e:
             logger.error(f"Error fetching module prompts: {e}")
 
-    @sync_to_async
+    @in_executor('db')
     def get_task_prompts(self, session_id):
-        ChatSession = apps.get_model('accounts', 'ChatSession')
         try:
-            session = ChatSession.objects.get(id=session_id)
-            task = session.task
+            task = self.load_session(session_id).task
             return task.content, task.instruction_prompt
         except Exception as e:
             logger.error(f"Error fetching task prompts: {e}")
 
-    @sync_to_async
+    @in_executor('db')
     def get_persona_prompts(self, session_id):
-        ChatSession = apps.get_model('accounts', 'ChatSession')
         try:
-            session = ChatSession.objects.get(id=session_id)
-            task = session.task
-            persona = task.persona
+            persona = self.load_session(session_id).task.persona
             return persona.name, persona.instructions
         except Exception as e:
             logger.error(f"Error fetching persona prompts: {e}")
 
-    @sync_to_async
+    @in_executor('db')
     def get_user_profile(self, session_id):
-        ChatSession = apps.get_model('accounts', 'ChatSession')
         try:
-            session = ChatSession.objects.get(id=session_id)
-            user = session.user
-            return {
-                "username": user.username,
-                "preferred_name": user.preferred_name,
-                "role": user.role,
-                "grade": user.grade,
-                "preferred_language": user.preferred_language,
-                "voice_speed": user.voice_speed
-            }
+            return self.user_profile(self.load_session(session_id).user)
         except Exception as e:
             logger.error(f"Error fetching user profile: {e}")
 
+    @in_executor('db')
+    def get_setup_context(self, session_id):
+        """Everything the setup instructions need, from one pool hop and one session query."""
+        session = self.load_session(session_id)
+        task = session.task
+        return {
+            "system_prompts": self.fetch_system_prompt(),
+            "module_content": session.module.content if session.module else None,
+            "task_content": task.content,
+            "persona_name": task.persona.name,
+            "persona_prompt": task.persona.instructions,
+            "user_profile_details": self.user_profile(session.user),
+        }
+
     async def get_cumulative_setup_instructions(self, session_id):
         try:
-            system_prompts = await self.get_system_prompt()
-            task_content, task_instruction = await self.get_task_prompts(session_id=session_id)
-            persona_name, persona_prompt = await self.get_persona_prompts(session_id=session_id)
-            user_profile_details = await self.get_user_profile(session_id=session_id)
-            module_content = await self.get_module_prompts(session_id=session_id)
+            context = await self.get_setup_context(session_id=session_id)
             return f"""
                 ### System Guidelines:
-                {system_prompts}
+                {context['system_prompts']}
 
                 ### Module Content:
-                {module_content}
+                {context['module_content']}
 
                 ### Task Details:
-                - **Content**: {task_content}
+                - **Content**: {context['task_content']}
 
                 ### Persona Information:
-                - **Name**: {persona_name}
-                - **Persona Prompt**: {persona_prompt}
+                - **Name**: {context['persona_name']}
+                - **Persona Prompt**: {context['persona_prompt']}
 
                 ### User Profile:
-                {user_profile_details}
+                {context['user_profile_details']}
             """
         except Exception as e:
             logger.error(f"Error creating cumulative setup instructions: {e}")
@@ -206,6 +237,7 @@ class AssistantSessionManager(PromptHook):
             self.session_counters[session_id] += 1
         return self.session_counters[session_id]
 
+    @timed('session_setup')
     async def setup(self, session_id):
         logger.debug(f"Setting up session for session_id={session_id}")
         try:
@@ -228,10 +260,10 @@ class AssistantSessionManager(PromptHook):
         logger.debug(f"Getting assistant for session_id={session_id}")
         ChatSession = apps.get_model('accounts', 'ChatSession')
         try:
-            session = await sync_to_async(ChatSession.objects.get)(id=session_id)
+            session = await run_in('db', ChatSession.objects.only('assistant_id', 'thread_id').get, id=session_id)
             if session.assistant_id:
-                assistant = self.client.beta.assistants.retrieve(
-                    session.assistant_id)
+                assistant = await run_in(
+                    'sdk', self.client.beta.assistants.retrieve, session.assistant_id)
                 logger.debug(
                     f"Retrieved existing assistant id: {assistant.id}")
                 return assistant
@@ -239,13 +271,14 @@ class AssistantSessionManager(PromptHook):
             instruction_prompt = await self.get_cumulative_setup_instructions(session_id=session_id)
             logger.debug(
                 f"The instruction prompt for session: {session_id} is as follows: {instruction_prompt}")
-            assistant = self.client.beta.assistants.create(
+            assistant = await run_in(
+                'sdk', self.client.beta.assistants.create,
                 model="gpt-4o-mini",
                 instructions=instruction_prompt,
                 tools=[{"type": "file_search"}],
             )
-            session.assistant_id = assistant.id
-            await sync_to_async(session.save)()
+            await run_in('db', ChatSession.objects.filter(id=session_id).update,
+                         assistant_id=assistant.id, updated_at=timezone.now())
             logger.debug(f"Created new assistant: {assistant.id}")
             return assistant
         except Exception as e:
@@ -256,36 +289,43 @@ class AssistantSessionManager(PromptHook):
         logger.debug(f"Getting thread for session_id={session_id}")
         ChatSession = apps.get_model('accounts', 'ChatSession')
         try:
-            session = await sync_to_async(ChatSession.objects.get)(id=session_id)
+            session = await run_in('db', ChatSession.objects.only('assistant_id', 'thread_id').get, id=session_id)
             if session.thread_id:
-                thread = self.client.beta.threads.retrieve(session.thread_id)
+                thread = await run_in('sdk', self.client.beta.threads.retrieve, session.thread_id)
                 logger.debug(f"Retrieved existing thread id: {thread.id}")
                 return thread
 
-            thread = self.client.beta.threads.create()
-            session.thread_id = thread.id
-            await sync_to_async(session.save)()
+            thread = await run_in('sdk', self.client.beta.threads.create)
+            await run_in('db', ChatSession.objects.filter(id=session_id).update,
+                         thread_id=thread.id, updated_at=timezone.now())
             logger.debug(f"Created new thread: {thread.id}")
             return thread
         except Exception as e:
             logger.error(f"Error in get_thread: {e}")
             return None
 
+    @timed('create_message')
+    @traced('create_message')
     async def create_user_message(self, message):
         logger.debug(f"Creating user message: {message}")
         try:
-            self.client.beta.threads.messages.create(
+            await run_in(
+                'sdk', self.client.beta.threads.messages.create,
                 thread_id=self.thread.id, role="user", content=message
             )
         except Exception as e:
             logger.error(f"Error creating user message: {e}")
+            STAGE_ERRORS.labels('create_message').inc()
 
+    @timed('run_create')
+    @traced('run_create')
     async def get_run_stream(self):
         logger.debug(
             f"Getting run stream for assistant id: {self.assistant.id}")
         while True:
             try:
-                stream = self.client.beta.threads.runs.create(
+                stream = await run_in(
+                    'sdk', self.client.beta.threads.runs.create,
                     assistant_id=self.assistant.id,
                     thread_id=self.thread.id,
                     stream=True
@@ -299,30 +339,39 @@ class AssistantSessionManager(PromptHook):
                     await asyncio.sleep(1)
                 else:
                     logger.error(f"Error getting run stream: {e}")
+                    STAGE_ERRORS.labels('run_create').inc()
                     return None
 
     async def async_stream(self, stream):
         logger.debug("Starting async stream")
         try:
-            loop = asyncio.get_running_loop()
-            for event in stream:
-                logger.debug(f"Streaming event: {event}")
-                yield await loop.run_in_executor(None, lambda: event)
+            events = iter(stream)
+            while True:
+                # Reading the next event blocks on the network, so it runs on the sdk pool
+                event = await run_in('sdk', next, events, None)
+                if event is None:
+                    break
+                # Per-event logs are lazy and sampled; the event repr is only built if kept
+                logger.debug("Streaming event: %s", event.event, extra={'sample': 'stream_event'})
+                yield event
         except Exception as e:
             logger.error(f"Error in async stream: {e}")
 
+    @timed('vector_store')
     async def initialize_vector_store(self, session_id):
         try:
             file_streams = await get_file_streams(session_id)
             if file_streams:
-                vector_store = self.client.beta.vector_stores.create(
+                vector_store = await run_in(
+                    'sdk', self.client.beta.vector_stores.create,
                     name="Educational Content", expires_after={
                         "anchor": "last_active_at",
                         "days": 2
                     }
                 )
                 logger.debug(f"Created vector store: {vector_store.id}")
-                file_batch = self.client.beta.vector_stores.file_batches.upload_and_poll(
+                file_batch = await run_in(
+                    'sdk', self.client.beta.vector_stores.file_batches.upload_and_poll,
                     vector_store_id=vector_store.id, files=file_streams
                 )
                 logger.debug(
@@ -339,7 +388,8 @@ class AssistantSessionManager(PromptHook):
     async def update_assistant_with_vector_store(self):
         try:
             if self.vector_store:
-                self.client.beta.assistants.update(
+                await run_in(
+                    'sdk', self.client.beta.assistants.update,
                     assistant_id=self.assistant.id,
                     tool_resources={"file_search": {
                         "vector_store_ids": [self.vector_store.id]}},
@@ -351,30 +401,344 @@ class AssistantSessionManager(PromptHook):
 
 
 class BaseWebSocketConsumer(AsyncWebsocketConsumer):
-    async def ping(self):
+    turn_profile = None
+    turn_started = None
+    counted = False
+    peers = frozenset()
+    accepts_audio = False
+    stream_handler = None
+    handling = 0
+    # Last seq a resume sent; group frames up to it are duplicates
+    replayed_seq = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Queued turns of this socket -> the task watching them
+        self.deferred = {}
+
+    def track_connected(self):
+        if not self.counted:
+            self.counted = True
+            WEBSOCKETS_ACTIVE.labels(type(self).__name__).inc()
+
+    def track_disconnected(self):
+        if self.counted:
+            self.counted = False
+            WEBSOCKETS_ACTIVE.labels(type(self).__name__).dec()
+
+    def observe_first_token(self, stream_started):
+        # Measured from the user's message when this consumer received it,
+        # otherwise (initial message, peer tabs) from the start of the run
+        started = self.turn_started or stream_started
+        self.turn_started = None
+        observe('time_to_first_token', time.perf_counter() - started)
+
+    async def dispatch(self, message):
+        # Messages in progress; the heartbeat leaves busy sockets alone
+        self.handling += 1
+        try:
+            await super().dispatch(message)
+        finally:
+            self.handling -= 1
+
+    async def websocket_receive(self, message):
+        # receive() sets the turn once it has a message_id; pongs leave it unset
+        current_turn.set(None)
+        received_at = time.time()
+        try:
+            await super().websocket_receive(message)
+        finally:
+            if current_turn.get():
+                record_span('receive', received_at, time.time(), consumer=type(self).__name__)
+
+    def trace_dispatch(self, event):
+        """Attach this run to its turn and record the delay from produce_run to the handler."""
+        set_turn(self.session_id, event["message_id"])
+        if event.get("sent_at"):
+            record_span('dispatch', event["sent_at"], time.time(), consumer=type(self).__name__)
+
+    async def join_group(self):
+        """
+        Join the session group and announce ourselves. Members already in the
+        group reply directly, so every member knows its peers' channels.
+        """
+        self.peers = set()
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        await self.channel_layer.group_send(
+            self.room_group_name, {"type": "group.peer_joined", "channel": self.channel_name})
+
+    async def leave_group(self):
+        await self.channel_layer.group_send(
+            self.room_group_name, {"type": "group.peer_left", "channel": self.channel_name})
+        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+
+    async def group_peer_joined(self, event):
+        if event["channel"] == self.channel_name:
+            return
+        self.peers.add(event["channel"])
+        await self.channel_layer.send(
+            event["channel"], {"type": "group.peer_present", "channel": self.channel_name})
+
+    async def group_peer_present(self, event):
+        self.peers.add(event["channel"])
+
+    async def group_peer_left(self, event):
+        self.peers.discard(event["channel"])
+
+    async def produce_run(self, message_id, message):
+        """
+        Add the user's `message` to the thread and stream the run answering it. The session's producer
+        lock makes one socket at a time the producer, so sockets sharing a
+        session never start two runs on the thread. A turn that arrives while
+        another socket is streaming is queued and the client told; the
+        producer hands it back to this socket when its turn comes, to run with
+        this socket's own handler. The message is only added once the turn
+        holds the lock, since OpenAI rejects new messages while another run on
+        the thread is active. Other sockets in the session get the run's
+        frames through send_frame.
+        """
+        runs = get_run_queue()
+        if not await run_in('db', runs.acquire, self.session_id, self.channel_name):
+            self.deferred[message_id] = None
+            await run_in('db', runs.push, self.session_id, {
+                "message_id": message_id, "message": message, "channel": self.channel_name,
+                "queued_at": time.time()})
+            # Check again in case the producer finished before seeing the queued turn
+            if not await run_in('db', runs.acquire, self.session_id, self.channel_name):
+                DISPATCHES.labels('pending').inc()
+                self.deferred[message_id] = asyncio.create_task(self.watch_deferred(message_id))
+                await self.send(text_data=json.dumps({"event": "run_deferred", "message_id": message_id}))
+                await self.end_turn()
+                return
+            # Our turn is now in the queue, behind any older ones
+            message_id = message = None
+        await self.run_turns(message_id, message)
+
+    async def run_turns(self, message_id=None, message=None):
+        """
+        With the producer lock held: add `message` and run `message_id`, then
+        the queued turns in order. Turns of this socket run here; the first one queued by another
+        socket gets the lock handed over along with it.
+        """
+        runs = get_run_queue()
+        refresher = asyncio.create_task(self.refresh_producer_lock())
+        handed_over = False
+        try:
+            while True:
+                if message_id is not None:
+                    await self.session_manager.create_user_message(message=message)
+                    await run_in('db', get_delta_log().start_run, self.session_id)
+                    DISPATCHES.labels('group' if self.peers else 'local').inc()
+                    await self.dispatch({"type": self.stream_handler, "message_id": message_id, "sent_at": time.time()})
+                    message_id = None
+
+                entry = await run_in('db', runs.pop, self.session_id)
+                if entry is None:
+                    await run_in('db', runs.release, self.session_id, self.channel_name)
+                    # A turn queued while we released is ours to run if nobody else took the lock
+                    if not await run_in('db', runs.length, self.session_id) or \
+                            not await run_in('db', runs.acquire, self.session_id, self.channel_name):
+                        return
+                    continue
+                if time.time() - entry["queued_at"] > settings.RUN_PENDING_MAX_SECONDS:
+                    DISPATCHES.labels('dropped').inc()
+                    await self.channel_layer.send(
+                        entry["channel"], {"type": "run.dropped", "message_id": entry["message_id"]})
+                    continue
+                if entry["channel"] == self.channel_name:
+                    # Unless it was already given up on
+                    if self.forget_deferred(entry["message_id"]):
+                        message_id, message = entry["message_id"], entry["message"]
+                    continue
+
+                DISPATCHES.labels('handoff').inc()
+                await run_in('db', runs.hand_over, self.session_id, entry["channel"])
+                handed_over = True
+                await self.channel_layer.send(entry["channel"], {"type": "run.start", **entry})
+                return
+        except Exception as e:
+            logger.error(f"Error running turns in session {self.session_id}: {e}")
+            if not handed_over:
+                await run_in('db', runs.release, self.session_id, self.channel_name)
+        finally:
+            refresher.cancel()
+
+    async def refresh_producer_lock(self):
+        runs = get_run_queue()
         while True:
+            await asyncio.sleep(settings.RUN_PRODUCER_LOCK_SECONDS / 3)
             try:
-                await self.send(text_data=json.dumps({"type": "ping"}))
-                logger.debug("Ping sent")
+                await run_in('db', runs.refresh, self.session_id, self.channel_name)
             except Exception as e:
-                logger.error(f"Error in ping: {e}")
-                await self.close()
-                break
-            await asyncio.sleep(30)
+                logger.error(f"Error refreshing run producer lock for session {self.session_id}: {e}")
+
+    async def run_start(self, event):
+        """The producer handed this socket the lock and its queued turn."""
+        runs = get_run_queue()
+        if not await run_in('db', runs.owns, self.session_id, self.channel_name) and \
+                not await run_in('db', runs.acquire, self.session_id, self.channel_name):
+            # The lock lapsed while this socket was busy and another producer
+            # took it; wait in the queue again
+            await run_in('db', runs.push, self.session_id, {
+                "message_id": event["message_id"], "message": event["message"], "channel": self.channel_name,
+                "queued_at": event["queued_at"]})
+            return
+        # A turn already given up on is skipped, but the queue behind it still runs
+        if self.forget_deferred(event["message_id"]):
+            await self.run_turns(event["message_id"], event["message"])
+        else:
+            await self.run_turns()
+
+    async def run_retry(self, event):
+        """A queued turn is still waiting: if the lock is free, its producer went away, so run the queue."""
+        if event["message_id"] in self.deferred and \
+                await run_in('db', get_run_queue().acquire, self.session_id, self.channel_name):
+            await self.run_turns()
+
+    async def run_dropped(self, event):
+        if self.forget_deferred(event["message_id"]):
+            await self.send_run_dropped(event["message_id"])
+
+    async def watch_deferred(self, message_id):
+        """
+        Retry a queued turn every lock lifetime, through the consumer's own
+        message queue, and give it up after RUN_PENDING_MAX_SECONDS.
+        """
+        deadline = time.monotonic() + settings.RUN_PENDING_MAX_SECONDS
+        while time.monotonic() < deadline:
+            await asyncio.sleep(settings.RUN_PRODUCER_LOCK_SECONDS)
+            await self.channel_layer.send(self.channel_name, {"type": "run.retry", "message_id": message_id})
+        if message_id in self.deferred:
+            del self.deferred[message_id]
+            DISPATCHES.labels('dropped').inc()
+            await self.send_run_dropped(message_id)
+
+    def forget_deferred(self, message_id):
+        """Stop tracking a queued turn; False if it was not (or no longer) queued."""
+        if message_id not in self.deferred:
+            return False
+        watcher = self.deferred.pop(message_id)
+        if watcher is not None and watcher is not asyncio.current_task():
+            watcher.cancel()
+        return True
+
+    async def send_run_dropped(self, message_id):
+        logger.warning(f"Dropped queued turn {message_id} in session {self.session_id}")
+        await self.send(text_data=json.dumps({
+            "event": "run_dropped",
+            "message_id": message_id,
+            "error": "Your message could not be answered in time. Please send it again.",
+        }))
+
+    async def send_frame(self, frame=None, bytes_data=None):
+        """
+        Send a run frame (a JSON-able dict, or audio bytes) to this socket, log
+        it for resumes, and fan it out to the session's other sockets. JSON
+        frames carry their log position as `seq`.
+        """
+        text_data = None
+        if frame is not None:
+            text_data = get_delta_log().append_text(self.session_id, frame)
+            seq = frame["seq"]
+        else:
+            seq = get_delta_log().append_audio(self.session_id, bytes_data)
+        await self.send(text_data=text_data, bytes_data=bytes_data)
+        if self.peers:
+            await self.channel_layer.group_send(self.room_group_name, {
+                "type": "run.delta",
+                "origin": self.channel_name,
+                "seq": seq,
+                "text_data": text_data,
+                "bytes_data": bytes_data,
+            })
+
+    async def run_delta(self, event):
+        if event["origin"] == self.channel_name:
+            return
+        # Frames queued behind a resume were already replayed from the log
+        if event["seq"] <= self.replayed_seq:
+            return
+        self.replayed_seq = 0
+        if event["bytes_data"] is not None and not self.accepts_audio:
+            return
+        await self.send(text_data=event["text_data"], bytes_data=event["bytes_data"])
+
+    async def receive_resume(self, text_data_json):
+        last_seq = text_data_json.get("last_seq", 0)
+        if isinstance(last_seq, str) and last_seq.isascii() and last_seq.isdigit():
+            last_seq = int(last_seq)
+        if isinstance(last_seq, bool) or not isinstance(last_seq, int) or last_seq < 0:
+            logger.warning(f"Invalid resume cursor {last_seq!r} in session {self.session_id}")
+            await self.send(text_data=json.dumps({
+                "event": "error",
+                "error": "last_seq must be a non-negative integer.",
+            }))
+            return
+        await self.resume(last_seq)
+
+    async def resume(self, last_seq):
+        """
+        Replay the run frames a reconnecting client missed, after the last
+        `seq` it saw. While the session's run is still streaming from another
+        socket, keep following the log until it ends.
+        """
+        delta_log = get_delta_log()
+        runs = get_run_queue()
+        deadline = time.monotonic() + settings.RUN_PENDING_MAX_SECONDS
+        # One more read after the run ends picks up its last queued frames
+        final_pass = False
+        while True:
+            running = await run_in('db', runs.running, self.session_id) and time.monotonic() < deadline
+            entries = await run_in('db', delta_log.read, self.session_id, last_seq)
+            for seq, text_data, bytes_data in entries:
+                last_seq = self.replayed_seq = seq
+                if bytes_data is not None and not self.accepts_audio:
+                    continue
+                await self.send(text_data=text_data, bytes_data=bytes_data)
+            RESUMED_FRAMES.inc(len(entries))
+            if not running:
+                if final_pass:
+                    return
+                final_pass = True
+            await asyncio.sleep(0.25)
+
+    async def begin_turn(self):
+        # A turn that never reached completion is closed out first
+        await self.end_turn()
+        self.turn_profile = await start_turn_profile(self.session_id, type(self).__name__)
+        self.turn_started = time.perf_counter()
+
+    async def end_turn(self):
+        profile, self.turn_profile = self.turn_profile, None
+        await finish_turn_profile(profile)
 
     async def connect(self):
         try:
             await self.accept()
-            asyncio.create_task(self.ping())
+            self.track_connected()
+            get_heartbeat().register(self)
         except Exception as e:
             logger.error(f"WebSocket connection failed: {e}")
             await self.close()
 
     async def disconnect(self, close_code):
+        get_heartbeat().unregister(self)
+        self.track_disconnected()
+        if self.deferred:
+            for message_id in list(self.deferred):
+                self.forget_deferred(message_id)
+            try:
+                await run_in('db', get_run_queue().discard, self.session_id, self.channel_name)
+            except Exception as e:
+                logger.error(f"Error discarding queued turns for session {self.session_id}: {e}")
+        await self.end_turn()
         await super().disconnect(close_code)
 
 
 class ChatConsumer(BaseWebSocketConsumer):
+    stream_handler = "stream_text_response"
+
+    @timed('connect')
     async def connect(self):
         self.session_id = self.scope['url_route']['kwargs']['session_id']
         self.room_group_name = f"chat_{self.session_id}"
@@ -382,13 +746,12 @@ class ChatConsumer(BaseWebSocketConsumer):
         logger.debug(
             f"User attempting to connect to session {self.session_id} in group {self.room_group_name}")
 
-        await self.channel_layer.group_add(
-            self.room_group_name, self.channel_name
-        )
+        await self.join_group()
         logger.debug(
             f"Connected to room group: {self.room_group_name} with channel: {self.channel_name}")
 
         await self.accept()
+        self.track_connected()
 
         logger.debug(
             f"Attempting WebSocket connection: session_id={self.session_id}")
@@ -400,14 +763,13 @@ class ChatConsumer(BaseWebSocketConsumer):
 
             logger.debug(
                 f"WebSocket connected: session_id={self.session_id}, assistant_id={self.session_manager.assistant.id}, thread_id={self.session_manager.thread.id}")
-            asyncio.create_task(self.ping())
+            get_heartbeat().register(self)
 
-            if not cache.get(f'initial_message_sent_{self.session_id}', False):
+            if not await run_in('db', cache.get, f'initial_message_sent_{self.session_id}', False):
                 message_id = await self.session_manager.get_next_message_id(self.session_id)
                 initial_message = "Begin the conversation."
-                await self.session_manager.create_user_message(message=initial_message)
-                await self.channel_layer.group_send(self.room_group_name, {"type": "stream_text_response", "message_id": message_id})
-                cache.set(f'initial_message_sent_{self.session_id}', True)
+                await self.produce_run(message_id, initial_message)
+                await run_in('db', cache.set, f'initial_message_sent_{self.session_id}', True)
 
         except Exception as e:
             logger.error(f"WebSocket connection failed: {e}")
@@ -416,9 +778,7 @@ class ChatConsumer(BaseWebSocketConsumer):
     async def disconnect(self, close_code):
         await super().disconnect(close_code)
 
-        await self.channel_layer.group_discard(
-            self.room_group_name, self.channel_name
-        )
+        await self.leave_group()
         logger.debug(
             f"Disconnected from room group: {self.room_group_name} with channel: {self.channel_name}")
 
@@ -429,10 +789,16 @@ class ChatConsumer(BaseWebSocketConsumer):
         text_data_json = json.loads(text_data)
         if text_data_json.get("type") == "pong":
             logger.debug(f"Received pong from client: {self.scope['client']}")
+            get_heartbeat().pong(self)
+            return
+        if text_data_json.get("type") == "resume":
+            await self.receive_resume(text_data_json)
             return
 
+        await self.begin_turn()
         message = text_data_json["message"]
         message_id = await self.session_manager.get_next_message_id(self.session_id)
+        set_turn(self.session_id, message_id)
 
         logger.debug(
             f"Received message: {message}, from user in session: {self.session_id}")
@@ -440,6 +806,7 @@ class ChatConsumer(BaseWebSocketConsumer):
         # Moderation check for incoming user message
         is_flagged, category = await moderate_content(message, self.session_manager.client)
         if is_flagged:
+            MESSAGES.labels('ChatConsumer', 'flagged').inc()
             # Save user message and respond as blocked
             moderation_response = f"Your message was blocked due to content related to {category}."
             await save_message_to_transcript(
@@ -455,18 +822,25 @@ class ChatConsumer(BaseWebSocketConsumer):
             await self.send(text_data=json.dumps({"event": "on_parser_start", "message_id": message_id}))
             await self.send(text_data=json.dumps({"event": "on_parser_stream", "message_id": message_id, "value": moderation_response}))
             await self.send(text_data=json.dumps({"event": "on_parser_end", "message_id": message_id}))
+            await self.end_turn()
             return
 
+        MESSAGES.labels('ChatConsumer', 'accepted').inc()
         try:
             await save_message_to_transcript(session_id=self.session_id, message_id=str(message_id),
                                              user_message=message, bot_message=None, has_audio=False, audio_bytes=None)
-            await self.session_manager.create_user_message(message=message)
-            await self.channel_layer.group_send(self.room_group_name, {"type": "stream_text_response", "message_id": message_id})
+            await self.produce_run(message_id, message)
         except Exception as e:
             logger.error(f"Error processing received message: {e}")
+            await self.end_turn()
 
     async def stream_text_response(self, event):
         message_id = event["message_id"]
+        self.trace_dispatch(event)
+        run_started = time.time()
+        stream_started = time.perf_counter()
+        first_token = True
+        RUNS_IN_FLIGHT.labels('ChatConsumer').inc()
         stream = await self.session_manager.get_run_stream()
         bot_message_buffer = []
         logger.debug(
@@ -477,18 +851,24 @@ class ChatConsumer(BaseWebSocketConsumer):
                 chunk["message_id"] = message_id
                 if event.event == 'thread.run.created':
                     chunk["event"] = "on_parser_start"
-                    await self.send(text_data=json.dumps(chunk))
+                    await self.send_frame(chunk)
                 elif event.event == 'thread.message.delta':
                     value = event.data.delta.content[0].text.value
                     if isinstance(value, bytes):
                         value = value.decode('utf-8', errors='replace')
                     chunk["event"] = "on_parser_stream"
                     chunk["value"] = value
-                    await self.send(text_data=json.dumps(chunk))
+                    if first_token:
+                        first_token = False
+                        self.observe_first_token(stream_started)
+                        record_span('first_delta', run_started, time.time())
+                    await self.send_frame(chunk)
                     bot_message_buffer.append(value)
                 elif event.event == 'thread.run.completed':
                     chunk["event"] = "on_parser_end"
-                    await self.send(text_data=json.dumps(chunk))
+                    await self.send_frame(chunk)
+                    observe('run_total', time.perf_counter() - stream_started)
+                    record_span('run', run_started, time.time())
                     complete_bot_message = ''.join(bot_message_buffer)
 
                     await save_message_to_transcript(session_id=self.session_id, message_id=message_id,
@@ -511,21 +891,27 @@ class ChatConsumer(BaseWebSocketConsumer):
                     continue
         except Exception as e:
             logger.error(f"Error in chain events: {e}")
+            STAGE_ERRORS.labels('run_stream').inc()
+        finally:
+            RUNS_IN_FLIGHT.labels('ChatConsumer').dec()
+            await self.end_turn()
 
 
 class AudioConsumer(BaseWebSocketConsumer):
+    accepts_audio = True
+    stream_handler = "stream_audio_response"
     audio_queue = deque()
     bot_audio_buffer = []
     bot_message_buffer = []
 
+    @timed('connect')
     async def connect(self):
         self.session_id = self.scope['url_route']['kwargs']['session_id']
         self.room_group_name = f"chat_{self.session_id}"
         self.session_manager = AssistantSessionManager()
-        await self.channel_layer.group_add(
-            self.room_group_name, self.channel_name
-        )
+        await self.join_group()
         await self.accept()
+        self.track_connected()
         try:
             await self.session_manager.setup(session_id=self.session_id)
             if not self.session_manager.assistant or not self.session_manager.thread:
@@ -533,14 +919,13 @@ class AudioConsumer(BaseWebSocketConsumer):
 
             logger.debug(
                 f"Audio WebSocket connected: session_id={self.session_id}")
-            asyncio.create_task(self.ping())
+            get_heartbeat().register(self)
 
-            if not cache.get(f'initial_message_sent_{self.session_id}', False):
+            if not await run_in('db', cache.get, f'initial_message_sent_{self.session_id}', False):
                 message_id = await self.session_manager.get_next_message_id(self.session_id)
                 initial_message = "Begin the conversation."
-                await self.session_manager.create_user_message(message=initial_message)
-                await self.channel_layer.group_send(self.room_group_name, {"type": "stream_audio_response", "message_id": message_id})
-                cache.set(f'initial_message_sent_{self.session_id}', True)
+                await self.produce_run(message_id, initial_message)
+                await run_in('db', cache.set, f'initial_message_sent_{self.session_id}', True)
 
         except Exception as e:
             logger.error(f"WebSocket connection failed: {e}")
@@ -549,9 +934,7 @@ class AudioConsumer(BaseWebSocketConsumer):
     async def disconnect(self, close_code):
         await super().disconnect(close_code)
 
-        await self.channel_layer.group_discard(
-            self.room_group_name, self.channel_name
-        )
+        await self.leave_group()
         logger.debug(
             f"Disconnected from room group: {self.room_group_name} with channel: {self.channel_name}")
 
@@ -561,7 +944,9 @@ class AudioConsumer(BaseWebSocketConsumer):
     async def receive(self, bytes_data=None, text_data=None):
         if bytes_data:
             logger.debug(f"Audio data received: {type(bytes_data)}")
+            await self.begin_turn()
             message_id = await self.session_manager.get_next_message_id(self.session_id)
+            set_turn(self.session_id, message_id)
 
             # transcript = await self.process_audio(bytes_data)
             transcript = await self.stt_openai(bytes_data)
@@ -569,6 +954,7 @@ class AudioConsumer(BaseWebSocketConsumer):
             # Moderation check for incoming user transcript
             is_flagged, category = await moderate_content(transcript, self.session_manager.client)
             if is_flagged:
+                MESSAGES.labels('AudioConsumer', 'flagged').inc()
                 moderation_message = f"Your audio message was blocked due to content related to {category}."
                 audio_chunk = await self.text_to_speech(self.process_text_for_tts(moderation_message))
                 self.audio_queue.append(audio_chunk)
@@ -584,25 +970,32 @@ class AudioConsumer(BaseWebSocketConsumer):
                     has_audio=True,
                     audio_bytes=audio_chunk
                 )
+                await self.end_turn()
                 return
 
             await save_message_to_transcript(session_id=self.session_id, message_id=message_id,
                                              user_message=transcript, bot_message=None, has_audio=True, audio_bytes=bytes_data)
             if transcript:
-                await self.session_manager.create_user_message(message=transcript)
+                MESSAGES.labels('AudioConsumer', 'accepted').inc()
                 await self.send(text_data=json.dumps({"transcript": transcript, "message_id": message_id}))
-                await self.channel_layer.group_send(self.room_group_name, {"type": "stream_audio_response", "message_id": message_id})
+                await self.produce_run(message_id, transcript)
 
             else:
+                MESSAGES.labels('AudioConsumer', 'unheard').inc()
                 moderation_message = "Sorry, I was unable to hear that."
                 audio_chunk = await self.text_to_speech(self.process_text_for_tts(moderation_message))
                 self.audio_queue.append(audio_chunk)
                 asyncio.create_task(self.send_audio_chunk())
+                await self.end_turn()
         else:
             text_data_json = json.loads(text_data)
             if text_data_json.get("type") == "pong":
                 logger.debug(
                     f"Received pong from client: {self.scope['client']}")
+                get_heartbeat().pong(self)
+                return
+            if text_data_json.get("type") == "resume":
+                await self.receive_resume(text_data_json)
                 return
 
     async def process_audio(self, audio_data):
@@ -625,6 +1018,8 @@ class AudioConsumer(BaseWebSocketConsumer):
             logger.error(f"Error during speech recognition: {e}")
             return ""
 
+    @timed('stt')
+    @traced('stt')
     async def stt_openai(self, audio_data):
         logger.debug(f"Audio data size: {len(audio_data)} bytes")
 
@@ -643,7 +1038,8 @@ class AudioConsumer(BaseWebSocketConsumer):
             client = OpenAI()  # Assuming you've instantiated OpenAI client earlier
 
             # Pass the BytesIO object with explicit filename and MIME type
-            response = client.audio.translations.create(
+            response = await run_in(
+                'sdk', client.audio.translations.create,
                 model="whisper-1",
                 # Specify filename and MIME type
                 file=("audio.webm", webm_audio, "audio/webm"),
@@ -658,10 +1054,16 @@ class AudioConsumer(BaseWebSocketConsumer):
 
         except Exception as e:
             logger.error(f"Error during speech recognition: {e}")
+            STAGE_ERRORS.labels('stt').inc()
             return ""
 
     async def stream_audio_response(self, event):
         message_id = event["message_id"]
+        self.trace_dispatch(event)
+        run_started = time.time()
+        stream_started = time.perf_counter()
+        first_token = True
+        RUNS_IN_FLIGHT.labels('AudioConsumer').inc()
         stream = await self.session_manager.get_run_stream()
         try:
             buffer = []
@@ -670,14 +1072,18 @@ class AudioConsumer(BaseWebSocketConsumer):
                 chunk["message_id"] = message_id
                 if event.event == 'thread.run.created':
                     chunk["event"] = "on_parser_start"
-                    await self.send(text_data=json.dumps(chunk))
+                    await self.send_frame(chunk)
                 elif event.event == 'thread.message.delta':
                     value = event.data.delta.content[0].text.value
                     if isinstance(value, bytes):
                         value = value.decode('utf-8', errors='replace')
                     chunk["event"] = "on_parser_stream"
                     chunk["value"] = value
-                    logger.debug(f"Received chunk: {chunk['value']}")
+                    logger.debug("Received chunk: %r", value, extra={'sample': 'audio_delta'})
+                    if first_token:
+                        first_token = False
+                        self.observe_first_token(stream_started)
+                        record_span('first_delta', run_started, time.time())
                     if value.startswith(" "):
                         buffer.append(value)
                     else:
@@ -686,14 +1092,13 @@ class AudioConsumer(BaseWebSocketConsumer):
                         else:
                             buffer.append(value)
                     self.bot_message_buffer.append(value)
-                    await self.send(text_data=json.dumps(chunk))
+                    await self.send_frame(chunk)
 
-                    logger.debug(f"Current buffer: {' '.join(buffer)}")
 
                     if any(p in buffer[-1] for p in ['.', '!', '?', ';', ',']):
                         batched_text = ' '.join(buffer)
-                        logger.debug(
-                            f"Buffer converted to audio: {batched_text}")
+                        logger.debug("Buffer converted to audio: %s", batched_text,
+                                     extra={'sample': 'tts_batch'})
                         buffer = []
                         processed_text = self.process_text_for_tts(
                             batched_text)
@@ -701,9 +1106,9 @@ class AudioConsumer(BaseWebSocketConsumer):
 
                         self.bot_audio_buffer.append(audio_chunk)
                         self.audio_queue.append(audio_chunk)
-                        asyncio.create_task(self.send_audio_chunk())
-                        logger.debug(
-                            f"Audio chunk queued: {len(audio_chunk)} bytes")
+                        asyncio.create_task(self.send_audio_chunk(fan_out=True))
+                        logger.debug("Audio chunk queued: %d bytes", len(audio_chunk),
+                                     extra={'sample': 'tts_batch'})
                 elif event.event == 'thread.run.completed':
                     if buffer:
                         batched_text = ' '.join(buffer)
@@ -715,8 +1120,10 @@ class AudioConsumer(BaseWebSocketConsumer):
                         audio_chunk = await self.text_to_speech(processed_text)
                         self.bot_audio_buffer.append(audio_chunk)
                         self.audio_queue.append(audio_chunk)
-                        asyncio.create_task(self.send_audio_chunk())
-                    await self.send(text_data=json.dumps({'event': 'on_parser_end'}))
+                        asyncio.create_task(self.send_audio_chunk(fan_out=True))
+                    await self.send_frame({'event': 'on_parser_end'})
+                    observe('run_total', time.perf_counter() - stream_started)
+                    record_span('run', run_started, time.time())
                     complete_bot_message = ''.join(self.bot_message_buffer)
                     complete_audio = b''.join(self.bot_audio_buffer)
                     logger.debug(
@@ -739,13 +1146,20 @@ class AudioConsumer(BaseWebSocketConsumer):
                         f"Unknown 'chunk' event: {chunk.get('event', 'no event')}")
         except Exception as e:
             logger.error(f"Error in chain events: {e}")
+            STAGE_ERRORS.labels('run_stream').inc()
+        finally:
+            RUNS_IN_FLIGHT.labels('AudioConsumer').dec()
+            await self.end_turn()
 
-    async def send_audio_chunk(self, audio_chunk=None):
+    async def send_audio_chunk(self, audio_chunk=None, fan_out=False):
         if audio_chunk:
             self.audio_queue.append(audio_chunk)
         while self.audio_queue:
             audio_chunk = self.audio_queue.popleft()
-            await self.send(bytes_data=audio_chunk)
+            if fan_out:
+                await self.send_frame(bytes_data=audio_chunk)
+            else:
+                await self.send(bytes_data=audio_chunk)
 
     def process_text_for_tts(self, text):
         text = re.sub(r'[,.!?;*#]', '', text)
@@ -753,14 +1167,14 @@ class AudioConsumer(BaseWebSocketConsumer):
 
     async def fetch_voice_speed(self):
         cache_key = f"voice_speed_{self.session_id}"
-        voice_speed = cache.get(cache_key)
+        voice_speed = await run_in('db', cache.get, cache_key)
 
         if voice_speed is None:
             logger.debug(
                 f"Fetching voice speed for session_id={self.session_id}")
             user_profile = await self.session_manager.get_user_profile(self.session_id)
             voice_speed = float(user_profile['voice_speed'])
-            cache.set(cache_key, voice_speed, timeout=3600)
+            await run_in('db', cache.set, cache_key, voice_speed, timeout=3600)
         else:
             logger.debug(f"Using cached voice speed: {voice_speed}")
 
@@ -791,6 +1205,8 @@ class AudioConsumer(BaseWebSocketConsumer):
     #         logger.error(f"Error during text-to-speech synthesis: {e}")
     #         return b""
 
+    @timed('tts_chunk')
+    @traced('tts_chunk')
     async def text_to_speech(self, text: str) -> bytes:
         """
         Replace Google TTS with Eleven Labs TTS (Prof. Angela voice).
@@ -810,11 +1226,11 @@ class AudioConsumer(BaseWebSocketConsumer):
             )
             return b"".join(chunks)
 
-        # run it off-thread
-        loop = asyncio.get_event_loop()
+        # run it on the sdk pool
         try:
-            audio_bytes = await loop.run_in_executor(None, sync_generate)
+            audio_bytes = await run_in('sdk', sync_generate)
             return audio_bytes
         except Exception as e:
             logger.error(f"ElevenLabs TTS error: {e}")
+            STAGE_ERRORS.labels('tts_chunk').inc()
             return b""